@@ -1,5 +1,6 @@
 from django.contrib import admin
-from apps.botapp.models import BotUser
+from apps.botapp import outbox
+from apps.botapp.models import BotUser, OutboxMessage
 
 
 class BotUserAdmin(admin.ModelAdmin):
@@ -13,4 +14,24 @@ class BotUserAdmin(admin.ModelAdmin):
         return obj.full_name
     full_name.short_description = 'Full Name'
     
-admin.site.register(BotUser, BotUserAdmin)
\ No newline at end of file
+admin.site.register(BotUser, BotUserAdmin)
+
+
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ('id', 'chat_id', 'status', 'attempts', 'created_at', 'sent_at', 'latency', 'last_error')
+    list_filter = ('status',)
+    search_fields = ('chat_id', 'text')
+    readonly_fields = ('created_at', 'sent_at', 'attempts', 'last_error')
+    ordering = ('-created_at',)
+    actions = ['replay']
+
+    @admin.display(description='Latency (s)')
+    def latency(self, obj):
+        return f"{obj.latency:.1f}" if obj.latency is not None else '—'
+
+    @admin.action(description='Send selected failed messages again')
+    def replay(self, request, queryset):
+        count = outbox.replay(ids=list(queryset.values_list('id', flat=True)))
+        self.message_user(request, f"{count} message(s) queued again.")
+
+admin.site.register(OutboxMessage, OutboxMessageAdmin)
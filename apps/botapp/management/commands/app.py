@@ -4,9 +4,14 @@ from django.core.management.base import BaseCommand
 from bot import filters
 from bot import middlewares
 
-from bot.loader import dp
+from bot.loader import dp, send_queue
+from bot.utils.db_api.executor import shutdown_db_pool
+from bot.utils.month_rollover import start_month_rollover
 from bot.utils.notify_admins import on_startup_notify
+from bot.utils.outbox_worker import outbox_worker
+from bot.utils.search_index import start_search_index
 from bot.utils.set_bot_commands import set_default_commands
+from bot.utils.status_board import status_boards
 
 
 class Command(BaseCommand):
@@ -23,7 +28,7 @@ class Command(BaseCommand):
         self.stdout.write(self.style.SUCCESS('Starting Telegram bot...'))
         
         # Start the bot with polling
-        executor.start_polling(dp, on_startup=on_startup, skip_updates=False, fast=True)
+        executor.start_polling(dp, on_startup=on_startup, on_shutdown=on_shutdown, skip_updates=False, fast=True)
 
 
 async def on_startup(dispatcher):
@@ -31,5 +36,25 @@ async def on_startup(dispatcher):
     await dispatcher.bot.delete_webhook(drop_pending_updates=True)
     # Set up bot commands
     await set_default_commands(dispatcher)
+    # Bill active enrollments whenever a new month starts
+    start_month_rollover()
+    # Load the inline search index in the background and keep checking it
+    start_search_index()
+    # Deliver notifications written to the outbox (including those left by a previous run)
+    outbox_worker.start(send_queue)
+    # Bring group status boards up to date, then keep them so
+    status_boards.start(dispatcher.bot)
+    # Compute the finance dashboard before the first admin asks for it
+    from bot.handlers.admins.finance import warm_dashboard_cache
+    await warm_dashboard_cache()
     # Notify admins that bot has started
     await on_startup_notify(dispatcher)
+
+
+async def on_shutdown(dispatcher):
+    # Record the outbox batch in flight, apply pending board updates, deliver
+    # what is still queued, then close the DB pool's per-thread connections
+    await outbox_worker.stop()
+    await status_boards.close()
+    await send_queue.close()
+    shutdown_db_pool()
@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.dispatcher.filters import FilterNotPassed, check_filters
+from django.core.management.base import BaseCommand, CommandError
+
+from bot.utils.callback_router import CallbackRouter
+
+
+async def _noop(*args, **kwargs):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the cost of matching one callback among N handlers: aiogram\'s linear '
+        'filter walk (startswith + regexp filters) against CallbackRouter.candidates().'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--handlers', type=int, nargs='+', default=[10, 50, 200, 1000],
+                            help='Handler counts (default 10 50 200 1000)')
+        parser.add_argument('--repeat', type=int, default=2000, help='Lookups per measurement (default 2000)')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1 or any(n < 1 for n in options['handlers']):
+            raise CommandError('--handlers and --repeat must be positive.')
+        asyncio.run(self._run(options['handlers'], options['repeat']))
+
+    async def _run(self, counts, repeat):
+        # The token only has to look valid; nothing is sent and no HTTP session is opened
+        bot = Bot('123456:bench')
+        for n in counts:
+            dp = Dispatcher(bot)
+            router = CallbackRouter(admin_check=None)
+            for i in range(n):
+                prefix = f'adm:sec{i}:item:'
+                dp.register_callback_query_handler(
+                    _noop, lambda c, prefix=prefix: c.data.startswith(prefix), regexp=rf'^adm:sec{i}:item:\d+:p:\d+$',
+                )
+                router.add(f'adm:sec{i}:item:{{id:int}}:p:{{page:int}}', _noop)
+            # The last handler matches, as for a callback near the end of the registration order
+            call = types.CallbackQuery(id='1', data=f'adm:sec{n - 1}:item:42:p:3')
+            handlers = dp.callback_query_handlers.handlers
+
+            started = time.perf_counter()
+            for _ in range(repeat):
+                for handler in handlers:
+                    try:
+                        await check_filters(handler.filters, (call,))
+                        break
+                    except FilterNotPassed:
+                        continue
+            linear = (time.perf_counter() - started) / repeat * 1e6
+
+            started = time.perf_counter()
+            for _ in range(repeat):
+                router.candidates(call.data)
+            trie = (time.perf_counter() - started) / repeat * 1e6
+
+            self.stdout.write(f'{n:5d} handlers: linear filters {linear:8.1f} us, trie {trie:5.1f} us')
@@ -0,0 +1,111 @@
+import asyncio
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.backends.signals import connection_created
+
+from apps.botapp.models import BotUser
+from main.models import Student
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure per-call latency of the bot\'s single-query DB calls through Django\'s async ORM '
+        '(aget/aexists/async iteration) and through the bot\'s DB pool (db_async): p50/p95 per call. Read-only.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=1000, help='Calls per operation and path (default 1000)')
+        parser.add_argument('--concurrency', type=int, default=1, help='Calls in flight at once (default 1)')
+        parser.add_argument('--workers', type=int, default=0, help='DB pool size (default DB_WORKERS)')
+        parser.add_argument('--latency', type=float, default=0, help='Extra milliseconds per query, as for a DB on another host')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        # The pool's config (bot.data.config) needs the bot's .env; imported here so --help works without it
+        from bot.utils.db_api import executor
+
+        ids = list(Student.objects.values_list('id', flat=True))
+        if not ids:
+            raise CommandError('No students in the database.')
+        if options['calls'] < 1 or options['concurrency'] < 1 or options['workers'] < 0:
+            raise CommandError('--calls and --concurrency must be positive, --workers not negative.')
+        rng = random.Random(options['seed'])
+        sample = [rng.choice(ids) for _ in range(options['calls'])]
+        db_async = executor.db_async
+        latency = options['latency'] / 1000
+
+        def delayed(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def add_latency(sender, connection, **kwargs):
+            # The async ORM's thread and each pool worker open their own connection
+            if delayed not in connection.execute_wrappers:
+                connection.execute_wrappers.append(delayed)
+
+        if latency:
+            connection_created.connect(add_latency, weak=False, dispatch_uid='bench_db_calls')
+
+        async def orm_student(sid):
+            return await Student.objects.aget(id=sid)
+
+        async def pool_student(sid):
+            return await db_async(Student.objects.get)(id=sid)
+
+        async def orm_exists(sid):
+            return await BotUser.objects.filter(user_id=str(sid)).aexists()
+
+        async def pool_exists(sid):
+            return await db_async(BotUser.objects.filter(user_id=str(sid)).exists)()
+
+        async def orm_admins(sid):
+            return [u async for u in BotUser.objects.filter(is_admin=True).values_list('user_id', flat=True)]
+
+        async def pool_admins(sid):
+            return await db_async(lambda: list(BotUser.objects.filter(is_admin=True).values_list('user_id', flat=True)))()
+
+        # What the facade and handlers call (DB.user_exists, get_admins_list, accept_payment's lookups)
+        operations = {
+            'get student by id': (orm_student, pool_student),
+            'user exists': (orm_exists, pool_exists),
+            'admin id list': (orm_admins, pool_admins),
+        }
+
+        async def timed(call, sid, timings):
+            started = time.perf_counter()
+            await call(sid)
+            timings.append((time.perf_counter() - started) * 1_000_000)
+
+        async def run(call) -> list:
+            await asyncio.gather(*(call(sid) for sid in sample[:20]))  # connections, caches
+            timings = []
+            step = options['concurrency']
+            for i in range(0, len(sample), step):
+                await asyncio.gather(*(timed(call, sid, timings) for sid in sample[i:i + step]))
+            return timings
+
+        async def main():
+            self.stdout.write(
+                f'{len(sample)} calls per path, {options["concurrency"]} in flight, {len(ids)} students, '
+                f'+{options["latency"]:g} ms per query'
+            )
+            try:
+                if options['workers']:
+                    executor.set_db_workers(options['workers'])
+                for name, (orm, pool) in operations.items():
+                    self.stdout.write(f'  {name}')
+                    self.stdout.write(f'    async ORM:  {self._percentiles(await run(orm))}')
+                    self.stdout.write(f'    DB pool:    {self._percentiles(await run(pool))}')
+            finally:
+                executor.shutdown_db_pool()
+
+        asyncio.run(main())
+
+    @staticmethod
+    def _percentiles(timings: list) -> str:
+        timings = sorted(timings)
+        p95 = timings[min(int(len(timings) * 0.95), len(timings) - 1)]
+        return f'p50 {statistics.median(timings):7.0f} us   p95 {p95:7.0f} us'
@@ -0,0 +1,65 @@
+import asyncio
+import random
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from main.models import Student
+from main.profiles import student_profile
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure concurrent student card loads (main.profiles.student_profile) through '
+        'sync_to_async and through the bot\'s DB pool at several sizes. Read-only.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--updates', type=int, default=400, help='Concurrent card loads per run (default 400)')
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8], help='Pool sizes (default 1 4 8)')
+        parser.add_argument('--latency', type=float, default=0, help='Extra milliseconds per query, as for a DB on another host')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        # The pool's config (bot.data.config) needs the bot's .env; imported here so --help works without it
+        from bot.utils.db_api import executor
+
+        ids = list(Student.objects.values_list('id', flat=True))
+        if not ids:
+            raise CommandError('No students in the database.')
+        if options['updates'] < 1 or any(w < 1 for w in options['workers']):
+            raise CommandError('--updates and --workers must be positive.')
+        rng = random.Random(options['seed'])
+        sample = [rng.choice(ids) for _ in range(options['updates'])]
+        latency = options['latency'] / 1000
+
+        def delayed(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def load(student_id):
+            if not latency:
+                return student_profile(student_id)
+            with connection.execute_wrapper(delayed):
+                return student_profile(student_id)
+
+        async def run(wrap) -> float:
+            await asyncio.gather(*(wrap(load)(sid) for sid in sample[:20]))  # connections, caches
+            started = time.perf_counter()
+            await asyncio.gather(*(wrap(load)(sid) for sid in sample))
+            return len(sample) / (time.perf_counter() - started)
+
+        async def main():
+            self.stdout.write(f'{len(sample)} card loads, {len(ids)} students, +{options["latency"]:g} ms per query')
+            self.stdout.write(f'  sync_to_async: {await run(sync_to_async):7.0f} loads/s')
+            try:
+                for workers in options['workers']:
+                    executor.set_db_workers(workers)
+                    rate = await run(executor.db_async)
+                    self.stdout.write(f'  pool, {workers} worker(s): {rate:7.0f} loads/s')
+            finally:
+                executor.shutdown_db_pool()
+
+        asyncio.run(main())
@@ -0,0 +1,25 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.botapp import outbox
+
+
+class Command(BaseCommand):
+    help = 'Queue failed outbox messages for delivery again (the running bot picks them up)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help='Message ids (default: every failed message)')
+        parser.add_argument('--since', help='Only messages created on or after this date (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = timezone.make_aware(datetime.strptime(options['since'], '%Y-%m-%d'))
+            except ValueError:
+                raise CommandError('--since must look like YYYY-MM-DD')
+
+        count = outbox.replay(ids=options['ids'] or None, since=since)
+        self.stdout.write(self.style.SUCCESS(f'Queued {count} message(s) again.'))
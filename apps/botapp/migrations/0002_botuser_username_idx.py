@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-18 01:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('botapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='botuser',
+            index=models.Index(fields=['username'], name='botuser_username_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 02:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('botapp', '0003_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxmessage',
+            name='digest',
+            field=models.CharField(blank=True, default='', max_length=500),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 
 class BotUser(models.Model):
@@ -30,3 +31,61 @@ class BotUser(models.Model):
         verbose_name = "Bot User"
         verbose_name_plural = "Bot Users"
         ordering = ["-created_at"]
+        indexes = [
+            # Payments are filtered by the creator's username
+            models.Index(fields=["username"], name="botuser_username_idx"),
+        ]
+
+
+class OutboxMessage(models.Model):
+    """A Telegram message written in the same transaction as the change it announces.
+
+    The bot's outbox worker (bot.utils.outbox_worker) delivers pending rows;
+    see apps.botapp.outbox.
+    """
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (SENT, "Sent"),
+        (FAILED, "Failed"),
+    ]
+
+    chat_id = models.CharField(max_length=100)
+    text = models.TextField()
+    # Extra send_message arguments (disable_notification, ...)
+    options = models.JSONField(default=dict, blank=True)
+    # Line standing for this message in a digest; messages with one are merged per chat
+    digest = models.CharField(max_length=500, blank=True, default="")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Not picked up before this time: retry back-off, or the lease of a worker sending it
+    available_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default="")
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.chat_id}: {self.text[:40]}"
+
+    @property
+    def latency(self):
+        """Seconds from creation to delivery."""
+        if self.sent_at is None:
+            return None
+        return (self.sent_at - self.created_at).total_seconds()
+
+    class Meta:
+        verbose_name = "Outbox Message"
+        verbose_name_plural = "Outbox Messages"
+        ordering = ["-created_at"]
+        indexes = [
+            # The worker's claim query; delivered rows stay out of the index
+            models.Index(
+                fields=["available_at", "id"], name="outbox_pending_idx",
+                condition=models.Q(status="pending"),
+            ),
+            models.Index(fields=["status", "created_at"], name="outbox_status_idx"),
+        ]
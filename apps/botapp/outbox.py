@@ -0,0 +1,129 @@
+"""Transactional outbox for Telegram notifications.
+
+`enqueue()` is called inside the transaction that creates the payment (or
+whatever the message announces), so the message exists exactly when the
+change does. The bot's worker claims pending rows with `claim()` (SELECT ...
+FOR UPDATE SKIP LOCKED, so several bot processes never claim the same row),
+sends them and records the outcome with `mark_sent()` / `mark_failed()`.
+
+Claiming moves `available_at` forward by a lease instead of holding the row
+lock while Telegram is called; a worker that dies mid-batch leaves its rows
+to be picked up again when the lease runs out. Delivery is therefore at
+least once.
+
+Messages added with `enqueue_digest()` wait a little for others to the same
+chat, and those that fall due together are sent as one digest message.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+
+from .models import OutboxMessage
+
+# How long a claimed row is left to the worker that claimed it
+LEASE = timedelta(minutes=10)
+MAX_ATTEMPTS = 5
+# Retry back-off: 1, 2, 4, ... minutes, at most an hour
+BACKOFF_BASE = 60
+BACKOFF_MAX = 60 * 60
+
+
+def enqueue(chat_id, text: str, **options) -> OutboxMessage:
+    """Add a message; call it inside the transaction of the change it announces."""
+    return OutboxMessage.objects.create(chat_id=str(chat_id).strip(), text=text, options=options)
+
+
+def enqueue_digest(chat_id, text: str, line: str, window: float, max_delay: float, max_batch: int, **options) -> OutboxMessage:
+    """Add a message that may go out merged with others to the chat, as `line` of a digest.
+
+    The chat's waiting messages are held until `window` seconds pass without a
+    new one, but no longer than `max_delay` seconds after the first; the
+    `max_batch`-th releases them at once. `text` is sent when no other message
+    joins it.
+    """
+    chat_id = str(chat_id).strip()
+    now = timezone.now()
+    # Retries (attempts > 0) and claimed rows are not held back again
+    waiting = OutboxMessage.objects.filter(
+        chat_id=chat_id, status=OutboxMessage.PENDING, attempts=0, available_at__gt=now,
+    ).exclude(digest="")
+    held = waiting.aggregate(first=Min("created_at"), count=Count("id"))
+    due = now + timedelta(seconds=window)
+    if held["count"]:
+        due = min(due, held["first"] + timedelta(seconds=max_delay))
+    if held["count"] + 1 >= max_batch:
+        due = now
+    if held["count"]:
+        waiting.update(available_at=due)
+    return OutboxMessage.objects.create(chat_id=chat_id, text=text, digest=line, options=options, available_at=due)
+
+
+def release_digests() -> int:
+    """Make every message still waiting for its digest due now (e.g. at shutdown)."""
+    return OutboxMessage.objects.filter(
+        status=OutboxMessage.PENDING, attempts=0, available_at__gt=timezone.now(),
+    ).exclude(digest="").update(available_at=timezone.now())
+
+
+@transaction.atomic
+def claim(limit: int) -> list:
+    """Up to `limit` due messages, oldest first, leased to the caller."""
+    now = timezone.now()
+    rows = list(
+        OutboxMessage.objects.select_for_update(skip_locked=True)
+        .filter(status=OutboxMessage.PENDING, available_at__lte=now)
+        .order_by("available_at", "id")[:limit]
+    )
+    if rows:
+        OutboxMessage.objects.filter(id__in=[m.id for m in rows]).update(
+            available_at=now + LEASE, attempts=F("attempts") + 1,
+        )
+        for m in rows:
+            m.attempts += 1
+    return rows
+
+
+def mark_sent(sent: dict):
+    """Record deliveries, given as {message id: time sent}."""
+    OutboxMessage.objects.bulk_update(
+        [OutboxMessage(id=i, status=OutboxMessage.SENT, sent_at=t, last_error="") for i, t in sent.items()],
+        ["status", "sent_at", "last_error"],
+    )
+
+
+def mark_failed(message: OutboxMessage, error: str, permanent: bool = False) -> bool:
+    """Schedule a retry with back-off, or give up; returns True when the message is given up."""
+    give_up = permanent or message.attempts >= MAX_ATTEMPTS
+    delay = min(BACKOFF_BASE * 2 ** max(message.attempts - 1, 0), BACKOFF_MAX)
+    OutboxMessage.objects.filter(id=message.id).update(
+        status=OutboxMessage.FAILED if give_up else OutboxMessage.PENDING,
+        available_at=timezone.now() + timedelta(seconds=delay),
+        last_error=error[:1000],
+    )
+    return give_up
+
+
+def replay(ids=None, since=None) -> int:
+    """Put failed messages (all, or the given ids / those created since `since`) back in the queue."""
+    qs = OutboxMessage.objects.filter(status=OutboxMessage.FAILED)
+    if ids is not None:
+        qs = qs.filter(id__in=ids)
+    if since is not None:
+        qs = qs.filter(created_at__gte=since)
+    return qs.update(status=OutboxMessage.PENDING, attempts=0, available_at=timezone.now(), last_error="")
+
+
+def purge_sent(older_than: timedelta) -> int:
+    """Delete delivered messages older than `older_than`; returns the number deleted."""
+    cutoff = timezone.now() - older_than
+    # created_at bounds sent_at from below and is indexed with the status
+    deleted, _ = OutboxMessage.objects.filter(
+        status=OutboxMessage.SENT, created_at__lt=cutoff, sent_at__lt=cutoff,
+    ).delete()
+    return deleted
+
+
+def pending_count() -> int:
+    return OutboxMessage.objects.filter(status=OutboxMessage.PENDING).count()
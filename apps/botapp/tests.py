@@ -1,3 +1,351 @@
-from django.test import TestCase
+import asyncio
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from aiogram import types
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from bot.utils import search_index
+from bot.utils.cache import LRUCache, SingleFlightCache, TTLCache
+from bot.utils.callback_router import CallbackRouter
+from bot.utils.search_index import StudentDoc, StudentIndex, _Tables
+from main.models import Student
+from main.translit import normalize_name, normalize_phone
+from . import outbox
+from .models import OutboxMessage
+
+
+class OutboxTests(TestCase):
+    def test_enqueue_follows_the_transaction(self):
+        try:
+            with transaction.atomic():
+                outbox.enqueue('-100', 'rolled back')
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        with transaction.atomic():
+            outbox.enqueue(' -100 ', 'kept', disable_notification=True)
+        message = OutboxMessage.objects.get()
+        self.assertEqual((message.chat_id, message.text, message.options), ('-100', 'kept', {'disable_notification': True}))
+
+    def test_claim_leases_rows(self):
+        for i in range(5):
+            outbox.enqueue('-100', f'm{i}')
+        first = outbox.claim(3)
+        self.assertEqual([m.text for m in first], ['m0', 'm1', 'm2'])
+        self.assertEqual({m.attempts for m in first}, {1})
+        # Claimed rows are not handed out again while leased
+        self.assertEqual([m.text for m in outbox.claim(10)], ['m3', 'm4'])
+        self.assertEqual(outbox.claim(10), [])
+
+        OutboxMessage.objects.filter(text='m0').update(available_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual([(m.text, m.attempts) for m in outbox.claim(10)], [('m0', 2)])
+
+    def test_sent_and_failed(self):
+        sent, retried, dead = (outbox.enqueue('-100', t) for t in ('sent', 'retried', 'dead'))
+        claimed = {m.text: m for m in outbox.claim(10)}
+        now = timezone.now()
+        outbox.mark_sent({sent.id: now})
+        self.assertFalse(outbox.mark_failed(claimed['retried'], 'NetworkError: timeout'))
+        self.assertTrue(outbox.mark_failed(claimed['dead'], 'ChatNotFound: chat not found', permanent=True))
+
+        sent.refresh_from_db()
+        self.assertEqual((sent.status, sent.sent_at), (OutboxMessage.SENT, now))
+        retried.refresh_from_db()
+        self.assertEqual(retried.status, OutboxMessage.PENDING)
+        self.assertGreater(retried.available_at, now + timedelta(seconds=50))
+        self.assertEqual(outbox.pending_count(), 1)
+
+        # Retries stop after MAX_ATTEMPTS
+        retried.attempts = outbox.MAX_ATTEMPTS
+        self.assertTrue(outbox.mark_failed(retried, 'NetworkError: timeout'))
+
+        self.assertEqual(outbox.replay(ids=[dead.id]), 1)
+        dead.refresh_from_db()
+        self.assertEqual((dead.status, dead.attempts, dead.last_error), (OutboxMessage.PENDING, 0, ''))
+        self.assertEqual([m.text for m in outbox.claim(10)], ['dead'])
+        self.assertEqual(outbox.replay(), 1)
+
+    def test_purge_keeps_recent_and_undelivered(self):
+        old, recent, pending = (outbox.enqueue('-100', t) for t in ('old', 'recent', 'pending'))
+        long_ago = timezone.now() - timedelta(days=40)
+        OutboxMessage.objects.filter(id=old.id).update(created_at=long_ago)
+        outbox.mark_sent({old.id: long_ago, recent.id: timezone.now()})
+        self.assertEqual(outbox.purge_sent(timedelta(days=30)), 1)
+        self.assertEqual(set(OutboxMessage.objects.values_list('text', flat=True)), {'recent', 'pending'})
+
+    def _digest(self, chat, text, **kw):
+        kw = {'window': 20, 'max_delay': 120, 'max_batch': 3, **kw}
+        return outbox.enqueue_digest(chat, text, f'• {text}', **kw)
+
+    def test_digest_messages_wait_for_each_other(self):
+        first = self._digest('-100', 'a')
+        self.assertEqual(outbox.claim(10), [])
+        second = self._digest('-100', 'b')
+        other = self._digest('-200', 'c')
+        first.refresh_from_db()
+        # A new message moves the chat's waiting ones to its own due time
+        self.assertEqual(first.available_at, second.available_at)
+        self.assertGreater(second.available_at, timezone.now() + timedelta(seconds=15))
+
+        # ... but not past max_delay after the first
+        OutboxMessage.objects.filter(id=first.id).update(created_at=timezone.now() - timedelta(seconds=115))
+        third = self._digest('-100', 'd', max_batch=10)
+        self.assertLess(third.available_at, timezone.now() + timedelta(seconds=6))
+        other.refresh_from_db()
+        self.assertGreater(other.available_at, timezone.now() + timedelta(seconds=15))
+
+    def test_digest_batch_and_release(self):
+        for text in ('a', 'b', 'c'):
+            self._digest('-100', text)
+        # The max_batch-th message makes the batch due at once
+        self.assertEqual([m.digest for m in outbox.claim(10)], ['• a', '• b', '• c'])
+
+        self._digest('-100', 'd')
+        outbox.enqueue('-100', 'plain')
+        self.assertEqual(outbox.release_digests(), 1)
+        self.assertEqual(sorted(m.text for m in outbox.claim(10)), ['d', 'plain'])
+
+
+def _doc(sid, name, phone=None):
+    return StudentDoc(sid, name, phone, normalize_name(name), normalize_phone(phone))
+
+
+class SearchTablesTests(SimpleTestCase):
+    def setUp(self):
+        self.index = StudentIndex()
+        self.index._tables = _Tables.build([
+            _doc(1, 'Karimov Aziz', '+998 90 123 45 67'),
+            _doc(2, 'Karimova Dilnoza', '+998 91 555 00 11'),
+            _doc(3, 'Xasanov Shoxrux', '901230000'),
+            _doc(4, 'Тошматов Ғайрат'),
+        ])
+
+    def ids(self, query):
+        return [doc.id for doc in self.index.search(query)]
+
+    def assertSorted(self):
+        tables = self.index._tables
+        self.assertEqual(list(zip(tables.words, tables.word_slots)), sorted(zip(tables.words, tables.word_slots)))
+        self.assertEqual(list(zip(tables.phones, tables.phone_slots)), sorted(zip(tables.phones, tables.phone_slots)))
+
+    def test_prefix(self):
+        self.assertEqual(self.ids('kar'), [1, 2])
+        self.assertEqual(self.ids('karimov d'), [2])
+        self.assertEqual(self.ids('toshm'), [4])
+        self.assertEqual(self.ids('Ғайрат'), [4])
+
+    def test_phone(self):
+        self.assertEqual(self.ids('90 123'), [3, 1])
+        self.assertEqual(self.ids('+998 90 1234'), [1])
+        self.assertEqual(self.ids('2'), [2])  # student id
+
+    def test_typo(self):
+        self.assertEqual(self.ids('hasanof'), [3])
+        self.assertEqual(self.ids('karimof'), [1, 2])
+
+    def test_rename_keeps_keys_sorted(self):
+        self.index.upsert(_doc(1, 'Aliyev Aziz', '+998 93 000 00 00'))
+        self.assertEqual(self.ids('kar'), [2])
+        self.assertEqual(self.ids('aliyev'), [1])
+        self.assertEqual(self.ids('93 000'), [1])
+        self.assertEqual(self.ids('90 123'), [3])
+        self.assertSorted()
+
+    def test_delete_drops_unused_words(self):
+        self.index.remove(3)
+        self.assertEqual(self.ids('xasanov'), [])
+        self.assertEqual(self.ids('hasanof'), [])
+        self.assertEqual(self.ids('90 123'), [1])
+        self.assertEqual(self.index.stats()['dead_slots'], 1)
+        self.assertSorted()
+
+
+class StudentIndexCheckTests(TestCase):
+    def setUp(self):
+        self.students = [
+            Student.objects.create(full_name=f'Oquvchi {i:02d}', phone_number=f'9000000{i:02d}') for i in range(10)
+        ]
+        self.index = StudentIndex()
+        self.index.load()
+
+    def ids(self, query):
+        return [doc.id for doc in self.index.search(query)]
+
+    def test_check_fixes_missed_writes(self):
+        first, second = self.students[:2]
+        # Writes that bypass signals (on_commit never runs inside a test case either)
+        Student.objects.filter(id=first.id).update(full_name='Renamed', search_name='renamed')
+        Student.objects.filter(id=second.id).delete()
+        added = Student.objects.create(full_name='Yangi Oquvchi')
+
+        self.assertEqual(self.index.check(), 3)
+        self.assertEqual(self.ids('renamed'), [first.id])
+        self.assertNotIn(second.id, self.ids('oquvchi'))
+        self.assertIn(added.id, self.ids('yangi'))
+        self.assertEqual(self.index.check(), 0)
+
+    def test_compaction_rebuilds_and_keeps_concurrent_changes(self):
+        tables = self.index._tables
+        tables.dead = 10 ** 6
+        target = self.students[3]
+        Student.objects.filter(id=target.id).update(full_name='Stale Name', search_name='stale name')
+
+        # A signal saving the student while the check reads the database wins over what it read
+        fetch_docs = search_index.fetch_docs
+
+        def fetch_during_save(*args):
+            docs = fetch_docs(*args)
+            self.index.upsert(_doc(target.id, 'Fresh Name'))
+            return docs
+
+        with mock.patch.object(search_index, 'fetch_docs', fetch_during_save):
+            self.index.check()
+        self.assertIsNot(self.index._tables, tables)
+        self.assertEqual(self.index.stats()['dead_slots'], 1)  # the replayed student's first slot
+        self.assertEqual(self.ids('fresh'), [target.id])
+        self.assertEqual(self.ids('stale'), [])
+        self.assertEqual(len(self.ids('oquvchi')), 9)
+
+
+class CallbackRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.admin_checks = []
+
+        async def admin_check(user_id):
+            self.admin_checks.append(user_id)
+            return user_id == 1
+
+        self.router = CallbackRouter(admin_check)
+
+    def call(self, data, user_id=1):
+        return types.CallbackQuery(**{'id': '1', 'data': data, 'from': {'id': user_id, 'is_bot': False, 'first_name': 'a'}})
+
+    def matches(self, data):
+        return [(route.pattern, params) for route, params in self.router.candidates(data)]
+
+    def test_literal_segments_win_over_parameters(self):
+        self.router.add('adm:student:{sid}', 'detail')
+        self.router.add('adm:student:edit', 'edit')
+        self.router.add('adm:student:{sid:int}', 'detail_int')
+        self.assertEqual(self.matches('adm:student:edit'), [('adm:student:edit', {}), ('adm:student:{sid}', {'sid': 'edit'})])
+        # Parameters keep their registration order
+        self.assertEqual(
+            self.matches('adm:student:7'),
+            [('adm:student:{sid}', {'sid': '7'}), ('adm:student:{sid:int}', {'sid': 7})],
+        )
+
+    def test_int_parameters_are_converted_or_do_not_match(self):
+        self.router.add('adm:group:{group_id:int}:debtors:p:{page:int}', 'debtors')
+        self.assertEqual(self.matches('adm:group:12:debtors:p:3'), [
+            ('adm:group:{group_id:int}:debtors:p:{page:int}', {'group_id': 12, 'page': 3}),
+        ])
+        for data in ('adm:group:x:debtors:p:3', 'adm:group:12:debtors:p:', 'adm:group:12:debtors:p:3:4', 'adm:group:12'):
+            self.assertEqual(self.matches(data), [], data)
+
+    def test_colons_inside_braces_stay_in_one_segment(self):
+        self.router.add('bulkpay:t:{enrollment_id:int}', 'toggle')
+        self.assertEqual(self.matches('bulkpay:t:5'), [('bulkpay:t:{enrollment_id:int}', {'enrollment_id': 5})])
+
+    async def test_resolve_skips_routes_for_other_states(self):
+        self.router.add('imp:ok', 'confirm', state='ImportPayments:confirm')
+        self.router.add('imp:{action}', 'fallback')
+        state = mock.Mock(get_state=mock.AsyncMock(return_value=None))
+        route, params = await self.router.resolve(self.call('imp:ok'), state)
+        self.assertEqual((route.handler, params), ('fallback', {'action': 'ok'}))
+        state.get_state.return_value = 'ImportPayments:confirm'
+        route, _ = await self.router.resolve(self.call('imp:ok'), state)
+        self.assertEqual(route.handler, 'confirm')
+
+    async def test_admin_check_runs_once_and_only_on_a_match(self):
+        self.router.add('adm:{a}', 'one')
+        self.router.add('adm:{b}', 'two')
+        self.router.add('pub:{a}', 'public', admin=False)
+        state = mock.Mock(get_state=mock.AsyncMock(return_value=None))
+        self.assertIsNone(await self.router.resolve(self.call('other:1', user_id=2), state))
+        self.assertIsNone(await self.router.resolve(self.call('adm:1', user_id=2), state))
+        self.assertEqual(self.admin_checks, [2])
+        route, _ = await self.router.resolve(self.call('pub:1', user_id=2), state)
+        self.assertEqual(route.handler, 'public')
+        self.assertEqual(self.admin_checks, [2])
+        state.get_state.assert_not_called()
+
+
+class SingleFlightCacheTests(SimpleTestCase):
+    async def test_waiter_recomputes_when_owner_is_cancelled(self):
+        cache = SingleFlightCache()
+        started, calls = asyncio.Event(), []
+
+        async def compute():
+            calls.append(1)
+            started.set()
+            await asyncio.sleep(0 if len(calls) > 1 else 10)
+            return len(calls)
+
+        owner = asyncio.create_task(cache.get('k', compute))
+        await started.wait()
+        waiter = asyncio.create_task(cache.get('k', compute))
+        await asyncio.sleep(0)
+        owner.cancel()
+        self.assertEqual(await waiter, 2)
+        self.assertTrue(owner.cancelled())
+        self.assertEqual(await cache.get('k', compute), 2)
+
+    async def test_waiter_gets_the_owners_exception(self):
+        cache = SingleFlightCache()
+        release = asyncio.Event()
+
+        async def compute():
+            await release.wait()
+            raise ValueError('db down')
+
+        owner = asyncio.create_task(cache.get('k', compute))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get('k', compute))
+        await asyncio.sleep(0)
+        release.set()
+        for task in (owner, waiter):
+            with self.assertRaisesMessage(ValueError, 'db down'):
+                await task
+
+
+class TTLCacheTests(SimpleTestCase):
+    def test_set_purges_expired_keys(self):
+        with mock.patch('bot.utils.cache.time.monotonic', return_value=1000.0):
+            cache = TTLCache(ttl=60)
+            for user_id in range(100):
+                cache.set(user_id, True)
+        with mock.patch('bot.utils.cache.time.monotonic', return_value=1061.0):
+            self.assertIsNone(cache.get(1))
+            cache.set('fresh', True)
+            self.assertEqual(len(cache), 1)
+            self.assertTrue(cache.get('fresh'))
+
+
+class LRUCacheTests(SimpleTestCase):
+    def test_eviction_order(self):
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+    def test_invalidate_during_get(self):
+        cache = LRUCache(maxsize=10, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+
+        # Another thread invalidating between the lookup and the reordering
+        class Racing(type(cache._values)):
+            def get(self, key, default=None):
+                entry = super().get(key, default)
+                cache.invalidate(key)
+                cache.invalidate()
+                return entry
+
+        cache._values = Racing(cache._values)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
@@ -8,4 +8,22 @@ env.read_env()
 BOT_TOKEN = env.str("BOT_TOKEN")  # Bot token
 ADMINS = env.list("ADMINS")  # adminlar ro'yxati
 FINANCE_PASSWORD = env.str("FINANCE_PASSWORD", default="")  # Moliya bo'limi paroli
-
+FINANCE_CACHE_TTL = env.int("FINANCE_CACHE_TTL", default=300)  # Moliya paneli keshi muddati (soniya)
+DB_WORKERS = env.int("DB_WORKERS", default=4)  # ORM uchun oqimlar soni (har biri alohida DB ulanishi)
+ADMIN_CACHE_TTL = env.int("ADMIN_CACHE_TTL", default=60)  # Admin huquqi keshi muddati (soniya)
+SEARCH_INDEX_MAX_STUDENTS = env.int("SEARCH_INDEX_MAX_STUDENTS", default=200_000)  # Xotiradagi qidiruv indeksi chegarasi (o'quvchilar soni)
+SEARCH_INDEX_CHECK_INTERVAL = env.int("SEARCH_INDEX_CHECK_INTERVAL", default=600)  # Indeksni DB bilan solishtirish oralig'i (soniya)
+INLINE_CACHE_TTL = env.int("INLINE_CACHE_TTL", default=30)  # Inline qidiruv natijalari keshi muddati (soniya)
+INLINE_CACHE_SIZE = env.int("INLINE_CACHE_SIZE", default=64)  # Har bir admin uchun keshlangan inline so'rovlar soni
+SEND_RATE = env.int("SEND_RATE", default=30)  # Telegramga yuborish tezligi, jami (xabar/soniya)
+SEND_GROUP_RATE = env.int("SEND_GROUP_RATE", default=20)  # Bitta guruhga yuborish tezligi (xabar/daqiqa)
+SEND_QUEUE_SIZE = env.int("SEND_QUEUE_SIZE", default=10_000)  # Yuborish navbatidagi xabarlar chegarasi
+SEND_WORKERS = env.int("SEND_WORKERS", default=8)  # Navbatdan bir vaqtda yuboruvchi vazifalar soni
+OUTBOX_BATCH_SIZE = env.int("OUTBOX_BATCH_SIZE", default=50)  # Outboxdan bir marta olinadigan xabarlar soni
+OUTBOX_POLL_INTERVAL = env.int("OUTBOX_POLL_INTERVAL", default=5)  # Outboxni tekshirish oralig'i (soniya)
+OUTBOX_KEEP_DAYS = env.int("OUTBOX_KEEP_DAYS", default=30)  # Yuborilgan xabarlar saqlanadigan muddat (kun)
+BOARD_DEBOUNCE = env.int("BOARD_DEBOUNCE", default=60)  # Guruh holat taxtasini yangilashdan oldingi kutish (soniya)
+BOARD_REFRESH_INTERVAL = env.int("BOARD_REFRESH_INTERVAL", default=600)  # Holat taxtalarini admin saytidagi o'zgarishlar uchun tekshirish oralig'i (soniya)
+DIGEST_WINDOW = env.int("DIGEST_WINDOW", default=20)  # Guruhga to'lov xabarlarini jamlab yuborishdan oldingi kutish (soniya)
+DIGEST_MAX_DELAY = env.int("DIGEST_MAX_DELAY", default=120)  # Jamlangan xabar birinchi to'lovdan keyin eng ko'pi bilan shuncha kutadi (soniya)
+DIGEST_MAX_BATCH = env.int("DIGEST_MAX_BATCH", default=25)  # Bitta jamlangan xabardagi to'lovlar soni
@@ -1,5 +1,6 @@
 from aiogram import types
 from aiogram.dispatcher.filters import BoundFilter
+from aiogram.dispatcher.handler import ctx_data
 from bot.loader import db
 
 
@@ -23,4 +24,12 @@ class IsAdmin(BoundFilter):
         if user is None:
             return False
 
-        return await db.is_admin(user.id)
\ No newline at end of file
+        # Every candidate handler lists IsAdmin, so remember the answer for the
+        # rest of this update (ctx_data is a fresh dict per update and event type)
+        data = ctx_data.get(None)
+        if data is not None and data.get('_is_admin', (None,))[0] == user.id:
+            return data['_is_admin'][1]
+        result = await db.is_admin(user.id)
+        if data is not None:
+            data['_is_admin'] = (user.id, result)
+        return result
\ No newline at end of file
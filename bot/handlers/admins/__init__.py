@@ -5,4 +5,6 @@ from . import students
 from . import payments
 from . import finance
 from . import accept_payment
+from . import bulk_payment
+from . import import_payments
 from . import debug
\ No newline at end of file
@@ -2,12 +2,19 @@ from aiogram import types
 from aiogram.dispatcher import FSMContext
 from datetime import datetime, date
 import calendar
+from html import escape
 
-from bot.loader import dp, db
+from apps.botapp import outbox
+from bot.data.config import DIGEST_MAX_BATCH, DIGEST_MAX_DELAY, DIGEST_WINDOW
+from bot.loader import dp, db, router
 from bot.filters import IsAdmin
 from bot.states.payments import AcceptPayment
-from asgiref.sync import sync_to_async
+from bot.utils.db_api.executor import db_async
+from bot.utils.outbox_worker import outbox_worker
+from bot.utils.status_board import status_boards
+from django.db import transaction
 from main.models import Student, Group, Enrollment, Payment
+from main.payments import parse_amount, parse_month
 from bot.keyboards.inline.admin import admin_main_menu_kb
 from .payments import build_payments_page
 
@@ -24,6 +31,11 @@ def month_label(d: date) -> str:
     return f"{uz_months[d.month-1]} {d.year}"
 
 
+def digest_line(student_name: str, group_title: str, month: date) -> str:
+    """A payment's line in a digest notification (see bot.utils.outbox_worker)."""
+    return f"• {escape(student_name, quote=False)} ({escape(group_title, quote=False)}) — {month_label(month)}"
+
+
 async def safe_edit_cb(call: types.CallbackQuery, text: str, kb: types.InlineKeyboardMarkup | None = None):
     if call.message:
         try:
@@ -81,7 +93,7 @@ async def cmd_new_student(message: types.Message, state: FSMContext):
     await create_student_start(_Call(message), state)
 
 
-@dp.callback_query_handler(IsAdmin(), text='adm:pay:start', state='*')
+@router.callback('adm:pay:start')
 async def pay_start(call: types.CallbackQuery, state: FSMContext):
     await state.finish()
     kb = types.InlineKeyboardMarkup(row_width=1)
@@ -91,10 +103,9 @@ async def pay_start(call: types.CallbackQuery, state: FSMContext):
     await call.answer()
 
 
-@dp.callback_query_handler(IsAdmin(), lambda c: c.data.startswith('pay:enr:'), state=AcceptPayment.select_student)
-async def pay_selected_enrollment(call: types.CallbackQuery, state: FSMContext):
-    enr_id = int(call.data.split(':')[-1])
-    enrollment = await sync_to_async(Enrollment.objects.select_related('student','group').get)(id=enr_id)
+@router.callback('pay:enr:{enr_id:int}', state=AcceptPayment.select_student)
+async def pay_selected_enrollment(call: types.CallbackQuery, state: FSMContext, enr_id: int):
+    enrollment = await db_async(Enrollment.objects.select_related('student','group').get)(id=enr_id)
     await state.update_data(student_id=enrollment.student_id, enrollment_id=enrollment.id)
 
     # add cancel reply keyboard for amount entry later
@@ -106,16 +117,15 @@ async def pay_selected_enrollment(call: types.CallbackQuery, state: FSMContext):
     await call.answer()
 
 
-@dp.callback_query_handler(IsAdmin(), lambda c: c.data.startswith('pay:st:'), state='*')
-async def pay_start_for_student(call: types.CallbackQuery, state: FSMContext):
+@router.callback('pay:st:{sid:int}')
+async def pay_start_for_student(call: types.CallbackQuery, state: FSMContext, sid: int):
     # Start or continue payment for a given student id from anywhere (including inline mode)
-    sid = int(call.data.split(':')[-1])
     await state.finish()
     await AcceptPayment.select_student.set()
-    student = await sync_to_async(Student.objects.get)(id=sid)
+    student = await db_async(Student.objects.get)(id=sid)
     await state.update_data(student_id=student.id)
 
-    groups = await sync_to_async(lambda: list(student.groups.all()))()
+    groups = await db_async(lambda: list(student.groups.all()))()
     if not groups:
         await safe_edit_cb(call, "Bu o'quvchi hech qanday guruhga yozilmagan.")
         await state.finish()
@@ -130,21 +140,20 @@ async def pay_start_for_student(call: types.CallbackQuery, state: FSMContext):
     await call.answer()
 
 
-@dp.callback_query_handler(IsAdmin(), lambda c: c.data.startswith('pay:enr:'), state='*')
-async def pay_selected_enrollment_any(call: types.CallbackQuery, state: FSMContext):
+@router.callback('pay:enr:{enr_id:int}')
+async def pay_selected_enrollment_any(call: types.CallbackQuery, state: FSMContext, enr_id: int):
     # Allow selecting enrollment from anywhere
     await state.finish()
     await AcceptPayment.select_student.set()
-    await pay_selected_enrollment(call, state)
+    await pay_selected_enrollment(call, state, enr_id)
 
 
-@dp.callback_query_handler(IsAdmin(), lambda c: c.data.startswith('pay:gr:'), state=AcceptPayment.select_group)
-async def pay_group_selected(call: types.CallbackQuery, state: FSMContext):
-    gid = int(call.data.split(':')[-1])
+@router.callback('pay:gr:{gid:int}', state=AcceptPayment.select_group)
+async def pay_group_selected(call: types.CallbackQuery, state: FSMContext, gid: int):
     data = await state.get_data()
     sid = int(data['student_id'])
 
-    enrollment = await sync_to_async(Enrollment.objects.get)(student_id=sid, group_id=gid)
+    enrollment = await db_async(Enrollment.objects.get)(student_id=sid, group_id=gid)
     await state.update_data(enrollment_id=enrollment.id)
 
     base = date.today().replace(day=1)
@@ -169,9 +178,8 @@ def build_months_kb(base: date) -> types.InlineKeyboardMarkup:
     return kb
 
 
-@dp.callback_query_handler(IsAdmin(), lambda c: c.data.startswith('pay:month:'), state=AcceptPayment.select_month)
-async def pay_month_selected(call: types.CallbackQuery, state: FSMContext):
-    val = call.data.split(':')[-1]
+@router.callback('pay:month:{val}', state=AcceptPayment.select_month)
+async def pay_month_selected(call: types.CallbackQuery, state: FSMContext, val: str):
     if val == 'custom':
         await safe_edit_cb(call, "Oy kiritish: YYYY-MM")
         await AcceptPayment.enter_custom_month.set()
@@ -201,7 +209,7 @@ async def pay_amount_cancel(message: types.Message, state: FSMContext):
 
 async def show_confirm_inline(call: types.CallbackQuery | None, message: types.Message | None, state: FSMContext):
     data = await state.get_data()
-    enrollment = await sync_to_async(Enrollment.objects.select_related('student', 'group').get)(id=data['enrollment_id'])
+    enrollment = await db_async(Enrollment.objects.select_related('student', 'group').get)(id=data['enrollment_id'])
     text = (
         "Tasdiqlaysizmi?\n"
         f"O'quvchi: {enrollment.student.full_name}\n"
@@ -222,9 +230,8 @@ async def show_confirm_inline(call: types.CallbackQuery | None, message: types.M
 
 @dp.message_handler(IsAdmin(), state=AcceptPayment.enter_custom_month)
 async def pay_enter_custom_month(message: types.Message, state: FSMContext):
-    try:
-        month = datetime.strptime(message.text.strip(), "%Y-%m").date().replace(day=1)
-    except Exception:
+    month = parse_month(message.text)
+    if month is None:
         await message.answer("❌ Format noto'g'ri. Qayta kiriting (YYYY-MM):")
         return
     await state.update_data(month=month)
@@ -234,12 +241,8 @@ async def pay_enter_custom_month(message: types.Message, state: FSMContext):
 
 @dp.message_handler(IsAdmin(), state=AcceptPayment.enter_amount)
 async def pay_enter_amount(message: types.Message, state: FSMContext):
-    text_val = message.text.replace(' ', '').replace(',', '')
-    try:
-        amount = int(text_val)
-        if amount <= 0:
-            raise ValueError
-    except Exception:
+    amount = parse_amount(message.text)
+    if amount is None:
         await message.answer("❌ Noto'g'ri summa. Qayta kiriting:")
         return
 
@@ -248,14 +251,14 @@ async def pay_enter_amount(message: types.Message, state: FSMContext):
     await AcceptPayment.confirm.set()
 
 
-@dp.callback_query_handler(IsAdmin(), text='pay:cancel', state=AcceptPayment.confirm)
+@router.callback('pay:cancel', state=AcceptPayment.confirm)
 async def pay_cancel_cb(call: types.CallbackQuery, state: FSMContext):
     await state.finish()
     await safe_edit_cb(call, "Bekor qilindi.")
     await call.answer()
 
 
-@dp.callback_query_handler(IsAdmin(), text='pay:confirm', state=AcceptPayment.confirm)
+@router.callback('pay:confirm', state=AcceptPayment.confirm)
 async def pay_confirm_cb(call: types.CallbackQuery, state: FSMContext):
     data = await state.get_data()
     enrollment_id = data['enrollment_id']
@@ -263,7 +266,7 @@ async def pay_confirm_cb(call: types.CallbackQuery, state: FSMContext):
     month = data['month']
 
     # Load enrollment with relations for notification
-    enrollment = await sync_to_async(Enrollment.objects.select_related('student', 'group').get)(id=enrollment_id)
+    enrollment = await db_async(Enrollment.objects.select_related('student', 'group').get)(id=enrollment_id)
 
     # Map telegram user to BotUser
     creator = None
@@ -272,39 +275,51 @@ async def pay_confirm_cb(call: types.CallbackQuery, state: FSMContext):
     except Exception:
         creator = None
 
-    await sync_to_async(Payment.objects.create)(
-        enrollment_id=enrollment_id,
-        amount=amount,
-        month=month,
-        created_by=creator if creator else None,
+    # Group chat notification, written with the payment (see apps.botapp.outbox);
+    # groups with a status board get the board updated instead
+    use_board = enrollment.group.status_board and bool((enrollment.group.chat_id or '').strip())
+    chat_id = '' if use_board else (enrollment.group.chat_id or enrollment.chat_id or '').strip()
+    student_name = str(enrollment.student.full_name).capitalize()
+    group_title = enrollment.group.title if enrollment.group else 'Belgilanmagan'
+    notify_text = (
+        "✅ To'lov qabul qilindi\n"
+        f"O'quvchi: {student_name}\n"
+        f"Guruh: {group_title}\n"
+        f"Oy: {month_label(month)}\n"
     )
 
-
+    def _create_payment():
+        # Rollup rows are updated by signals inside the same transaction
+        with transaction.atomic():
+            payment = Payment.objects.create(
+                enrollment_id=enrollment_id,
+                amount=amount,
+                month=month,
+                created_by=creator if creator else None,
+            )
+            if chat_id:
+                # A burst of payments to one chat is sent as a single digest
+                outbox.enqueue_digest(
+                    chat_id, notify_text, digest_line(student_name, group_title, month),
+                    window=DIGEST_WINDOW, max_delay=DIGEST_MAX_DELAY, max_batch=DIGEST_MAX_BATCH,
+                    disable_notification=True,
+                )
+            return payment
+
+    await db_async(_create_payment)()
+    if chat_id:
+        outbox_worker.wake()
+    if use_board:
+        status_boards.touch(enrollment.group_id)
 
     await state.finish()
     # Show payments page after successful accept
     text, kb = await build_payments_page(page=1)
     await safe_edit_cb(call, text, kb)
     await call.answer()
-    # Notify group chat if chat_id is available
-    chat_id = (enrollment.group.chat_id or enrollment.chat_id or '').strip()
-    print("Chat ID:", chat_id)
-    if chat_id:
-        notify_text = (
-            "✅ To'lov qabul qilindi\n"
-            f"O'quvchi: {str(enrollment.student.full_name).capitalize()}\n"
-            f"Guruh: {enrollment.group.title if enrollment.group else 'Belgilanmagan'}\n"
-            f"Oy: {month_label(month)}\n"
-        )
-        try:
-            await dp.bot.send_message(chat_id, notify_text, disable_notification=True)
-        except Exception as err:
-            # Ignore if bot cannot send to the group
-            print(f"Error sending payment notification: {err}")
-            pass
 
 
-@dp.callback_query_handler(IsAdmin(), text='pay:cancel_flow', state='*')
+@router.callback('pay:cancel_flow')
 async def pay_cancel_flow(call: types.CallbackQuery, state: FSMContext):
     await state.finish()
     await safe_edit_cb(call, "Bekor qilindi.", admin_main_menu_kb())
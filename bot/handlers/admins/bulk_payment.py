@@ -0,0 +1,157 @@
+from datetime import datetime
+from html import escape
+
+from aiogram import types
+from aiogram.dispatcher import FSMContext
+from django.db import transaction
+
+from apps.botapp import outbox
+from bot.keyboards.inline.admin import group_bulk_months_kb, group_bulk_pay_kb
+from bot.loader import db, router
+from bot.states.payments import BulkPayment
+from bot.utils.db_api.executor import db_async, db_gather
+from bot.utils.outbox_worker import outbox_worker, render_digest, split_digest
+from bot.utils.status_board import status_boards
+from main.ledger import current_month
+from main.models import Group
+from main.payments import pay_month_dues
+from main.reports import group_month_payments
+from main.rollups import next_month
+from .accept_payment import digest_line, fmt_amount, month_label
+
+# Telegram allows 100 buttons per keyboard; the rest are left for the controls
+MAX_ROWS = 90
+
+
+def _prev_month(month):
+    return month.replace(year=month.year - 1, month=12) if month.month == 1 else month.replace(month=month.month - 1)
+
+
+def _selection_text(title: str, month, rows: list, selected: set, hidden: int) -> str:
+    total = sum(due for eid, _, due in rows if eid in selected)
+    text = (
+        f"<b>{escape(title, quote=False)}</b> — {month_label(month)}\n"
+        f"To'lamaganlar: {len(rows) + hidden} ta\n"
+        f"Belgilangan: {len(selected)} ta, {fmt_amount(total)} so'm\n\n"
+        "Belgilangan o'quvchilar uchun oyning qolgan summasi to'lanadi."
+    )
+    if hidden:
+        text += f"\n\nRo'yxatda birinchi {len(rows)} tasi; qolgan {hidden} tasi keyingi safar."
+    return text
+
+
+async def _show_selection(call: types.CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    month = datetime.strptime(data['month'], "%Y-%m").date()
+    rows, selected = data['rows'], set(data['selected'])
+    labels = [(eid, f"{name} — {fmt_amount(due)}") for eid, name, due in rows]
+    await call.message.edit_text(_selection_text(data['title'], month, rows, selected, data['hidden']))
+    await call.message.edit_reply_markup(group_bulk_pay_kb(data['group_id'], labels, selected))
+
+
+@router.callback('adm:group:{group_id:int}:bulkpay')
+async def bulk_pay_start(call: types.CallbackQuery, state: FSMContext, group_id: int):
+    await state.finish()
+    month = current_month()
+    months = [(m.strftime('%Y-%m'), month_label(m)) for m in (_prev_month(month), month, next_month(month))]
+    await call.message.edit_text("Qaysi oy uchun guruh to'lovi?")
+    await call.message.edit_reply_markup(group_bulk_months_kb(group_id, months))
+    await call.answer()
+
+
+@router.callback('adm:group:{group_id:int}:bulkpay:{val}')
+async def bulk_pay_month(call: types.CallbackQuery, state: FSMContext, group_id: int, val: str):
+    month = datetime.strptime(val, "%Y-%m").date()
+    group, students = await db_gather(
+        lambda: Group.objects.get(id=group_id),
+        lambda: group_month_payments(group_id, month),
+    )
+    unpaid = [(s['id'], s['name'], s['fee'] - s['paid']) for s in students if s['fee'] > s['paid']]
+    if not unpaid:
+        await call.answer(f"{month_label(month)}: hamma to'lagan", show_alert=True)
+        return
+    rows = unpaid[:MAX_ROWS]
+    await state.set_state(BulkPayment.select)
+    await state.set_data({
+        'group_id': group_id,
+        'title': group.title,
+        'month': val,
+        'rows': rows,
+        'hidden': len(unpaid) - len(rows),
+        'selected': [eid for eid, _, _ in rows],
+    })
+    await _show_selection(call, state)
+    await call.answer()
+
+
+@router.callback('bulkpay:t:{enrollment_id:int}', state=BulkPayment.select)
+async def bulk_pay_toggle(call: types.CallbackQuery, state: FSMContext, enrollment_id: int):
+    data = await state.get_data()
+    selected = set(data['selected'])
+    selected ^= {enrollment_id}
+    await state.update_data(selected=[eid for eid, _, _ in data['rows'] if eid in selected])
+    await _show_selection(call, state)
+    await call.answer()
+
+
+@router.callback('bulkpay:all', state=BulkPayment.select)
+@router.callback('bulkpay:none', state=BulkPayment.select)
+async def bulk_pay_select_all(call: types.CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    everyone = call.data == 'bulkpay:all'
+    await state.update_data(selected=[eid for eid, _, _ in data['rows']] if everyone else [])
+    await _show_selection(call, state)
+    await call.answer()
+
+
+@router.callback('bulkpay:cancel:{group_id:int}')
+async def bulk_pay_cancel(call: types.CallbackQuery, state: FSMContext, group_id: int):
+    await state.finish()
+    kb = types.InlineKeyboardMarkup().add(
+        types.InlineKeyboardButton("⬅️ Guruhga qaytish", callback_data=f"adm:group:{group_id}"),
+    )
+    await call.message.edit_text("Bekor qilindi.", reply_markup=kb)
+    await call.answer()
+
+
+@router.callback('bulkpay:ok', state=BulkPayment.select)
+async def bulk_pay_confirm(call: types.CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    group_id = data['group_id']
+    month = datetime.strptime(data['month'], "%Y-%m").date()
+    try:
+        creator = await db.get_user(call.from_user.id)
+    except Exception:
+        creator = None
+
+    # Payments, rollups and balances in one transaction, with a single digest for the
+    # group chat written alongside (split only at Telegram's message size)
+    def _pay():
+        group = Group.objects.get(id=group_id)
+        chat_id = (group.chat_id or '').strip()
+        use_board = group.status_board and bool(chat_id)
+        with transaction.atomic():
+            paid = pay_month_dues(group_id, month, data['selected'], created_by=creator)
+            if paid and chat_id and not use_board:
+                lines = [digest_line(name, group.title, month) for _, name in paid]
+                for chunk in split_digest(lines, max_batch=None):
+                    outbox.enqueue(chat_id, render_digest(chunk), disable_notification=True)
+        return paid, chat_id, use_board
+
+    paid, chat_id, use_board = await db_async(_pay)()
+    await state.finish()
+    if paid and use_board:
+        status_boards.touch(group_id)
+    elif paid and chat_id:
+        outbox_worker.wake()
+
+    total = sum(p.amount for p, _ in paid)
+    text = f"✅ {month_label(month)}: {len(paid)} ta to'lov qabul qilindi, {fmt_amount(total)} so'm"
+    skipped = len(data['selected']) - len(paid)
+    if skipped:
+        text += f"\n{skipped} tasi shu orada to'langan, o'tkazib yuborildi."
+    kb = types.InlineKeyboardMarkup().add(
+        types.InlineKeyboardButton("⬅️ Guruhga qaytish", callback_data=f"adm:group:{group_id}"),
+    )
+    await call.message.edit_text(text, reply_markup=kb)
+    await call.answer()
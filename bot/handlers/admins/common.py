@@ -1,11 +1,10 @@
 from aiogram.types import CallbackQuery
 from aiogram.dispatcher import FSMContext
-from bot.loader import dp
-from bot.filters import IsAdmin
+from bot.loader import dp, router
 from bot.keyboards.inline.admin import admin_main_menu_kb
 
 
-@dp.callback_query_handler(IsAdmin(), text='adm:back:home', state='*')
+@router.callback('adm:back:home')
 async def back_to_home(call: CallbackQuery, state: FSMContext):
     await state.finish()
     # If callback came from a regular message
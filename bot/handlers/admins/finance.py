@@ -1,14 +1,40 @@
+import logging
+
 from aiogram import types
 from aiogram.dispatcher import FSMContext
-from bot.loader import dp
+from aiogram.dispatcher.filters import Command
+from bot.loader import dp, router
 from bot.filters import IsAdmin
 from bot.states.finance import FinanceAuth
-from bot.data.config import FINANCE_PASSWORD
-from asgiref.sync import sync_to_async
-from django.db.models import Sum
+from bot.data.config import FINANCE_PASSWORD, FINANCE_CACHE_TTL
+from bot.utils.cache import SingleFlightCache
+from bot.utils.db_api.executor import db_gather
+from bot.utils.search_index import student_index
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.utils import timezone
-from datetime import timedelta
-from main.models import Payment, Group, Enrollment
+from main.models import Enrollment, Payment
+from main.reports import build_dashboard, creator_name, dashboard_queries
+from main.signals import month_charged, payments_recorded
+
+# Writes made by this process invalidate the dashboard right away; the TTL bounds
+# how stale it can get after writes from the admin site or `manage.py roll_month`,
+# which run separately.
+dashboard_cache = SingleFlightCache(ttl=FINANCE_CACHE_TTL)
+
+
+def _invalidate_dashboard(sender, **kwargs):
+    # After commit, so a refresh racing the write cannot cache the old figures
+    transaction.on_commit(dashboard_cache.invalidate)
+
+
+for _model in (Payment, Enrollment):
+    post_save.connect(_invalidate_dashboard, sender=_model, dispatch_uid=f'fin_dashboard_save_{_model.__name__}')
+    post_delete.connect(_invalidate_dashboard, sender=_model, dispatch_uid=f'fin_dashboard_delete_{_model.__name__}')
+# Bulk-created payments (sent after commit, so the invalidation runs right away)
+payments_recorded.connect(_invalidate_dashboard, dispatch_uid='fin_dashboard_bulk')
+# The hourly month rollover's new charges and balances
+month_charged.connect(_invalidate_dashboard, dispatch_uid='fin_dashboard_rollover')
 
 
 def fmt_amount(n: int) -> str:
@@ -18,16 +44,7 @@ def fmt_amount(n: int) -> str:
         return str(n)
 
 
-def month_start(dt):
-    return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-
-
-def months_between(a, b):
-    # number of months from a to b, where a and b are first day of month; b >= a
-    return (b.year - a.year) * 12 + (b.month - a.month)
-
-
-@dp.callback_query_handler(IsAdmin(), text='adm:finance', state='*')
+@router.callback('adm:finance')
 async def finance_entry(call: types.CallbackQuery, state: FSMContext):
     await state.finish()
     if not FINANCE_PASSWORD:
@@ -53,75 +70,36 @@ async def finance_check_password(message: types.Message, state: FSMContext):
     await show_finance_dashboard(message)
 
 
-async def show_finance_dashboard(msg: types.Message):
-    now = timezone.now()
-    local_now = timezone.localtime(now)
-    start_today = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    start_week = (start_today - timedelta(days=start_today.weekday()))
-    start_month = start_today.replace(day=1)
-
-    def agg_range(start_dt):
-        return Payment.objects.filter(paid_at__gte=start_dt).aggregate(total=Sum('amount')).get('total') or 0
-
-    today_total = await sync_to_async(agg_range)(start_today)
-    week_total = await sync_to_async(agg_range)(start_week)
-    month_total = await sync_to_async(agg_range)(start_month)
-    
-
-    # Per-creator for today/week/month
-    def per_creator(start_dt):
-        qs = (
-            Payment.objects.filter(paid_at__gte=start_dt)
-            .values('created_by__username', 'created_by__first_name', 'created_by__last_name')
-            .annotate(total=Sum('amount'))
-            .order_by('-total')
-        )
-        return list(qs)
-
-    creators_today, creators_week, creators_month = await sync_to_async(per_creator)(start_today), await sync_to_async(per_creator)(start_week), await sync_to_async(per_creator)(start_month)
-
-    # Per-group current month expected vs collected and past arrears
-    cur_month = month_start(now)
-
-    # Overall current month expected vs collected
-    def expected_all_current():
-        return Enrollment.objects.filter(is_active=True).aggregate(total=Sum('monthly_fee')).get('total') or 0
-
-    def collected_all_current():
-        return Payment.objects.filter(month=cur_month.date()).aggregate(total=Sum('amount')).get('total') or 0
-
-    overall_expected, overall_collected = await sync_to_async(expected_all_current)(), await sync_to_async(collected_all_current)()
-    overall_remaining = max((overall_expected - overall_collected), 0)
-
-    def group_summaries():
-        groups = list(Group.objects.filter(is_active=True).order_by('title'))
-        data = []
-        for g in groups:
-            enr_qs = Enrollment.objects.filter(group=g, is_active=True)
-            expected_current = enr_qs.aggregate(total=Sum('monthly_fee')).get('total') or 0
-            collected_current = Payment.objects.filter(enrollment__in=enr_qs, month=cur_month.date()).aggregate(total=Sum('amount')).get('total') or 0
-            # past arrears up to previous month
-            def _enr_past_debt(enr: Enrollment):
-                joined_m = month_start(enr.joined_at)
-                months_prior = max(months_between(joined_m, cur_month), 0)
-                if months_prior <= 0:
-                    return 0
-                expected_past = months_prior * (enr.monthly_fee or 0)
-                paid_past = Payment.objects.filter(enrollment=enr, month__gte=joined_m.date(), month__lt=cur_month.date()).aggregate(total=Sum('amount')).get('total') or 0
-                d = expected_past - paid_past
-                return d if d > 0 else 0
-            arrears_past = 0
-            for enr in enr_qs:
-                arrears_past += _enr_past_debt(enr)
-            remaining_current = max((expected_current - collected_current), 0)
-            data.append((g.title, expected_current, collected_current, remaining_current, arrears_past))
+async def get_dashboard_data() -> dict:
+    """Dashboard payload for the local day; concurrent callers share one computation."""
+    async def _compute():
+        # The dashboard's queries are independent; run them side by side
+        data = build_dashboard(*await db_gather(*dashboard_queries()))
+        data['computed_at'] = timezone.localtime(timezone.now())
         return data
 
-    groups_data = await sync_to_async(group_summaries)()
+    return await dashboard_cache.get(timezone.localdate(), _compute)
+
+
+async def warm_dashboard_cache():
+    try:
+        await get_dashboard_data()
+    except Exception:
+        logging.exception("Finance dashboard warm-up failed")
+
+
+async def show_finance_dashboard(msg: types.Message):
+    data = await get_dashboard_data()
+
+    today_total, week_total, month_total = data['today_total'], data['week_total'], data['month_total']
+    creators_today, creators_week, creators_month = data['creators_today'], data['creators_week'], data['creators_month']
+    overall_expected, overall_collected = data['overall_expected'], data['overall_collected']
+    overall_remaining = data['overall_remaining']
+    groups_data = data['groups']
 
     lines = [
         "📊 Moliya — umumiy ko'rinish",
-        f"🕒 Yangilanish: {local_now.strftime('%Y-%m-%d %H:%M')}",
+        f"🕒 Yangilanish: {data['computed_at'].strftime('%Y-%m-%d %H:%M')}",
         "",
         "💵 Kirimlar:",
         f"  • Bugun: {fmt_amount(today_total)} so'm",
@@ -138,7 +116,7 @@ async def show_finance_dashboard(msg: types.Message):
     ]
     if creators_today:
         for c in creators_today:
-            name = c['created_by__username'] or f"{(c['created_by__first_name'] or '')} {(c['created_by__last_name'] or '')}".strip() or "Noma'lum"
+            name = creator_name(c)
             lines.append(f"    - {name}: {fmt_amount(c['total'])} so'm")
     else:
         lines.append("    - Ma'lumot yo'q")
@@ -146,7 +124,7 @@ async def show_finance_dashboard(msg: types.Message):
     lines += ["  • Hafta:"]
     if creators_week:
         for c in creators_week:
-            name = c['created_by__username'] or f"{(c['created_by__first_name'] or '')} {(c['created_by__last_name'] or '')}".strip() or "Noma'lum"
+            name = creator_name(c)
             lines.append(f"    - {name}: {fmt_amount(c['total'])} so'm")
     else:
         lines.append("    - Ma'lumot yo'q")
@@ -154,7 +132,7 @@ async def show_finance_dashboard(msg: types.Message):
     lines += ["  • Oy:"]
     if creators_month:
         for c in creators_month:
-            name = c['created_by__username'] or f"{(c['created_by__first_name'] or '')} {(c['created_by__last_name'] or '')}".strip() or "Noma'lum"
+            name = creator_name(c)
             lines.append(f"    - {name}: {fmt_amount(c['total'])} so'm")
     else:
         lines.append("    - Ma'lumot yo'q")
@@ -180,7 +158,26 @@ async def show_finance_dashboard(msg: types.Message):
     await msg.answer("\n".join([l for l in lines if l is not None]).rstrip(), reply_markup=kb)
 
 
-@dp.callback_query_handler(IsAdmin(), text='fin:refresh', state='*')
+@router.callback('fin:refresh')
 async def finance_refresh(call: types.CallbackQuery, state: FSMContext):
     await show_finance_dashboard(call.message)
     await call.answer("Yangilandi")
+
+
+@dp.message_handler(Command('cache_stats'), IsAdmin(), state='*')
+async def finance_cache_stats(message: types.Message):
+    stats = dashboard_cache.stats()
+    index = student_index.stats()
+    index_line = (
+        f"{index['students']} o'quvchi, {index['trigrams']} trigram, {index['dead_slots']} bo'sh slot"
+        if index['ready'] else "yuklanmagan (DB qidiruvi)"
+    )
+    await message.answer(
+        "🗄 Moliya paneli keshi:\n"
+        f"  • Topildi (hit): {stats['hits']}\n"
+        f"  • Hisoblandi (miss): {stats['misses']}\n"
+        f"  • Kutib olindi (bir vaqtda): {stats['shared']}\n"
+        f"  • Bekor qilindi: {stats['invalidations']}\n"
+        f"  • Yozuvlar: {stats['size']}\n\n"
+        f"🔎 Qidiruv indeksi: {index_line}"
+    )
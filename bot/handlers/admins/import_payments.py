@@ -0,0 +1,150 @@
+import io
+from datetime import date
+from html import escape
+
+from aiogram import types
+from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.filters import Command
+
+from bot.filters import IsAdmin
+from bot.loader import dp, db, router
+from bot.states.payments import ImportPayments
+from bot.utils.db_api.executor import db_async
+from bot.utils.status_board import status_boards
+from main.imports import MAX_LINES, prepare_import
+from main.models import Group
+from main.payments import record_payments
+from .accept_payment import fmt_amount
+
+# Larger files are refused before download (MAX_LINES lines fit well within it)
+MAX_FILE_BYTES = 1024 * 1024
+IMPORT_EXTENSIONS = ('.txt', '.csv')
+# Unresolved lines listed in the summary; all of them are sent as a file beyond that
+ERRORS_SHOWN = 15
+
+HELP_TEXT = (
+    "📥 <b>To'lovlarni ro'yxatdan kiritish</b>\n\n"
+    "Har bir qatorda bitta to'lov:\n"
+    "<code>o'quvchi yoki telefon; guruh; YYYY-MM; summa</code>\n\n"
+    "Masalan:\n"
+    "<code>Aliyev Vali; Ingliz tili; 2025-10; 300 000\n"
+    "+998901234567; Matematika; 2025-10; 250000</code>\n\n"
+    f"Ro'yxatni xabar qilib yoki .txt / .csv fayl qilib yuboring (ko'pi bilan {MAX_LINES} qator)."
+)
+
+
+def _cancel_kb() -> types.InlineKeyboardMarkup:
+    return types.InlineKeyboardMarkup().add(types.InlineKeyboardButton("❌ Bekor qilish", callback_data="imp:cancel"))
+
+
+def _decode(data: bytes) -> str:
+    try:
+        return data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        # Excel on Windows saves CSV in the ANSI code page
+        return data.decode('cp1251', errors='replace')
+
+
+def _summary(payments: list, errors: list) -> str:
+    total = sum(p['amount'] for p in payments)
+    lines = [
+        "📥 <b>Import natijasi</b>",
+        f"Qatorlar: {len(payments) + len(errors)}",
+        f"✅ Topildi: {len(payments)} ta, {fmt_amount(total)} so'm",
+        f"⚠️ Topilmadi yoki xato: {len(errors)} ta",
+    ]
+    if errors:
+        lines.append("")
+        for number, text, reason in errors[:ERRORS_SHOWN]:
+            shown = text if len(text) <= 60 else text[:57] + '...'
+            lines.append(f"• {number}-qator: {escape(reason, quote=False)}" + (f" — <i>{escape(shown, quote=False)}</i>" if shown else ""))
+        if len(errors) > ERRORS_SHOWN:
+            lines.append(f"... va yana {len(errors) - ERRORS_SHOWN} ta (hammasi faylda)")
+    lines.append("")
+    lines.append("Topilgan to'lovlar saqlansinmi?" if payments else "Saqlanadigan to'lov yo'q.")
+    return "\n".join(lines)
+
+
+def _errors_file(errors: list) -> types.InputFile:
+    body = "\n".join(f"{number}\t{reason}\t{text}" for number, text, reason in errors)
+    return types.InputFile(io.BytesIO(body.encode()), filename='xatolar.txt')
+
+
+@dp.message_handler(Command(['import_payments', 'import']), IsAdmin(), state='*')
+async def cmd_import_payments(message: types.Message, state: FSMContext):
+    await state.finish()
+    await ImportPayments.wait_input.set()
+    await message.answer(HELP_TEXT, reply_markup=_cancel_kb())
+
+
+# A corrected list sent after the summary replaces the previous one
+@dp.message_handler(IsAdmin(), state=[ImportPayments.wait_input, ImportPayments.confirm], content_types=[types.ContentType.TEXT, types.ContentType.DOCUMENT])
+async def import_payments_input(message: types.Message, state: FSMContext):
+    if message.document:
+        name = (message.document.file_name or '').lower()
+        if not name.endswith(IMPORT_EXTENSIONS):
+            await message.answer("Faqat .txt yoki .csv fayl qabul qilinadi.", reply_markup=_cancel_kb())
+            return
+        if (message.document.file_size or 0) > MAX_FILE_BYTES:
+            await message.answer("Fayl juda katta (1 MB dan ortiq).", reply_markup=_cancel_kb())
+            return
+        text = _decode((await message.document.download(destination=io.BytesIO())).getvalue())
+    else:
+        text = message.text or ''
+
+    payments, errors = await db_async(prepare_import)(text)
+    if not payments and not errors:
+        await message.answer("Ro'yxat bo'sh. Qatorlarni yuboring.", reply_markup=_cancel_kb())
+        return
+
+    kb = types.InlineKeyboardMarkup(row_width=1)
+    await state.update_data(payments=[
+        (p['enrollment_id'], p['month'].isoformat(), p['amount'], p['group_id']) for p in payments
+    ])
+    if payments:
+        kb.add(types.InlineKeyboardButton(f"✅ Saqlash ({len(payments)} ta)", callback_data="imp:ok"))
+        await ImportPayments.confirm.set()
+    else:
+        await ImportPayments.wait_input.set()
+    kb.add(types.InlineKeyboardButton("❌ Bekor qilish", callback_data="imp:cancel"))
+    if len(errors) > ERRORS_SHOWN:
+        await message.answer_document(_errors_file(errors), caption="Topilmagan qatorlar")
+    await message.answer(_summary(payments, errors), reply_markup=kb)
+
+
+@router.callback('imp:cancel')
+async def import_payments_cancel(call: types.CallbackQuery, state: FSMContext):
+    await state.finish()
+    await call.message.edit_text("Import bekor qilindi.")
+    await call.answer()
+
+
+@router.callback('imp:ok', state=ImportPayments.confirm)
+async def import_payments_confirm(call: types.CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    # Leave the state first, so a second tap cannot save the list twice
+    await state.finish()
+    try:
+        creator = await db.get_user(call.from_user.id)
+    except Exception:
+        creator = None
+    items = data['payments']
+    group_ids = {group_id for _, _, _, group_id in items}
+
+    def _save():
+        payments = record_payments(
+            ((eid, date.fromisoformat(month), amount) for eid, month, amount, _ in items), created_by=creator,
+        )
+        boards = list(
+            Group.objects.filter(id__in=group_ids, status_board=True)
+            .exclude(chat_id__isnull=True).exclude(chat_id='')
+            .values_list('id', flat=True)
+        )
+        return payments, boards
+
+    payments, boards = await db_async(_save)()
+    for group_id in boards:
+        status_boards.touch(group_id)
+    total = sum(p.amount for p in payments)
+    await call.message.edit_text(f"✅ {len(payments)} ta to'lov saqlandi, jami {fmt_amount(total)} so'm.")
+    await call.answer()
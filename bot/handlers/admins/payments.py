@@ -1,17 +1,30 @@
+import asyncio
+import os
+import tempfile
+
 from aiogram import types
 from aiogram.dispatcher import FSMContext
-from asgiref.sync import sync_to_async
 
-from bot.loader import dp
+from bot.loader import dp, router
 from bot.filters import IsAdmin
 from bot.keyboards.inline.admin import payments_list_kb
+from bot.utils.db_api.executor import db_async
+from bot.utils.db_api.keyset import Keyset
+from main.exports import PAYMENT_COLUMNS, WRITERS, write_export_parts
 from main.models import Payment
 from django.utils import timezone
-from django.db.models import Sum
+from django.db.models import Q, Sum
 from aiogram.dispatcher.filters.state import StatesGroup, State
 
 PAGE_SIZE = 10
 
+PAYMENTS_KEYSET = Keyset(('-paid_at', '-id'), page_size=PAGE_SIZE)
+
+# Bots may upload documents up to 50 MB; export files are split a little below that
+EXPORT_PART_BYTES = 45 * 1024 * 1024
+# An export holds a pool thread and a server-side cursor until it finishes; run one at a time
+_export_lock = asyncio.Lock()
+
 
 class PaymentsFilter(StatesGroup):
     wait_creator = State()
@@ -80,34 +93,28 @@ def apply_filters(qs, f: dict):
     return qs
 
 
-async def paginate(qs, page: int, page_size: int = PAGE_SIZE):
-    total = await sync_to_async(qs.count)()
-    total_pages = max((total + page_size - 1) // page_size, 1)
-    page = max(min(page, total_pages), 1)
-    offset = (page - 1) * page_size
-    items = await sync_to_async(lambda: list(
-        qs.select_related('enrollment__student', 'enrollment__group', 'created_by')
-          .order_by('-paid_at')[offset:offset+page_size]
-    ))()
-    return items, total_pages, page
+async def paginate(qs, cursor: str | None = None, page: int = 1):
+    """Keyset page of payments, newest first; see bot.utils.db_api.keyset."""
+    qs = qs.select_related('enrollment__student', 'enrollment__group', 'created_by')
+    return await db_async(PAYMENTS_KEYSET.page)(qs, cursor, page)
 
 
-async def build_payments_page(page: int = 1, filters: dict | None = None):
+async def build_payments_page(page: int = 1, filters: dict | None = None, cursor: str | None = None):
     qs = Payment.objects.all()
     if filters:
         qs = apply_filters(qs, filters)
-    items, total_pages, page = await paginate(qs, page)
+    result = await paginate(qs, cursor, page)
+    items, total_pages, page = result.items, result.total_pages, result.number
 
     now = timezone.now()
     start_today = now.replace(hour=0, minute=0, second=0, microsecond=0)
     start_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
 
-    def agg_from(start_dt):
-        base = Payment.objects.filter(paid_at__gte=start_dt)
-        base = apply_filters(base, filters) if filters else base
-        return base.aggregate(total=Sum('amount')).get('total') or 0
-
-    today_total, month_total = await sync_to_async(agg_from)(start_today), await sync_to_async(agg_from)(start_month)
+    # Both totals in one query
+    base = Payment.objects.filter(paid_at__gte=start_month)
+    base = apply_filters(base, filters) if filters else base
+    totals = await db_async(base.aggregate)(today=Sum('amount', filter=Q(paid_at__gte=start_today)), month=Sum('amount'))
+    today_total, month_total = totals['today'] or 0, totals['month'] or 0
 
     if not items:
         text = (
@@ -115,7 +122,7 @@ async def build_payments_page(page: int = 1, filters: dict | None = None):
             f"Bugun: {fmt_amount(today_total)} so'm | Oy: {fmt_amount(month_total)} so'm\n\n"
             "Hozircha to'lovlar mavjud emas."
         )
-        kb = payments_list_kb(page, total_pages)
+        kb = payments_list_kb(page, total_pages, cursors=result.cursors)
         return text, kb
 
     lines = [
@@ -143,11 +150,11 @@ async def build_payments_page(page: int = 1, filters: dict | None = None):
         lines.append("")
 
     text = "\n".join(lines).rstrip()
-    kb = payments_list_kb(page, total_pages)
+    kb = payments_list_kb(page, total_pages, cursors=result.cursors)
     return text, kb
 
 
-@dp.callback_query_handler(IsAdmin(), text='adm:payments:filters', state='*')
+@router.callback('adm:payments:filters')
 async def payments_filters(call: types.CallbackQuery, state: FSMContext):
     # Do not finish state to preserve existing filter data
     current = await state.get_data()
@@ -159,7 +166,7 @@ async def payments_filters(call: types.CallbackQuery, state: FSMContext):
     await call.answer()
 
 
-@dp.callback_query_handler(IsAdmin(), text='adm:payments:filters:clear', state='*')
+@router.callback('adm:payments:filters:clear')
 async def payments_filters_clear(call: types.CallbackQuery, state: FSMContext):
     await state.update_data(c=None, df=None, dt=None, m=None)
     text, kb = await build_payments_page(page=1, filters=None)
@@ -168,12 +175,12 @@ async def payments_filters_clear(call: types.CallbackQuery, state: FSMContext):
     await call.answer("Tozalandi")
 
 
-@dp.callback_query_handler(IsAdmin(), lambda c: c.data.startswith('adm:payments:p:'), state='*')
-async def payments_paged(call: types.CallbackQuery, state: FSMContext):
-    page = int(call.data.split(':')[-1])
+@router.callback('adm:payments:p:{page:int}')
+@router.callback('adm:payments:p:{page:int}:{cursor}')
+async def payments_paged(call: types.CallbackQuery, state: FSMContext, page: int, cursor: str | None = None):
     current = await state.get_data()
     filters = {k: current.get(k) for k in ('c','df','dt','m') if current.get(k)} or None
-    text, kb = await build_payments_page(page, filters=filters)
+    text, kb = await build_payments_page(page, filters=filters, cursor=cursor)
     await call.message.edit_text(text)
     await call.message.edit_reply_markup(kb)
     await call.answer()
@@ -181,7 +188,7 @@ async def payments_paged(call: types.CallbackQuery, state: FSMContext):
 
 # ============== Filter prompts (no inline queries) ==============
 
-@dp.callback_query_handler(IsAdmin(), text='adm:payments:filters:set:c', state='*')
+@router.callback('adm:payments:filters:set:c')
 async def payments_filter_set_creator_prompt(call: types.CallbackQuery, state: FSMContext):
     await call.answer()
     await PaymentsFilter.wait_creator.set()
@@ -200,7 +207,7 @@ async def payments_filter_set_creator_value(message: types.Message, state: FSMCo
     await message.answer(text, reply_markup=kb)
 
 
-@dp.callback_query_handler(IsAdmin(), text='adm:payments:filters:set:df', state='*')
+@router.callback('adm:payments:filters:set:df')
 async def payments_filter_set_dfrom_prompt(call: types.CallbackQuery, state: FSMContext):
     await call.answer()
     await PaymentsFilter.wait_dfrom.set()
@@ -224,7 +231,7 @@ async def payments_filter_set_dfrom_value(message: types.Message, state: FSMCont
     await message.answer(text_out, reply_markup=kb)
 
 
-@dp.callback_query_handler(IsAdmin(), text='adm:payments:filters:set:dt', state='*')
+@router.callback('adm:payments:filters:set:dt')
 async def payments_filter_set_dto_prompt(call: types.CallbackQuery, state: FSMContext):
     await call.answer()
     await PaymentsFilter.wait_dto.set()
@@ -248,7 +255,7 @@ async def payments_filter_set_dto_value(message: types.Message, state: FSMContex
     await message.answer(text_out, reply_markup=kb)
 
 
-@dp.callback_query_handler(IsAdmin(), text='adm:payments:filters:set:m', state='*')
+@router.callback('adm:payments:filters:set:m')
 async def payments_filter_set_month_prompt(call: types.CallbackQuery, state: FSMContext):
     await call.answer()
     await PaymentsFilter.wait_month.set()
@@ -271,3 +278,53 @@ async def payments_filter_set_month_value(message: types.Message, state: FSMCont
     await state.reset_state(with_data=False)
     await message.answer("✅ To'lov oyi o'rnatildi.")
     await message.answer(text_out, reply_markup=kb)
+
+
+# ============== Export ==============
+
+@router.callback('adm:payments:export')
+async def payments_export_menu(call: types.CallbackQuery, state: FSMContext):
+    kb = types.InlineKeyboardMarkup(row_width=2)
+    kb.add(
+        types.InlineKeyboardButton("📄 CSV", callback_data="adm:payments:export:csv"),
+        types.InlineKeyboardButton("📊 Excel (XLSX)", callback_data="adm:payments:export:xlsx"),
+    )
+    kb.add(types.InlineKeyboardButton("⬅️ Orqaga", callback_data="adm:payments:p:1"))
+    await call.message.edit_reply_markup(kb)
+    await call.answer("Joriy filterlar bo'yicha eksport")
+
+
+def export_payments(filters: dict | None, fmt: str, directory: str) -> list:
+    """Write the filtered payments (oldest first) into `directory`; returns [(path, row count)]."""
+    qs = Payment.objects.all()
+    if filters:
+        qs = apply_filters(qs, filters)
+    stamp = timezone.localtime().strftime('%Y%m%d-%H%M')
+    ext = WRITERS[fmt].extension
+    return write_export_parts(
+        qs.order_by('paid_at', 'id'), PAYMENT_COLUMNS, fmt,
+        lambda n: os.path.join(directory, f"tolovlar-{stamp}-{n}.{ext}"),
+        EXPORT_PART_BYTES,
+    )
+
+
+@router.callback('adm:payments:export:{fmt}')
+async def payments_export(call: types.CallbackQuery, state: FSMContext, fmt: str):
+    if fmt not in WRITERS:
+        await call.answer()
+        return
+    current = await state.get_data()
+    filters = {k: current.get(k) for k in ('c','df','dt','m') if current.get(k)} or None
+    await call.answer("⏳ Eksport tayyorlanmoqda...")
+    if _export_lock.locked():
+        await call.message.answer("⏳ Boshqa eksport tugashi kutilmoqda...")
+
+    async with _export_lock:
+        with tempfile.TemporaryDirectory(prefix='export-') as directory:
+            # Rows are streamed to disk on the DB pool, so the event loop stays free
+            parts = await db_async(export_payments)(filters, fmt, directory)
+            for i, (path, count) in enumerate(parts, start=1):
+                caption = f"💳 To'lovlar: {count} ta"
+                if len(parts) > 1:
+                    caption += f" (qism {i}/{len(parts)})"
+                await call.message.answer_document(types.InputFile(path), caption=caption)
@@ -1,16 +1,20 @@
 from aiogram import types
 from aiogram.dispatcher import FSMContext
-from bot.loader import dp, db
+from bot.loader import dp, db, router
 from bot.filters import IsAdmin
 from bot.keyboards.inline.admin import simple_pager, admin_main_menu_kb
-from asgiref.sync import sync_to_async
-from main.models import Student, Enrollment, Payment, Group
-from django.db import models
+from bot.utils.db_api.executor import db_async
+from bot.utils.db_api.keyset import Keyset
+from main.models import Student, Enrollment, Group
+from main.profiles import student_profile
+from main.reports import debtors_ordering, debtors_queryset
 from bot.states.students import StudentEdit
 from bot.states.admin import AddStudentToGroupState, CreateStudentState
 
 PAGE_SIZE = 10
 
+DEBTORS_KEYSET = Keyset(debtors_ordering(), key='student_id', page_size=10)
+
 # Reply keyboard labels for create student
 ST_CANCEL = "❌ Bekor qilish"
 ST_BACK = "⬅️ Orqaga"
@@ -65,27 +69,28 @@ async def safe_edit(call: types.CallbackQuery, text: str, kb: types.InlineKeyboa
             await dp.bot.send_message(call.from_user.id, text, reply_markup=kb, parse_mode=None)
 
 
-@dp.callback_query_handler(IsAdmin(), text='adm:students', state='*')
+@router.callback('adm:students')
 async def students_root(call: types.CallbackQuery, state: FSMContext):
     await state.finish()
     await show_students_page(call.message, 1)
     await call.answer()
 
 
-@dp.callback_query_handler(IsAdmin(), lambda c: c.data.startswith('adm:students:p:'), state='*')
-async def students_paged(call: types.CallbackQuery, state: FSMContext):
+@router.callback('adm:students:p:{page:int}')
+@router.callback('adm:students:p:{page:int}:{cursor}')
+async def students_paged(call: types.CallbackQuery, state: FSMContext, page: int, cursor: str | None = None):
     await state.finish()
-    page = int(call.data.split(':')[-1])
-    await show_students_page(call.message, page)
+    await show_students_page(call.message, page, cursor)
     await call.answer()
 
 
-async def show_students_page(msg: types.Message, page: int):
-    items, total_pages, page, total = await db.get_students(page=page, page_size=PAGE_SIZE)
+async def show_students_page(msg: types.Message, page: int, cursor: str | None = None):
+    result = await db.get_students(cursor=cursor, page=page, page_size=PAGE_SIZE)
+    items, total_pages, page, total = result.items, result.total_pages, result.number, result.total
 
     if not items:
         await msg.edit_text("Hozircha o'quvchilar mavjud emas.")
-        await msg.edit_reply_markup(simple_pager('adm:students', page, total_pages))
+        await msg.edit_reply_markup(simple_pager('adm:students', page, total_pages, cursors=result.cursors))
         return
 
     text = f"O'quvchilar ro'yxati (jami: {total})\nTanlang:"
@@ -93,7 +98,7 @@ async def show_students_page(msg: types.Message, page: int):
     kb = types.InlineKeyboardMarkup(row_width=1)
     for s in items:
         kb.add(types.InlineKeyboardButton(f"{s.full_name} — {s.phone_number or '-'}", callback_data=f"adm:student:{s.id}"))
-    nav = simple_pager('adm:students', page, total_pages)
+    nav = simple_pager('adm:students', page, total_pages, cursors=result.cursors)
     if nav and nav.inline_keyboard:
         for row in nav.inline_keyboard:
             kb.row(*row)
@@ -108,77 +113,46 @@ async def show_students_page(msg: types.Message, page: int):
         await msg.answer(text, reply_markup=kb)
 
 
-@dp.callback_query_handler(IsAdmin(), regexp=r'^adm:student:\d+$', state='*')
-async def student_detail(call: types.CallbackQuery, state: FSMContext):
+@router.callback('adm:student:{sid:int}')
+async def student_detail(call: types.CallbackQuery, state: FSMContext, sid: int):
     await state.finish()
-    sid = int(call.data.split(':')[-1])
-    student = await sync_to_async(Student.objects.get)(id=sid)
-
-    enrollments = await sync_to_async(lambda: list(Enrollment.objects.select_related('group').filter(student_id=sid)))()
-    payments_count = await sync_to_async(Payment.objects.filter(enrollment__student_id=sid).count)()
-    total_paid = await sync_to_async(lambda: Payment.objects.filter(enrollment__student_id=sid).aggregate(total=models.Sum('amount')).get('total') or 0)()
-    last_payments = await sync_to_async(lambda: list(Payment.objects.select_related('enrollment__group', 'created_by').filter(enrollment__student_id=sid).order_by('-paid_at')[:5]))()
-
-    from django.utils import timezone
-    now = timezone.now()
-    cur_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    profile = await db_async(student_profile)(sid)
 
     lines = [
-        f"👤 {student.full_name}",
-        f"📞 {student.phone_number or '-'}",
+        f"👤 {profile.full_name}",
+        f"📞 {profile.phone_number or '-'}",
         "",
     ]
-    if enrollments:
+    if profile.enrollments:
         lines.append("🏷️ Guruhlar (joriy oy):")
-        for e in enrollments:
-            paid_m = await sync_to_async(lambda: Payment.objects.filter(enrollment=e, month=cur_month.date()).aggregate(total=models.Sum('amount')).get('total') or 0)()
-            need_m = e.monthly_fee or 0
-            due_m = max(need_m - paid_m, 0)
+        for e in profile.enrollments:
             lines += [
-                f"• {e.group.title}",
-                f"  Kerak: {fmt_amount(need_m)} so'm | To'langan: {fmt_amount(paid_m)} so'm",
-                f"  Qolgan: {fmt_amount(due_m)} so'm",
+                f"• {e.group_title}",
+                f"  Kerak: {fmt_amount(e.monthly_fee)} so'm | To'langan: {fmt_amount(e.month_paid)} so'm",
+                f"  Qolgan: {fmt_amount(e.month_due)} so'm",
             ]
     else:
         lines.append("🏷️ Guruhlar: yo'q")
 
-    # Total arrears since joining
-    def total_arrears():
-        debt = 0
-        for e in enrollments:
-            joined_m = cur_month.replace(year=e.joined_at.year, month=e.joined_at.month)
-            months = max((cur_month.year - joined_m.year) * 12 + (cur_month.month - joined_m.month) + 1, 1)
-            expected = months * (e.monthly_fee or 0)
-            paid = Payment.objects.filter(enrollment=e, month__gte=joined_m.date(), month__lte=cur_month.date()).aggregate(total=models.Sum('amount')).get('total') or 0
-            d = expected - paid
-            if d > 0:
-                debt += d
-        return debt
-
-    arrears_total = await sync_to_async(total_arrears)()
-
     lines += [
         "",
         "📊 Umumiy ma'lumot:",
-        f"  • To'lovlar soni: {payments_count}",
-        f"  • Jami to'langan: {fmt_amount(total_paid)} so'm",
-        f"  • Umumiy qarz: {fmt_amount(arrears_total)} so'm",
+        f"  • To'lovlar soni: {profile.payments_count}",
+        f"  • Jami to'langan: {fmt_amount(profile.total_paid)} so'm",
+        f"  • Umumiy qarz: {fmt_amount(profile.arrears)} so'm",
     ]
 
-    if last_payments:
+    if profile.last_payments:
         lines += ["", "🧾 Oxirgi to'lovlar:"]
-        for p in last_payments:
-            creator = None
-            if getattr(p, 'created_by', None):
-                creator = p.created_by.username or getattr(p.created_by, 'full_name', None) or str(p.created_by)
+        for p in profile.last_payments:
             lines += [
                 f"• Oy: {p.month.strftime('%Y-%m')}",
-                f"  Guruh: {p.enrollment.group.title}",
+                f"  Guruh: {p.group_title}",
                 f"  Summa: {fmt_amount(p.amount)} so'm",
                 f"  Sana: {p.paid_at.strftime('%Y-%m-%d %H:%M')}",
             ]
-            if creator:
-                lines.append(f"  Qabul qilgan: {creator}")
+            if p.created_by:
+                lines.append(f"  Qabul qilgan: {p.created_by}")
             lines.append("")
 
     text = "\n".join([l for l in lines if l is not None]).rstrip()
@@ -197,13 +171,11 @@ async def student_detail(call: types.CallbackQuery, state: FSMContext):
     await safe_edit(call, text, kb)
 
 
-@dp.callback_query_handler(IsAdmin(), lambda c: c.data.startswith('adm:student:') and c.data.endswith(':groups'), state='*')
-async def student_groups_view(call: types.CallbackQuery, state: FSMContext):
+@router.callback('adm:student:{sid:int}:groups')
+async def student_groups_view(call: types.CallbackQuery, state: FSMContext, sid: int):
     await state.finish()
-    parts = call.data.split(':')
-    sid = int(parts[2])
-    student = await sync_to_async(Student.objects.get)(id=sid)
-    enrollments = await sync_to_async(lambda: list(Enrollment.objects.select_related('group').filter(student_id=sid)))()
+    student = await db_async(Student.objects.get)(id=sid)
+    enrollments = await db_async(lambda: list(Enrollment.objects.select_related('group').filter(student_id=sid)))()
 
     lines = [f"👤 {student.full_name} — guruhlari:"]
     if enrollments:
@@ -222,10 +194,9 @@ async def student_groups_view(call: types.CallbackQuery, state: FSMContext):
     await safe_edit(call, "\n".join(lines), kb)
 
 
-@dp.callback_query_handler(IsAdmin(), lambda c: c.data.startswith('adm:student:') and c.data.endswith(':edit'), state='*')
-async def student_edit_menu(call: types.CallbackQuery, state: FSMContext):
+@router.callback('adm:student:{sid:int}:edit')
+async def student_edit_menu(call: types.CallbackQuery, state: FSMContext, sid: int):
     await state.finish()
-    sid = int(call.data.split(':')[2])
     await state.update_data(student_id=sid)
     kb = types.InlineKeyboardMarkup(row_width=2)
     kb.add(
@@ -236,7 +207,7 @@ async def student_edit_menu(call: types.CallbackQuery, state: FSMContext):
     await safe_edit(call, "Qaysi ma'lumotni o'zgartiramiz?", kb)
 
 
-@dp.callback_query_handler(IsAdmin(), text='adm:student:edit:name', state='*')
+@router.callback('adm:student:edit:name')
 async def student_edit_name_start(call: types.CallbackQuery, state: FSMContext):
     data = await state.get_data()
     if 'student_id' not in data:
@@ -247,7 +218,7 @@ async def student_edit_name_start(call: types.CallbackQuery, state: FSMContext):
     await call.answer()
 
 
-@dp.callback_query_handler(IsAdmin(), text='adm:student:edit:phone', state='*')
+@router.callback('adm:student:edit:phone')
 async def student_edit_phone_start(call: types.CallbackQuery, state: FSMContext):
     data = await state.get_data()
     if 'student_id' not in data:
@@ -263,7 +234,14 @@ async def student_edit_name_save(message: types.Message, state: FSMContext):
     new_name = message.text.strip()
     data = await state.get_data()
     sid = data.get('student_id')
-    await sync_to_async(Student.objects.filter(id=sid).update)(full_name=new_name)
+
+    # save() rather than update(): the search keys are derived from the name and phone
+    def _save():
+        student = Student.objects.get(id=sid)
+        student.full_name = new_name
+        student.save(update_fields=['full_name'])
+
+    await db_async(_save)()
     await state.finish()
     await message.answer("✅ Ism yangilandi.")
 
@@ -273,18 +251,23 @@ async def student_edit_phone_save(message: types.Message, state: FSMContext):
     new_phone = message.text.strip()
     data = await state.get_data()
     sid = data.get('student_id')
-    await sync_to_async(Student.objects.filter(id=sid).update)(phone_number=new_phone)
+
+    def _save():
+        student = Student.objects.get(id=sid)
+        student.phone_number = new_phone
+        student.save(update_fields=['phone_number'])
+
+    await db_async(_save)()
     await state.finish()
     await message.answer("✅ Telefon yangilandi.")
 
 
-@dp.callback_query_handler(IsAdmin(), lambda c: c.data.startswith('adm:student:') and c.data.endswith(':add_to_group'), state='*')
-async def student_add_to_group(call: types.CallbackQuery, state: FSMContext):
+@router.callback('adm:student:{sid:int}:add_to_group')
+async def student_add_to_group(call: types.CallbackQuery, state: FSMContext, sid: int):
     await state.finish()
-    sid = int(call.data.split(':')[2])
     await state.update_data(student_id=sid)
 
-    groups = await sync_to_async(lambda: list(Group.objects.all().order_by('title')))()
+    groups = await db_async(lambda: list(Group.objects.all().order_by('title')))()
     if not groups:
         await call.answer("Guruhlar mavjud emas.", show_alert=True)
         return
@@ -299,9 +282,8 @@ async def student_add_to_group(call: types.CallbackQuery, state: FSMContext):
     await call.answer()
 
 
-@dp.callback_query_handler(IsAdmin(), lambda c: c.data.startswith('adm:add_to_group:'), state=AddStudentToGroupState.group_id)
-async def student_add_to_group_save(call: types.CallbackQuery, state: FSMContext):
-    gid = int(call.data.split(':')[-1])
+@router.callback('adm:add_to_group:{gid:int}', state=AddStudentToGroupState.group_id)
+async def student_add_to_group_save(call: types.CallbackQuery, state: FSMContext, gid: int):
     data = await state.get_data()
     sid = data.get('student_id')
 
@@ -311,7 +293,7 @@ async def student_add_to_group_save(call: types.CallbackQuery, state: FSMContext
         if created:
             obj.save()
         return created
-    created = await sync_to_async(_create)()
+    created = await db_async(_create)()
 
     await state.finish()
     # Show confirmation with next-step buttons
@@ -325,7 +307,7 @@ async def student_add_to_group_save(call: types.CallbackQuery, state: FSMContext
     await call.answer()
 
 
-@dp.callback_query_handler(IsAdmin(), text='adm:students:create', state='*')
+@router.callback('adm:students:create')
 async def create_student_start(call: types.CallbackQuery, state: FSMContext):
     await state.finish()
     await call.message.answer("Yangi o'quvchi F.I.Sh ni kiriting:", reply_markup=st_kb_cancel())
@@ -373,7 +355,7 @@ async def create_student_name(message: types.Message, state: FSMContext):
 async def create_student_phone_skip(message: types.Message, state: FSMContext):
     data = await state.get_data()
     full_name = data.get('full_name')
-    student = await sync_to_async(Student.objects.create)(full_name=full_name)
+    student = await db_async(Student.objects.create)(full_name=full_name)
     await state.finish()
     kb = types.InlineKeyboardMarkup(row_width=2)
     kb.add(
@@ -391,7 +373,7 @@ async def create_student_save(message: types.Message, state: FSMContext):
     data = await state.get_data()
     full_name = data.get('full_name')
     phone = message.text.strip() if message.text else None
-    student = await sync_to_async(Student.objects.create)(full_name=full_name, phone_number=phone)
+    student = await db_async(Student.objects.create)(full_name=full_name, phone_number=phone)
     await state.finish()
     kb = types.InlineKeyboardMarkup(row_width=2)
     kb.add(
@@ -404,49 +386,13 @@ async def create_student_save(message: types.Message, state: FSMContext):
 
 # =================== Global Debtors (Main menu) ===================
 
-@dp.callback_query_handler(IsAdmin(), lambda c: c.data.startswith('adm:debtors:p:'), state='*')
-async def global_debtors_paged(call: types.CallbackQuery, state: FSMContext):
-    from django.utils import timezone
-    from django.db.models import Sum
-    now = timezone.now()
-    cur_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-
-    # Build student -> (due_current_sum, debt_total_sum)
-    enr_qs = Enrollment.objects.filter(is_active=True).select_related('student')
-
-    # Accumulate per student
-    def compute_items():
-        agg = {}
-        for e in enr_qs:
-            paid_m = Payment.objects.filter(enrollment=e, month=cur_month.date()).aggregate(total=Sum('amount')).get('total') or 0
-            need_m = e.monthly_fee or 0
-            due_m = max(need_m - paid_m, 0)
-            joined_m = cur_month.replace(year=e.joined_at.year, month=e.joined_at.month)
-            months = max((cur_month.year - joined_m.year) * 12 + (cur_month.month - joined_m.month) + 1, 1)
-            expected = months * (e.monthly_fee or 0)
-            paid_total = Payment.objects.filter(enrollment=e, month__gte=joined_m.date(), month__lte=cur_month.date()).aggregate(total=Sum('amount')).get('total') or 0
-            debt_total = max(expected - paid_total, 0)
-            sid = e.student_id
-            name = e.student.full_name
-            if sid not in agg:
-                agg[sid] = [name, 0, 0]
-            agg[sid][1] += due_m
-            agg[sid][2] += debt_total
-        # Prepare items, filter those with any debt
-        items = [(name, dm, dt) for _, (name, dm, dt) in agg.items() if dm > 0 or dt > 0]
-        # Sort by total debt desc, then current due desc, then name
-        items.sort(key=lambda x: (x[2], x[1], x[0]), reverse=True)
-        return items
-
-    items = await sync_to_async(compute_items)()
-
-    page = int(call.data.split(':')[-1])
-    total = len(items)
-    page_size = 10
-    total_pages = max((total + page_size - 1) // page_size, 1)
-    page = max(min(page, total_pages), 1)
-    offset = (page - 1) * page_size
-    page_items = items[offset:offset+page_size]
+@router.callback('adm:debtors:p:{page:int}')
+@router.callback('adm:debtors:p:{page:int}:{cursor}')
+async def global_debtors_paged(call: types.CallbackQuery, state: FSMContext, page: int, cursor: str | None = None):
+    # Per-student (current month due, total debt), sorted and paginated in the database
+    result = await db_async(DEBTORS_KEYSET.page)(debtors_queryset(), cursor, page)
+    page, total_pages = result.number, result.total_pages
+    page_items = [(row['name'], row['due'], row['debt']) for row in result.items]
 
     lines = [
         "💳 Qarzdorlar (eng ko'pdan kamga):",
@@ -467,7 +413,7 @@ async def global_debtors_paged(call: types.CallbackQuery, state: FSMContext):
     text = "\n".join([l for l in lines if l is not None]).rstrip()
 
     kb = types.InlineKeyboardMarkup(row_width=2)
-    nav = simple_pager('adm:debtors', page, total_pages)
+    nav = simple_pager('adm:debtors', page, total_pages, cursors=result.cursors)
     if nav and nav.inline_keyboard:
         for row in nav.inline_keyboard:
             kb.row(*row)
@@ -45,12 +45,13 @@ async def errors_handler(update, exception):
         logging.exception(f'InvalidQueryID: {exception} \nUpdate: {update}')
         return True
 
+    if isinstance(exception, RetryAfter):
+        # The bot already waited and retried (bot.utils.send_queue.ThrottledBot)
+        logging.warning(f'RetryAfter after retries: {exception} \nUpdate: {update}')
+        return True
     if isinstance(exception, TelegramAPIError):
         logging.exception(f'TelegramAPIError: {exception} \nUpdate: {update}')
         return True
-    if isinstance(exception, RetryAfter):
-        logging.exception(f'RetryAfter: {exception} \nUpdate: {update}')
-        return True
     if isinstance(exception, CantParseEntities):
         logging.exception(f'CantParseEntities: {exception} \nUpdate: {update}')
         return True
@@ -1,32 +1,183 @@
+import asyncio
+
 from aiogram import types
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
 from bot.loader import dp, db
 from bot.filters import IsAdmin
+from bot.data.config import INLINE_CACHE_SIZE, INLINE_CACHE_TTL
+from bot.utils.cache import LRUCache, TTLCache
+from bot.utils.db_api.executor import db_async
+from bot.utils.search_index import student_index
+from main.ledger import current_month
+from main.rollups import as_month
+from main.models import Enrollment, Group, Payment, Student
+from main.reports import month_status
+from main.signals import payments_recorded
+
+PAGE_SIZE = 25
+
+# user_id -> LRUCache of (query, offset) -> (students, next_offset); statuses are added per answer
+result_caches = {}
+# (student_id, month) -> (fee, paid, due), see main.reports.month_status
+status_cache = TTLCache(ttl=INLINE_CACHE_TTL)
+# user_id -> task rendering that user's latest query
+_searches = {}
+
+
+@receiver([post_save, post_delete], sender=Student, dispatch_uid='inline_result_cache')
+@receiver([post_save, post_delete], sender=Enrollment, dispatch_uid='inline_result_cache')
+@receiver(post_save, sender=Group, dispatch_uid='inline_result_cache')
+def _forget_results(sender, instance=None, **kwargs):
+    # Names, phones and group titles are part of the cached pages
+    transaction.on_commit(clear_result_caches)
+    if sender is Enrollment:
+        # Fee and active flag feed the student's status
+        transaction.on_commit(lambda: status_cache.invalidate((instance.student_id, current_month())))
+
+
+@receiver([post_save, post_delete], sender=Payment, dispatch_uid='inline_status_cache')
+def _forget_payment_status(sender, instance: Payment, **kwargs):
+    # Only the paying student's current-month status changes; result pages stay
+    enrollments = [(instance.enrollment_id, instance.month)]
+    prev = getattr(instance, '_rollup_prev', None)  # set by main.signals when an existing payment is edited
+    if prev is not None:
+        enrollments.append((prev[3], prev[1]))
+    transaction.on_commit(lambda: forget_statuses(enrollments))
+
+
+@receiver(payments_recorded, dispatch_uid='inline_status_cache')
+def _forget_recorded_statuses(sender, payments, **kwargs):
+    forget_statuses([(p.enrollment_id, p.month) for p in payments])
+
+
+def clear_result_caches():
+    for cache in list(result_caches.values()):
+        cache.invalidate()
+
+
+def forget_statuses(enrollment_months):
+    """Drop the cached statuses touched by payments on these (enrollment_id, month) pairs."""
+    month = current_month()
+    enrollment_ids = {eid for eid, m in enrollment_months if as_month(m) == month}
+    if not enrollment_ids or not len(status_cache):
+        return
+    for student_id in Enrollment.objects.filter(id__in=enrollment_ids).values_list('student_id', flat=True):
+        status_cache.invalidate((student_id, month))
+
+
+def fmt_amount(n: int) -> str:
+    try:
+        return f"{int(n):,}".replace(",", " ")
+    except Exception:
+        return str(n)
+
+
+async def payment_statuses(student_ids: list) -> dict:
+    """Current-month (fee, paid, due) per student; uncached ones come from one grouped query."""
+    month = current_month()
+    statuses, missing = {}, []
+    for sid in student_ids:
+        status = status_cache.get((sid, month))
+        if status is None:
+            missing.append(sid)
+        else:
+            statuses[sid] = status
+    if missing:
+        fetched = await db_async(month_status)(missing, month)
+        for sid in missing:
+            statuses[sid] = fetched.get(sid, (0, 0, 0))
+            status_cache.set((sid, month), statuses[sid])
+    return statuses
+
+
+def _status_line(fee: int, paid: int, due: int) -> str | None:
+    if not fee:
+        return None
+    if not due:
+        return "✅ Joriy oy to'langan"
+    if paid:
+        return f"🟡 Qisman: {fmt_amount(due)} so'm qoldi"
+    return f"🔴 To'lanmagan: {fmt_amount(due)} so'm"
+
+
+def _description(student, status) -> str:
+    titles = getattr(student, 'group_titles', ())
+    line = f"{student.phone_number or '-'} · {', '.join(titles)}" if titles else (student.phone_number or '-')
+    status_line = _status_line(*status) if status else None
+    return f"{line}\n{status_line}" if status_line else line
+
+
+def _article(s, status=None) -> types.InlineQueryResultArticle:
+    kb = InlineKeyboardMarkup(row_width=2)
+    kb.add(
+        InlineKeyboardButton("O'quvchini ochish", callback_data=f"adm:student:{s.id}"),
+        InlineKeyboardButton("💵 To'lov qilish", callback_data=f"pay:st:{s.id}"),
+    )
+    return types.InlineQueryResultArticle(
+        id=f"student-{s.id}",
+        title=s.full_name,
+        description=_description(s, status),
+        input_message_content=types.InputTextMessageContent(
+            message_text=f"👤 {s.full_name} — {s.phone_number or '-'}"
+        ),
+        reply_markup=kb,
+    )
+
+
+async def find_page(q: str, offset: int):
+    """(students, next_offset) for one page; one extra match tells whether another page exists."""
+    # Answered from memory when the index is loaded; the database otherwise
+    students = student_index.search(q, limit=offset + PAGE_SIZE + 1)
+    if students is None:
+        students = await db.search_students(query=q, limit=PAGE_SIZE + 1, offset=offset)
+    else:
+        students = students[offset:]
+    next_offset = str(offset + PAGE_SIZE) if len(students) > PAGE_SIZE else ''
+    return students[:PAGE_SIZE], next_offset
+
+
+async def render_page(students: list) -> list:
+    statuses = await payment_statuses([s.id for s in students])
+    return [_article(s, statuses.get(s.id)) for s in students]
+
+
+async def answer_page(cache: LRUCache, q: str, offset: int):
+    """(results, next_offset), the students from the user's cache when there."""
+    page = cache.get((q, offset))
+    if page is None:
+        page = await find_page(q, offset)
+        cache.set((q, offset), page)
+    students, next_offset = page
+    return await render_page(students), next_offset
 
 
 @dp.inline_handler(IsAdmin())
 async def inline_search_students(query: types.InlineQuery):
     q = (query.query or '').strip()
+    offset = int(query.offset) if (query.offset or '').isdigit() else 0
+    user_id = query.from_user.id
+
+    cache = result_caches.get(user_id)
+    if cache is None:
+        cache = result_caches[user_id] = LRUCache(maxsize=INLINE_CACHE_SIZE, ttl=INLINE_CACHE_TTL)
+
+    # A newer keystroke makes the previous search pointless, cached or not; pending DB
+    # work is dropped from the pool queue
+    previous = _searches.get(user_id)
+    if previous is not None and not previous.done():
+        previous.cancel()
+    task = asyncio.ensure_future(answer_page(cache, q, offset))
+    _searches[user_id] = task
+    await asyncio.wait({task})
+    if _searches.get(user_id) is not task:
+        return  # superseded, even if it finished first
+    del _searches[user_id]
+    if task.cancelled():
+        return
 
-    students = await db.search_students(query=q, limit=25) if q else await db.search_students(query='', limit=25)
-
-    results = []
-    for s in students:
-        kb = InlineKeyboardMarkup(row_width=2)
-        kb.add(
-            InlineKeyboardButton("O'quvchini ochish", callback_data=f"adm:student:{s.id}"),
-            InlineKeyboardButton("💵 To'lov qilish", callback_data=f"pay:st:{s.id}"),
-        )
-        results.append(
-            types.InlineQueryResultArticle(
-                id=f"student-{s.id}",
-                title=s.full_name,
-                description=s.phone_number or '-',
-                input_message_content=types.InputTextMessageContent(
-                    message_text=f"👤 {s.full_name} — {s.phone_number or '-'}"
-                ),
-                reply_markup=kb,
-            )
-        )
-
-    await query.answer(results, cache_time=1, is_personal=True)
+    results, next_offset = task.result()
+    await query.answer(results, cache_time=1, is_personal=True, next_offset=next_offset)
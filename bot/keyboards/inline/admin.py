@@ -35,9 +35,17 @@ def finance_menu_kb() -> InlineKeyboardMarkup:
     return kb
 
 
-def pager_buttons(prefix: str, page: int, total_pages: int, extra: str = ""):
+def pager_buttons(prefix: str, page: int, total_pages: int, extra: str = "", cursors: tuple | None = None):
     # prefix example: adm:groups or adm:students
     btns = []
+    if cursors is not None:
+        # Keyset pages (bot.utils.db_api.keyset): {prefix}:p:{page}:{cursor}
+        prev_cursor, next_cursor = cursors
+        if prev_cursor:
+            btns.append(InlineKeyboardButton("⬅️ Oldingi", callback_data=f"{prefix}:p:{page-1}:{prev_cursor}{extra}"))
+        if next_cursor:
+            btns.append(InlineKeyboardButton("Keyingi ➡️", callback_data=f"{prefix}:p:{page+1}:{next_cursor}{extra}"))
+        return btns
     if page > 1:
         btns.append(InlineKeyboardButton("⬅️ Oldingi", callback_data=f"{prefix}:p:{page-1}{extra}"))
     if page < total_pages:
@@ -47,25 +55,28 @@ def pager_buttons(prefix: str, page: int, total_pages: int, extra: str = ""):
 
 # Groups
 
-def groups_list_kb(groups, page: int, total_pages: int):
+def groups_list_kb(groups, page: int, total_pages: int, cursors: tuple | None = None):
     kb = InlineKeyboardMarkup(row_width=1)
     for g in groups:
         kb.add(InlineKeyboardButton(f"{g.title}", callback_data=f"adm:group:{g.id}"))
     kb.add(InlineKeyboardButton("➕ Yangi guruh", callback_data="adm:groups:create"))
     # Pagination row
-    nav = pager_buttons("adm:groups", page, total_pages)
+    nav = pager_buttons("adm:groups", page, total_pages, cursors=cursors)
     if nav:
         kb.row(*nav)
     kb.add(InlineKeyboardButton("⬅️ Orqaga", callback_data="adm:back:home"))
     return kb
 
 
-def group_item_kb(group_id: int) -> InlineKeyboardMarkup:
+def group_item_kb(group_id: int, status_board: bool = False) -> InlineKeyboardMarkup:
     kb = InlineKeyboardMarkup(row_width=2)
     kb.add(
         InlineKeyboardButton("🧑‍🎓 O'quvchilar", callback_data=f"adm:group:{group_id}:students:p:1"),
         InlineKeyboardButton("💳 Qarzdorlar", callback_data=f"adm:group:{group_id}:debtors:p:1"),
     )
+    kb.add(InlineKeyboardButton("✅ Guruh to'lovi (oy uchun)", callback_data=f"adm:group:{group_id}:bulkpay"))
+    board_state = "yoqilgan" if status_board else "o'chirilgan"
+    kb.add(InlineKeyboardButton(f"📌 Holat taxtasi: {board_state}", callback_data=f"adm:group:{group_id}:board"))
     kb.add(
         InlineKeyboardButton("⬅️ Guruhlarga qaytish", callback_data="adm:groups:p:1"),
         InlineKeyboardButton("⬅️ Asosiy menyu", callback_data="adm:back:home"),
@@ -73,9 +84,34 @@ def group_item_kb(group_id: int) -> InlineKeyboardMarkup:
     return kb
 
 
-def group_students_kb(group_id: int, page: int, total_pages: int) -> InlineKeyboardMarkup:
+def group_bulk_months_kb(group_id: int, months) -> InlineKeyboardMarkup:
+    """months: (YYYY-MM, label) pairs."""
+    kb = InlineKeyboardMarkup(row_width=1)
+    for value, label in months:
+        kb.add(InlineKeyboardButton(f"📅 {label}", callback_data=f"adm:group:{group_id}:bulkpay:{value}"))
+    kb.add(InlineKeyboardButton("⬅️ Guruhga qaytish", callback_data=f"adm:group:{group_id}"))
+    return kb
+
+
+def group_bulk_pay_kb(group_id: int, rows, selected) -> InlineKeyboardMarkup:
+    """rows: (enrollment id, label) pairs; selected: the ticked enrollment ids."""
+    kb = InlineKeyboardMarkup(row_width=2)
+    for enrollment_id, label in rows:
+        mark = "☑️" if enrollment_id in selected else "⬜"
+        kb.add(InlineKeyboardButton(f"{mark} {label}", callback_data=f"bulkpay:t:{enrollment_id}"))
+    kb.add(
+        InlineKeyboardButton("☑️ Hammasi", callback_data="bulkpay:all"),
+        InlineKeyboardButton("⬜ Hech biri", callback_data="bulkpay:none"),
+    )
+    if selected:
+        kb.add(InlineKeyboardButton(f"✅ Tasdiqlash ({len(selected)} ta)", callback_data="bulkpay:ok"))
+    kb.add(InlineKeyboardButton("❌ Bekor qilish", callback_data=f"bulkpay:cancel:{group_id}"))
+    return kb
+
+
+def group_students_kb(group_id: int, page: int, total_pages: int, cursors: tuple | None = None) -> InlineKeyboardMarkup:
     kb = InlineKeyboardMarkup(row_width=2)
-    nav = pager_buttons(f"adm:group:{group_id}:students", page, total_pages)
+    nav = pager_buttons(f"adm:group:{group_id}:students", page, total_pages, cursors=cursors)
     if nav:
         kb.row(*nav)
     kb.add(
@@ -87,12 +123,12 @@ def group_students_kb(group_id: int, page: int, total_pages: int) -> InlineKeybo
 
 # Students
 
-def students_list_kb(students, page: int, total_pages: int) -> InlineKeyboardMarkup:
+def students_list_kb(students, page: int, total_pages: int, cursors: tuple | None = None) -> InlineKeyboardMarkup:
     kb = InlineKeyboardMarkup(row_width=1)
     for s in students:
         kb.add(InlineKeyboardButton(f"{s.full_name}", callback_data=f"adm:student:{s.id}"))
     kb.add(InlineKeyboardButton("➕ Yangi o'quvchi", callback_data="adm:students:create"))
-    nav = pager_buttons("adm:students", page, total_pages)
+    nav = pager_buttons("adm:students", page, total_pages, cursors=cursors)
     if nav:
         kb.row(*nav)
     kb.add(InlineKeyboardButton("⬅️ Orqaga", callback_data="adm:back:home"))
@@ -108,12 +144,15 @@ def student_item_kb(student_id: int) -> InlineKeyboardMarkup:
 
 # Payments
 
-def payments_list_kb(page: int, total_pages: int) -> InlineKeyboardMarkup:
+def payments_list_kb(page: int, total_pages: int, cursors: tuple | None = None) -> InlineKeyboardMarkup:
     kb = InlineKeyboardMarkup(row_width=2)
-    nav = pager_buttons("adm:payments", page, total_pages)
+    nav = pager_buttons("adm:payments", page, total_pages, cursors=cursors)
     if nav:
         kb.row(*nav)
-    kb.add(InlineKeyboardButton("🔎 Filterlar", callback_data="adm:payments:filters"))
+    kb.add(
+        InlineKeyboardButton("🔎 Filterlar", callback_data="adm:payments:filters"),
+        InlineKeyboardButton("📤 Eksport", callback_data="adm:payments:export"),
+    )
     kb.add(InlineKeyboardButton("⬅️ Orqaga", callback_data="adm:back:home"))
     return kb
 
@@ -131,9 +170,9 @@ def search_students_kb() -> InlineKeyboardMarkup:
 
 # Generic simple pager (optional helper)
 
-def simple_pager(prefix: str, page: int, total_pages: int) -> InlineKeyboardMarkup:
+def simple_pager(prefix: str, page: int, total_pages: int, cursors: tuple | None = None) -> InlineKeyboardMarkup:
     kb = InlineKeyboardMarkup(row_width=2)
-    nav = pager_buttons(prefix, page, total_pages)
+    nav = pager_buttons(prefix, page, total_pages, cursors=cursors)
     if nav:
         kb.row(*nav)
     return kb
\ No newline at end of file
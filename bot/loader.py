@@ -1,12 +1,22 @@
-from aiogram import Bot, Dispatcher, types
+from aiogram import Dispatcher, types
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from bot.data import config
+from bot.utils.callback_router import CallbackRouter
 from bot.utils.db_api.db import DB
+from bot.utils.send_queue import RateLimiter, SendQueue, ThrottledBot
 
 
-bot = Bot(token=config.BOT_TOKEN, parse_mode="HTML")
+# Every sending call waits for Telegram's rate limits (see bot.utils.send_queue)
+bot = ThrottledBot(
+    token=config.BOT_TOKEN,
+    parse_mode="HTML",
+    limiter=RateLimiter(config.SEND_RATE, config.SEND_GROUP_RATE),
+)
+# Messages nobody waits on (notifications) go through the queue
+send_queue = SendQueue(bot, maxsize=config.SEND_QUEUE_SIZE, workers=config.SEND_WORKERS)
 storage = MemoryStorage()
 dp = Dispatcher(bot, storage=storage)
 db = DB()
-
-
+# Admin callbacks; registered first so unmatched data still reaches later handlers
+router = CallbackRouter(admin_check=db.is_admin)
+router.setup(dp)
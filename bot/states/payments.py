@@ -8,3 +8,12 @@ class AcceptPayment(StatesGroup):
     select_month = State()  # choose from suggested months via inline
     enter_custom_month = State()  # optional manual entry YYYY-MM
     confirm = State()
+
+
+class BulkPayment(StatesGroup):
+    select = State()  # tick the group's enrollments to mark paid for the month
+
+
+class ImportPayments(StatesGroup):
+    wait_input = State()  # a message or .txt/.csv file with the payment lines
+    confirm = State()
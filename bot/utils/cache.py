@@ -0,0 +1,181 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+# Handed to waiters when the caller computing for them was cancelled
+_RETRY = object()
+
+
+class SingleFlightCache:
+    """
+    In-process cache for expensive async computations.
+
+    Concurrent misses for the same key share one in-flight computation instead
+    of each starting their own. `invalidate()` may be called from any thread
+    (e.g. Django signal handlers running on the DB pool); a computation
+    that was already running when it was called is handed to its waiters but
+    not stored. Waiters get the computation's exception too, except when the
+    caller running it is cancelled: they retry then, and one of them computes.
+    """
+
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = ttl
+        self._values = {}  # key -> (expires_at | None, value)
+        self._inflight = {}  # key -> asyncio.Future
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.invalidations = 0
+
+    def invalidate(self):
+        self._generation += 1
+        self._values = {}
+        self.invalidations += 1
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared": self.shared,
+            "invalidations": self.invalidations,
+            "size": len(self._values),
+        }
+
+    async def get(self, key: Hashable, compute: Callable[[], Awaitable[Any]]):
+        while True:
+            entry = self._values.get(key)
+            if entry is not None and (entry[0] is None or entry[0] > time.monotonic()):
+                self.hits += 1
+                return entry[1]
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            self.shared += 1
+            # shield: a cancelled waiter must not cancel the shared computation
+            value = await asyncio.shield(inflight)
+            if value is not _RETRY:
+                return value
+
+        self.misses += 1
+        generation = self._generation
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+        except asyncio.CancelledError:
+            # Only this caller was cancelled; the waiters still want a value
+            future.set_result(_RETRY)
+            raise
+        except BaseException as err:
+            future.set_exception(err)
+            future.exception()  # mark retrieved when nobody else was waiting
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+        future.set_result(value)
+        if generation == self._generation:
+            expires_at = time.monotonic() + self.ttl if self.ttl else None
+            self._values[key] = (expires_at, value)
+        return value
+
+
+class TTLCache:
+    """Small dict cache whose entries expire `ttl` seconds after they are set.
+
+    Expired entries are dropped by `set()`, at most once per `ttl`, so keys
+    that are never read again do not pile up.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._values = {}  # key -> (expires_at, value)
+        self._purge_at = time.monotonic() + ttl
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, key: Hashable, default=None):
+        entry = self._values.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value):
+        now = time.monotonic()
+        self._values[key] = (now + self.ttl, value)
+        if now >= self._purge_at:
+            self._purge_at = now + self.ttl
+            self._purge(now)
+
+    def _purge(self, now: float):
+        # In place and over a snapshot: invalidate() may run on another thread meanwhile
+        values = self._values
+        for key, entry in list(values.items()):
+            if entry[0] <= now and values.get(key) is entry:
+                values.pop(key, None)
+
+    def invalidate(self, key: Hashable = None):
+        """Drop one key, or everything when no key is given."""
+        if key is None:
+            self._values = {}
+        else:
+            self._values.pop(key, None)
+
+
+class LRUCache:
+    """TTLCache that also holds at most `maxsize` entries, evicting the least recently used.
+
+    `invalidate()` may run on another thread (e.g. after commit on the DB pool)
+    while the loop is in `get()`/`set()`: those work on the dict they read once
+    and tolerate a key that disappears halfway.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._values = OrderedDict()  # key -> (expires_at, value), oldest use first
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, key: Hashable, default=None):
+        values = self._values
+        entry = values.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            try:
+                values.move_to_end(key)
+            except KeyError:
+                pass  # invalidated meanwhile; the value read is still answered
+            self.hits += 1
+            return entry[1]
+        if entry is not None:
+            values.pop(key, None)
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value):
+        values = self._values
+        values[key] = (time.monotonic() + self.ttl, value)
+        try:
+            values.move_to_end(key)
+            while len(values) > self.maxsize:
+                values.popitem(last=False)
+        except KeyError:
+            pass
+
+    def invalidate(self, key: Hashable = None):
+        """Drop one key, or everything when no key is given."""
+        if key is None:
+            self._values = OrderedDict()
+        else:
+            self._values.pop(key, None)
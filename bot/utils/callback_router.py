@@ -0,0 +1,171 @@
+"""Callback query routing through a prefix trie.
+
+Handlers register colon-separated patterns with typed parameters:
+
+    @router.callback('adm:group:{group_id:int}:debtors:p:{page:int}')
+    async def group_debtors(call, state, group_id: int, page: int): ...
+
+`callback_data` is split once and walked segment by segment, so matching costs
+the same however many routes exist. Literal segments win over parameters
+(`adm:student:edit:name` is not read as a student id). The FSM state and the
+admin check are looked up at most once per update, and only for a matching route.
+
+The router sits in front of the dispatcher as a single callback handler; data
+that matches no route falls through to the handlers registered after it.
+"""
+import re
+from typing import Awaitable, Callable, Optional
+
+from aiogram import Dispatcher, types
+from aiogram.dispatcher import FSMContext
+
+CONVERTERS = {
+    'str': str,
+    'int': int,
+}
+
+
+class Route:
+    __slots__ = ('pattern', 'handler', 'states', 'admin')
+
+    def __init__(self, pattern: str, handler, states, admin: bool):
+        self.pattern = pattern
+        self.handler = handler
+        self.states = states  # None means any state
+        self.admin = admin
+
+    def accepts_state(self, state: Optional[str]) -> bool:
+        return self.states is None or state in self.states
+
+
+class _Node:
+    __slots__ = ('literals', 'params', 'routes')
+
+    def __init__(self):
+        self.literals = {}
+        self.params = []  # [(name, converter, node)]
+        self.routes = []
+
+
+def _normalize_states(state) -> Optional[frozenset]:
+    """Same conventions as aiogram's `state=` argument ('*', None, State, StatesGroup, list)."""
+    if state == '*':
+        return None
+    if not isinstance(state, (list, tuple, set, frozenset)):
+        state = [state]
+    names = set()
+    for s in state:
+        if s == '*':
+            return None
+        if isinstance(s, type):  # StatesGroup
+            names.update(s.all_states_names)
+        else:
+            names.add(getattr(s, 'state', s))
+    return frozenset(names)
+
+
+class CallbackRouter:
+    def __init__(self, admin_check: Callable[[int], Awaitable[bool]], separator: str = ':'):
+        self.admin_check = admin_check
+        self.separator = separator
+        self._root = _Node()
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    # -----------------------------
+    # Registration
+    # -----------------------------
+
+    def add(self, pattern: str, handler, state='*', admin: bool = True):
+        node = self._root
+        # Split on separators outside `{...}` so `{page:int}` stays one segment
+        for segment in re.split(re.escape(self.separator) + r'(?![^{]*\})', pattern):
+            if segment.startswith('{') and segment.endswith('}'):
+                name, _, kind = segment[1:-1].partition(':')
+                converter = CONVERTERS[kind or 'str']
+                for p_name, p_conv, p_node in node.params:
+                    if p_name == name and p_conv is converter:
+                        node = p_node
+                        break
+                else:
+                    child = _Node()
+                    node.params.append((name, converter, child))
+                    node = child
+            else:
+                node = node.literals.setdefault(segment, _Node())
+        node.routes.append(Route(pattern, handler, _normalize_states(state), admin))
+        self._count += 1
+
+    def callback(self, pattern: str, state='*', admin: bool = True):
+        """Decorator form of `add()`; the handler is returned unchanged."""
+        def decorator(handler):
+            self.add(pattern, handler, state=state, admin=admin)
+            return handler
+        return decorator
+
+    # -----------------------------
+    # Lookup
+    # -----------------------------
+
+    def candidates(self, data: str) -> list:
+        """Every (route, params) matching `data`, most specific first."""
+        segments = data.split(self.separator)
+        found = []
+
+        def walk(node: _Node, i: int, params: dict):
+            if i == len(segments):
+                found.extend((route, params) for route in node.routes)
+                return
+            segment = segments[i]
+            child = node.literals.get(segment)
+            if child is not None:
+                walk(child, i + 1, params)
+            for name, converter, p_node in node.params:
+                try:
+                    value = converter(segment)
+                except ValueError:
+                    continue
+                walk(p_node, i + 1, {**params, name: value})
+
+        walk(self._root, 0, {})
+        return found
+
+    async def resolve(self, call: types.CallbackQuery, state: FSMContext):
+        """The (route, params) to run for this callback, or None."""
+        if not call.data:
+            return None
+        candidates = self.candidates(call.data)
+        if not candidates:
+            return None
+        current_state = None
+        if any(route.states is not None for route, _ in candidates):
+            current_state = await state.get_state()
+        is_admin = None
+        for route, params in candidates:
+            if not route.accepts_state(current_state):
+                continue
+            if route.admin:
+                if is_admin is None:
+                    is_admin = await self.admin_check(call.from_user.id)
+                if not is_admin:
+                    continue
+            return route, params
+        return None
+
+    # -----------------------------
+    # Dispatcher glue
+    # -----------------------------
+
+    def setup(self, dp: Dispatcher):
+        """Register the router as one callback handler, ahead of any registered later."""
+        async def route_filter(call: types.CallbackQuery):
+            match = await self.resolve(call, dp.current_state())
+            return {'route_match': match} if match else False
+
+        async def route_handler(call: types.CallbackQuery, state: FSMContext, route_match):
+            route, params = route_match
+            return await route.handler(call, state, **params)
+
+        dp.register_callback_query_handler(route_handler, route_filter, state='*')
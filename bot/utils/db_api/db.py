@@ -1,23 +1,48 @@
-from asgiref.sync import sync_to_async
+from bot.utils.cache import TTLCache
+from bot.utils.db_api.executor import db_async
+from bot.utils.db_api.keyset import Keyset, KeysetPage
 import logging
 from apps.botapp.models import BotUser
-from bot.data.config import ADMINS
-from typing import List, Tuple, Optional
-from django.db.models import Q
+from bot.data.config import ADMINS, ADMIN_CACHE_TTL
+from typing import List, Optional
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from main import search
 from main.models import Student, Enrollment
-import math
+
+# Admins from the environment never need a lookup
+ENV_ADMINS = frozenset(str(a).strip() for a in ADMINS)
+
+# user_id -> is_admin for BotUser lookups. Saves in this process (make_admin,
+# remove_admin, the /admin command) drop the entry at once; the TTL covers
+# changes made from the admin site.
+admin_cache = TTLCache(ttl=ADMIN_CACHE_TTL)
+
+STUDENTS_KEYSET = Keyset(('full_name', 'id'))
+
+
+@receiver([post_save, post_delete], sender=BotUser, dispatch_uid='bot_admin_cache')
+def _forget_admin(sender, instance: BotUser, **kwargs):
+    user_id = instance.user_id
+    admin_cache.invalidate(user_id)
+    # Again after commit, in case a check cached the old value in between
+    transaction.on_commit(lambda: admin_cache.invalidate(user_id))
 
 
 class DB:
     def __init__(self):
         self.logger = logging.getLogger(__name__)
 
+    # Everything runs on the DB pool, not Django's async ORM: its a* methods go through
+    # sync_to_async(thread_sensitive=True), which serializes them on a single thread and
+    # skips the pool's close_old_connections()
+
     async def get_user(self, user_id):
-        user = await sync_to_async(BotUser.objects.get)(user_id=str(user_id))
-        return user
+        return await db_async(BotUser.objects.get)(user_id=str(user_id))
 
     async def create_user(self, user_id, username, first_name, last_name):
-        user = await sync_to_async(BotUser.objects.update_or_create)(
+        user = await db_async(BotUser.objects.update_or_create)(
             user_id=str(user_id),
             defaults={
                 "username": username,
@@ -31,85 +56,45 @@ class DB:
         user = await self.get_user(user_id)
         for key, value in kwargs.items():
             setattr(user, key, value)
-        await sync_to_async(user.save)()
+        await db_async(user.save)()
         return user
 
     async def delete_user(self, user_id):
         user = await self.get_user(user_id)
-        await sync_to_async(user.delete)()
+        await db_async(user.delete)()
         return user
     
     async def user_exists(self, user_id):
-        exists = await sync_to_async(BotUser.objects.filter(user_id=str(user_id)).exists)()
-        return exists
+        return await db_async(BotUser.objects.filter(user_id=str(user_id)).exists)()
 
     async def get_admins_list(self):
-        admins = await sync_to_async(BotUser.objects.filter(is_admin=True).values_list('user_id', flat=True))() # type: ignore
-        admins_list = list(admins) + ADMINS
-        return admins_list
+        admins = await db_async(lambda: list(BotUser.objects.filter(is_admin=True).values_list('user_id', flat=True)))() # type: ignore
+        return admins + ADMINS
     
     async def is_admin(self, user_id):
-        if str(user_id) in ADMINS:
+        user_id = str(user_id)
+        if user_id in ENV_ADMINS:
             return True
-        is_admin = await sync_to_async(BotUser.objects.filter(user_id=str(user_id), is_admin=True).exists)() # type: ignore
-        return is_admin
+        cached = admin_cache.get(user_id)
+        if cached is not None:
+            return cached
+        result = await db_async(BotUser.objects.filter(user_id=user_id, is_admin=True).exists)() # type: ignore
+        admin_cache.set(user_id, result)
+        return result
 
     # -----------------------------
     # Students helpers
     # -----------------------------
 
-    async def get_students(self, page: int = 1, page_size: int = 10, q: Optional[str] = None) -> Tuple[List[Student], int, int, int]:
-        """Return (items, total_pages, page, total). Optional q searches by name, phone or id."""
-        def _inner():
-            qs = Student.objects.all().order_by('full_name', 'id')
-            if q:
-                text = str(q).strip()
-                if text.isdigit():
-                    qs = qs.filter(Q(id=int(text)) | Q(full_name__icontains=text) | Q(phone_number__icontains=text))
-                else:
-                    qs = qs.filter(Q(full_name__icontains=text) | Q(phone_number__icontains=text))
-            total = qs.count()
-            if page_size <= 0:
-                page_size_local = 10
-            else:
-                page_size_local = page_size
-            total_pages = max(1, math.ceil(total / page_size_local))
-            page_local = min(max(1, page), total_pages)
-            start = (page_local - 1) * page_size_local
-            items = list(qs[start:start + page_size_local])
-            return items, total_pages, page_local, total
-        return await sync_to_async(_inner)()
-
-    async def search_students(self, query: str = "", limit: int = 25) -> List[Student]:
-        def _inner():
-            qs = Student.objects.all().order_by('full_name', 'id')
-            text = (query or '').strip()
-            if text:
-                if text.isdigit():
-                    qs = qs.filter(Q(id=int(text)) | Q(full_name__icontains=text) | Q(phone_number__icontains=text))
-                else:
-                    qs = qs.filter(Q(full_name__icontains=text) | Q(phone_number__icontains=text))
-            return list(qs[:max(1, min(limit, 50))])
-        return await sync_to_async(_inner)()
+    async def get_students(self, cursor: Optional[str] = None, page: int = 1, page_size: int = 10,
+                           q: Optional[str] = None) -> KeysetPage:
+        """Keyset page of students by name. Optional q searches like `search_students`."""
+        qs = search.student_matches(q) if q else Student.objects.all()
+        return await db_async(STUDENTS_KEYSET.page)(qs, cursor, page, page_size)
+
+    async def search_students(self, query: str = "", limit: int = 25, offset: int = 0) -> List[Student]:
+        """Best matches first; see main.search."""
+        return await db_async(search.search_students)(query, max(1, min(limit, 50)), max(offset, 0))
 
     async def search_enrollments(self, query: str = "", limit: int = 25) -> List[Enrollment]:
-        def _inner():
-            qs = Enrollment.objects.select_related('student', 'group').filter(is_active=True)
-            text = (query or '').strip()
-            if text:
-                if text.isdigit():
-                    qs = qs.filter(
-                        Q(student__id=int(text)) |
-                        Q(student__full_name__icontains=text) |
-                        Q(student__phone_number__icontains=text) |
-                        Q(group__title__icontains=text)
-                    )
-                else:
-                    qs = qs.filter(
-                        Q(student__full_name__icontains=text) |
-                        Q(student__phone_number__icontains=text) |
-                        Q(group__title__icontains=text)
-                    )
-            qs = qs.order_by('student__full_name', 'group__title', 'id')
-            return list(qs[:max(1, min(limit, 50))])
-        return await sync_to_async(_inner)()
\ No newline at end of file
+        return await db_async(search.search_enrollments)(query, max(1, min(limit, 50)))
\ No newline at end of file
@@ -0,0 +1,96 @@
+"""Thread pool for ORM work.
+
+`sync_to_async` (thread_sensitive=True) runs every call on one shared thread, so
+concurrent updates queue behind each other's queries. `db_async` runs sync code
+on a pool of `DB_WORKERS` threads instead, each holding its own Django
+connection, and `db_gather` runs independent callables at the same time:
+
+    student, payments = await db_gather(
+        lambda: Student.objects.get(id=sid),
+        lambda: list(Payment.objects.filter(enrollment__student_id=sid)),
+    )
+
+A callable runs entirely on one worker thread, so `transaction.atomic()` blocks
+inside it behave as usual; separate callables must not share a transaction.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections, connections
+
+from bot.data.config import DB_WORKERS
+
+_pool = None
+_pool_lock = threading.Lock()
+_worker_count = 0
+
+
+def _count_worker():
+    global _worker_count
+    with _pool_lock:
+        _worker_count += 1
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(
+                    max_workers=max(DB_WORKERS, 1), thread_name_prefix='db', initializer=_count_worker,
+                )
+    return _pool
+
+
+def _run(func, args, kwargs):
+    # Same handling Django applies around a request: drop this thread's
+    # connection if it broke or outlived CONN_MAX_AGE, otherwise reuse it.
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def db_async(func):
+    """Async wrapper for a sync callable that runs it on the DB pool (like `sync_to_async`)."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_pool(), _run, func, args, kwargs)
+    return wrapper
+
+
+async def db_gather(*funcs):
+    """Run zero-argument sync callables concurrently on the pool; results keep their order."""
+    return await asyncio.gather(*(db_async(f)() for f in funcs))
+
+
+def set_db_workers(count: int):
+    """Resize the pool (e.g. for a benchmark): the next call starts `count` workers."""
+    global DB_WORKERS
+    shutdown_db_pool()
+    DB_WORKERS = count
+
+
+def shutdown_db_pool():
+    """Close every worker's connection and stop the pool."""
+    global _pool, _worker_count
+    with _pool_lock:
+        pool, workers = _pool, _worker_count
+        _pool, _worker_count = None, 0
+    if pool is None:
+        return
+    # The barrier holds each worker until all of them have picked up one task,
+    # so every thread closes its own connection exactly once.
+    barrier = threading.Barrier(workers)
+
+    def _close():
+        connections.close_all()
+        barrier.wait(timeout=10)
+
+    for _ in range(workers):
+        pool.submit(_close)
+    pool.shutdown(wait=True)
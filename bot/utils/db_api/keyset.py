@@ -0,0 +1,189 @@
+"""Keyset (seek) pagination for the bot's list views.
+
+Pages are fetched with `WHERE (sort key) after/before <cursor> ... LIMIT n`
+instead of `OFFSET`, so late pages cost the same as the first one and no
+COUNT runs on every page view (totals are cached for a short while).
+
+Cursors travel in `callback_data` as `<direction><payload>`: `>` for the page
+after the key, `<` for the page before it. Integer, date and datetime keys are
+encoded directly (e.g. `>t1a2b3c4d5e.i2s` for a payment's (paid_at, id));
+keys containing text use the row's primary key instead (`>#2s`), which costs
+one indexed lookup to resolve.
+"""
+from datetime import date, datetime, timezone as dt_timezone
+from functools import reduce
+from operator import and_, or_
+from typing import Optional
+
+from django.db.models import Q
+
+from bot.utils.cache import LRUCache
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+# Counts are only used for "page x of y", so they may lag writes a little. Keyed
+# by the SQL, so one entry per list and filter (e.g. per group); bounded for that.
+count_cache = LRUCache(maxsize=512, ttl=60)
+
+
+def _b36(n: int) -> str:
+    if n < 0:
+        return '-' + _b36(-n)
+    out = ''
+    while True:
+        n, r = divmod(n, 36)
+        out = _DIGITS[r] + out
+        if not n:
+            return out
+
+
+def _encode_value(value) -> Optional[str]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return 'i' + _b36(value)
+    if isinstance(value, datetime):
+        delta = value - _EPOCH
+        return 't' + _b36((delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds)
+    if isinstance(value, date):
+        return 'd' + _b36(value.toordinal())
+    return None
+
+
+def _decode_value(token: str):
+    kind, body = token[0], int(token[1:], 36)
+    if kind == 'i':
+        return body
+    if kind == 't':
+        seconds, micros = divmod(body, 1_000_000)
+        return datetime.fromtimestamp(seconds, dt_timezone.utc).replace(microsecond=micros)
+    if kind == 'd':
+        return date.fromordinal(body)
+    raise ValueError(token)
+
+
+class KeysetPage:
+    def __init__(self, items: list, number: int, total: int, page_size: int,
+                 prev_cursor: Optional[str], next_cursor: Optional[str]):
+        self.items = items
+        self.number = number
+        self.total = total
+        self.page_size = page_size
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+
+    @property
+    def total_pages(self) -> int:
+        return max((self.total + self.page_size - 1) // self.page_size, 1)
+
+    @property
+    def cursors(self) -> tuple:
+        """(prev, next) cursors for `pager_buttons`."""
+        return self.prev_cursor, self.next_cursor
+
+
+class Keyset:
+    """Pagination over a fixed ordering that ends in a unique column.
+
+    `ordering` uses Django's `order_by` syntax; `key` names the unique column
+    used for primary-key cursors (e.g. 'student_id' for grouped rows).
+    Querysets may yield model instances or dicts (`.values()`).
+    """
+
+    def __init__(self, ordering, key: str = 'pk', page_size: int = 10):
+        self.ordering = tuple(ordering)
+        self.fields = tuple(f.lstrip('-') for f in self.ordering)
+        self.descending = tuple(f.startswith('-') for f in self.ordering)
+        self.key = key
+        self.page_size = page_size
+
+    # -----------------------------
+    # Cursors
+    # -----------------------------
+
+    def _row_value(self, row, field):
+        return row[field] if isinstance(row, dict) else getattr(row, field)
+
+    def cursor(self, row, direction: str) -> str:
+        values = [_encode_value(self._row_value(row, f)) for f in self.fields]
+        if all(values):
+            return direction + '.'.join(values)
+        return direction + '#' + _b36(self._row_value(row, self.key))
+
+    def _resolve(self, qs, payload: str) -> Optional[tuple]:
+        if payload.startswith('#'):
+            rows = qs.filter(**{self.key: int(payload[1:], 36)}).order_by().values_list(*self.fields)[:1]
+            return next(iter(rows), None)
+        values = tuple(_decode_value(t) for t in payload.split('.'))
+        return values if len(values) == len(self.fields) else None
+
+    # -----------------------------
+    # Queries
+    # -----------------------------
+
+    def _seek(self, values: tuple, after: bool) -> Q:
+        """Rows strictly after (or before) `values` in this ordering."""
+        alternatives = []
+        for i, (field, desc) in enumerate(zip(self.fields, self.descending)):
+            op = 'lt' if desc == after else 'gt'
+            equal = [Q(**{f: v}) for f, v in zip(self.fields[:i], values[:i])]
+            alternatives.append(reduce(and_, equal + [Q(**{f'{field}__{op}': values[i]})]))
+        # The redundant bound on the leading column lets the index range-scan
+        lead_op = 'lte' if self.descending[0] == after else 'gte'
+        return Q(**{f'{self.fields[0]}__{lead_op}': values[0]}) & reduce(or_, alternatives)
+
+    def _reversed_ordering(self):
+        return [f[1:] if f.startswith('-') else '-' + f for f in self.ordering]
+
+    def total(self, qs) -> int:
+        key = str(qs.query)
+        total = count_cache.get(key)
+        if total is None:
+            total = qs.count()
+            count_cache.set(key, total)
+        return total
+
+    def page(self, qs, cursor: Optional[str] = None, number: int = 1, page_size: Optional[int] = None) -> KeysetPage:
+        """The page at `cursor` (the first page when None). Runs queries; call from the DB pool."""
+        size = max(page_size or self.page_size, 1)
+        values = None
+        if cursor and cursor[0] in '<>':
+            try:
+                values = self._resolve(qs, cursor[1:])
+            except (ValueError, OverflowError):
+                values = None
+        if values is None:
+            number = 1
+
+        if values is not None and cursor[0] == '<':
+            rows = list(qs.filter(self._seek(values, after=False)).order_by(*self._reversed_ordering())[:size + 1])
+            has_prev, has_next = len(rows) > size, True
+            rows = rows[:size][::-1]
+            if not has_prev:
+                number = 1
+        else:
+            base = qs.filter(self._seek(values, after=True)) if values is not None else qs
+            rows = list(base.order_by(*self.ordering)[:size + 1])
+            has_prev, has_next = values is not None, len(rows) > size
+            rows = rows[:size]
+            if not rows and values is not None:
+                # Ran off the end (rows were removed meanwhile): show the last page
+                rows = list(qs.order_by(*self._reversed_ordering())[:size])[::-1]
+                has_next = False
+                has_prev = len(rows) == size
+
+        total = self.total(qs)
+        if not has_prev:
+            number = 1
+        elif not has_next:
+            number = max((total + size - 1) // size, 1)
+        number = max(number, 1)
+        return KeysetPage(
+            items=rows,
+            number=number,
+            total=total,
+            page_size=size,
+            prev_cursor=self.cursor(rows[0], '<') if rows and has_prev else None,
+            next_cursor=self.cursor(rows[-1], '>') if rows and has_next else None,
+        )
@@ -0,0 +1,25 @@
+import asyncio
+import logging
+
+from bot.utils.db_api.executor import db_async
+
+from main import ledger
+
+# Charging is idempotent, so checking hourly bills a new month within an hour of it starting
+CHECK_INTERVAL = 60 * 60
+
+
+async def month_rollover_loop(interval: int = CHECK_INTERVAL):
+    while True:
+        try:
+            charged = await db_async(ledger.charge_month)()
+            if charged:
+                logging.info(f"Month rollover: {charged} charge(s) created")
+        except Exception as err:
+            logging.exception(err)
+        await asyncio.sleep(interval)
+
+
+def start_month_rollover() -> asyncio.Task:
+    # Must be called from a running loop (e.g. on_startup)
+    return asyncio.create_task(month_rollover_loop())
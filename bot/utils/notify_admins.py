@@ -1,3 +1,4 @@
+import asyncio
 import logging
 
 from aiogram import Dispatcher
@@ -6,9 +7,14 @@ from bot.data.config import ADMINS
 
 
 async def on_startup_notify(dp: Dispatcher):
-    for admin in ADMINS:
-        try:
-            await dp.bot.send_message(admin, "Bot ishga tushdi")
+    # Imported here: bot.loader imports this package
+    from bot.loader import send_queue
 
-        except Exception as err:
-            logging.exception(err)
+    # Sent concurrently through the queue, within Telegram's rate limits
+    results = await asyncio.gather(
+        *(send_queue.send_message(admin, "Bot ishga tushdi") for admin in ADMINS),
+        return_exceptions=True,
+    )
+    for admin, result in zip(ADMINS, results):
+        if isinstance(result, Exception):
+            logging.error(f"Startup notice to {admin} failed: {result}")
@@ -0,0 +1,215 @@
+"""Delivers the transactional outbox (apps.botapp.outbox) from the bot process.
+
+The worker claims up to OUTBOX_BATCH_SIZE due messages, sends them through
+the send queue (concurrently, rate limited, in order within a chat) and
+records each outcome. It polls every OUTBOX_POLL_INTERVAL seconds; handlers
+call `outbox_worker.wake()` after committing a message so it goes out at
+once.
+
+Messages with a digest line (see `outbox.enqueue_digest`) that are claimed
+together for one chat go out as a single digest listing their lines, at
+most DIGEST_MAX_BATCH lines per message. Stopping the worker releases the
+messages still waiting for their digest and sends them.
+
+Delivery latency (creation to Telegram's answer) is kept for the last
+LATENCY_WINDOW messages and logged with the counters every METRICS_INTERVAL
+seconds.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import timedelta
+from operator import attrgetter
+
+from aiogram.utils.exceptions import BadRequest, Unauthorized
+from django.utils import timezone
+
+from apps.botapp import outbox
+from bot.data.config import DIGEST_MAX_BATCH, OUTBOX_BATCH_SIZE, OUTBOX_KEEP_DAYS, OUTBOX_POLL_INTERVAL
+from bot.utils.db_api.executor import db_async
+
+LATENCY_WINDOW = 1000
+METRICS_INTERVAL = 10 * 60
+PURGE_INTERVAL = 60 * 60
+# Telegram's limit, in UTF-16 code units
+MESSAGE_LIMIT = 4096
+
+
+def _length(text: str) -> int:
+    return len(text.encode('utf-16-le')) // 2
+
+
+def render_digest(lines: list) -> str:
+    return f"✅ To'lovlar qabul qilindi: {len(lines)} ta\n\n" + "\n".join(lines)
+
+
+def split_digest(items: list, line=str, max_batch: int | None = DIGEST_MAX_BATCH):
+    """Yield runs of `items` whose digest (of `line(item)`) fits one Telegram message and `max_batch` lines."""
+    chunk = []
+    for item in items:
+        if chunk and (
+            (max_batch and len(chunk) >= max_batch)
+            or _length(render_digest([line(i) for i in chunk + [item]])) > MESSAGE_LIMIT
+        ):
+            yield chunk
+            chunk = []
+        chunk.append(item)
+    if chunk:
+        yield chunk
+
+
+def _sends(messages: list) -> list:
+    """[(messages, text, options)]: one send per plain message, digests merged per chat."""
+    sends, digests = [], {}
+    for message in messages:
+        if message.digest:
+            digests.setdefault(message.chat_id, []).append(message)
+        else:
+            sends.append(([message], message.text, message.options))
+    for group in digests.values():
+        for chunk in split_digest(group, line=attrgetter('digest')):
+            text = chunk[0].text if len(chunk) == 1 else render_digest([m.digest for m in chunk])
+            sends.append((chunk, text, chunk[0].options))
+    return sends
+
+
+class OutboxWorker:
+    def __init__(self, batch_size: int = OUTBOX_BATCH_SIZE, poll_interval: float = OUTBOX_POLL_INTERVAL):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.send_queue = None
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+
+    def start(self, send_queue) -> asyncio.Task:
+        # Must be called from a running loop (e.g. on_startup)
+        self.send_queue = send_queue
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._loop())
+        return self._task
+
+    def wake(self):
+        """Look for due messages now instead of at the next poll."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def stop(self, timeout: float = 10):
+        """Let the batch being sent finish (and be recorded), send the waiting digests, then stop."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self.wake()
+        try:
+            # Cancelled on timeout; unrecorded messages are sent again when their lease ends
+            await asyncio.wait_for(self._task, timeout)
+            await asyncio.wait_for(self._flush(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        except Exception as err:
+            logging.exception(err)
+        self._task = None
+
+    async def _flush(self):
+        await db_async(outbox.release_digests)()
+        while await self.run_once() >= self.batch_size:
+            pass
+
+    def latency_summary(self) -> dict:
+        """p50 / p95 / max delivery latency in seconds over the recent window."""
+        if not self.latencies:
+            return {}
+        values = sorted(self.latencies)
+        return {
+            'p50': values[len(values) // 2],
+            'p95': values[min(int(len(values) * 0.95), len(values) - 1)],
+            'max': values[-1],
+        }
+
+    async def _loop(self):
+        last_metrics = last_purge = time.monotonic()
+        while not self._stopping:
+            # Before claiming, so a wake() for a message written during the claim is kept
+            self._wakeup.clear()
+            try:
+                count = await self.run_once()
+            except Exception as err:
+                logging.exception(err)
+                count = 0
+            now = time.monotonic()
+            if now - last_metrics >= METRICS_INTERVAL:
+                last_metrics = now
+                await self._log_metrics()
+            if now - last_purge >= PURGE_INTERVAL:
+                last_purge = now
+                try:
+                    await db_async(outbox.purge_sent)(timedelta(days=OUTBOX_KEEP_DAYS))
+                except Exception as err:
+                    logging.exception(err)
+            # A full batch suggests more are due
+            if count < self.batch_size and not self._stopping:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def run_once(self) -> int:
+        """Claim and send one batch; returns the number of messages claimed."""
+        messages = await db_async(outbox.claim)(self.batch_size)
+        if not messages:
+            return 0
+        sends = _sends(messages)
+        results = await asyncio.gather(
+            *(self._deliver(group[0].chat_id, text, options) for group, text, options in sends),
+            return_exceptions=True,
+        )
+        sent, failures = {}, []
+        for (group, _, _), result in zip(sends, results):
+            for message in group:
+                if isinstance(result, BaseException):
+                    failures.append((message, result))
+                else:
+                    sent[message.id] = result
+                    self.latencies.append((result - message.created_at).total_seconds())
+
+        def _record():
+            outbox.mark_sent(sent)
+            # A chat that does not exist or blocked the bot will not accept a retry
+            return [
+                outbox.mark_failed(m, f"{type(err).__name__}: {err}", permanent=isinstance(err, (BadRequest, Unauthorized)))
+                for m, err in failures
+            ]
+
+        gave_up = await db_async(_record)()
+        self.sent += len(sent)
+        self.failed += sum(gave_up)
+        self.retried += len(gave_up) - sum(gave_up)
+        for (message, err), given_up in zip(failures, gave_up):
+            if given_up:
+                logging.error(f"Outbox message {message.id} to {message.chat_id} failed: {err}")
+        return len(messages)
+
+    async def _deliver(self, chat_id: str, text: str, options: dict):
+        """Send one message through the queue; returns when it was delivered."""
+        await self.send_queue.send_message(chat_id, text, **options)
+        return timezone.now()
+
+    async def _log_metrics(self):
+        try:
+            pending = await db_async(outbox.pending_count)()
+        except Exception:
+            pending = '?'
+        latency = ', '.join(f"{k} {v:.1f}s" for k, v in self.latency_summary().items()) or '-'
+        logging.info(
+            f"Outbox: sent {self.sent}, retried {self.retried}, failed {self.failed}, "
+            f"pending {pending}; latency {latency}"
+        )
+
+
+outbox_worker = OutboxWorker()
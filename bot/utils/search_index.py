@@ -0,0 +1,470 @@
+"""In-memory student search for inline mode.
+
+Inline queries arrive on every keystroke; answering them from memory avoids a
+pool hop and a DB round trip each time. Matching follows main.search (same
+search keys from main.translit):
+
+- digit queries: exact student id, then phone prefixes with or without the
+  country code;
+- name queries: students with a word starting with the query, in word order
+  (slots are assigned in name order, so ties are roughly alphabetical);
+  other query words must start a word of the name as well;
+- when that finds too few, a trigram pass over the distinct name words picks
+  up typos ("hasanof" -> "hasanov") and their students are added.
+
+Word and phone postings are `array('I')` of slots kept parallel to sorted key
+lists. Removed students leave a dead slot behind, and unused words stay in
+the trigram table, until the tables are rebuilt (at the periodic check).
+
+The index is loaded in the background at startup, kept current by signals,
+and compared against the database every SEARCH_INDEX_CHECK_INTERVAL seconds.
+Past SEARCH_INDEX_MAX_STUDENTS it is dropped and searches fall back to the
+database.
+"""
+import asyncio
+import logging
+import re
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from sys import intern
+from typing import Iterable, List, Optional
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from bot.data.config import SEARCH_INDEX_CHECK_INTERVAL, SEARCH_INDEX_MAX_STUDENTS
+from bot.utils.db_api.executor import db_async
+from main.models import Enrollment, Group, Student
+from main.translit import COUNTRY_CODE, normalize_name
+
+# Share of the query's trigrams a name word must have to count as a typo match
+FUZZY_THRESHOLD = 0.5
+# Work limits for the typo pass: trigram postings scanned, candidate words scored
+FUZZY_SCAN_BUDGET = 20000
+FUZZY_CANDIDATES = 50
+
+_PHONE_QUERY = re.compile(r'^\+?[\d\s()-]+$')
+
+
+class StudentDoc:
+    __slots__ = ('id', 'full_name', 'phone_number', 'search_name', 'phone_digits', 'group_titles')
+
+    def __init__(self, id: int, full_name: str, phone_number: Optional[str], search_name: str,
+                 phone_digits: str, group_titles: tuple = ()):
+        self.id = id
+        self.full_name = full_name
+        self.phone_number = phone_number
+        self.search_name = search_name
+        self.phone_digits = phone_digits
+        self.group_titles = group_titles
+
+    def state(self) -> tuple:
+        return self.full_name, self.phone_number, self.search_name, self.phone_digits, self.group_titles
+
+
+def _trigrams(word: str) -> set:
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _prefix_range(keys: list, prefix: str) -> range:
+    lo = bisect_left(keys, prefix)
+    hi = bisect_left(keys, prefix + '￿', lo)
+    return range(lo, hi)
+
+
+class _Tables:
+    """One generation of index data. Callers hold StudentIndex's lock while mutating it."""
+
+    def __init__(self):
+        self.docs: List[Optional[StudentDoc]] = []  # slot -> doc; None once removed
+        self.slots = {}  # student id -> slot
+        self.words = []  # sorted name words; equal words in slot order
+        self.word_slots = array('I')
+        self.phones = []  # sorted phone digits; equal numbers in slot order
+        self.phone_slots = array('I')
+        self.vocab = {}  # name word -> number of students using it
+        self.grams = {}  # trigram -> words containing it
+        self.dead = 0
+
+    @classmethod
+    def build(cls, docs: Iterable[StudentDoc]) -> '_Tables':
+        tables = cls()
+        words, phones = [], []
+        for doc in docs:
+            slot = tables._append(doc)
+            words += [(word, slot) for word in set(doc.search_name.split())]
+            if doc.phone_digits:
+                phones.append((doc.phone_digits, slot))
+        words.sort()
+        phones.sort()
+        tables.words = [intern(word) for word, _ in words]
+        tables.word_slots = array('I', (slot for _, slot in words))
+        tables.phones = [phone for phone, _ in phones]
+        tables.phone_slots = array('I', (slot for _, slot in phones))
+        return tables
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _append(self, doc: StudentDoc) -> int:
+        slot = len(self.docs)
+        self.docs.append(doc)
+        self.slots[doc.id] = slot
+        for word in set(doc.search_name.split()):
+            count = self.vocab.get(word)
+            if count is None:
+                word = intern(word)
+                for gram in _trigrams(word):
+                    self.grams.setdefault(gram, []).append(word)
+                count = 0
+            self.vocab[word] = count + 1
+        return slot
+
+    @staticmethod
+    def _insert(keys: list, slots: array, key: str, slot: int):
+        # The new slot is the largest, so it goes after equal keys
+        i = bisect_right(keys, key)
+        keys.insert(i, intern(key))
+        slots.insert(i, slot)
+
+    @staticmethod
+    def _delete(keys: list, slots: array, key: str, slot: int):
+        lo = bisect_left(keys, key)
+        hi = bisect_right(keys, key, lo)
+        i = bisect_left(slots, slot, lo, hi)
+        if i < hi and slots[i] == slot:
+            del keys[i]
+            del slots[i]
+
+    def add(self, doc: StudentDoc):
+        slot = self._append(doc)
+        for word in set(doc.search_name.split()):
+            self._insert(self.words, self.word_slots, word, slot)
+        if doc.phone_digits:
+            self._insert(self.phones, self.phone_slots, doc.phone_digits, slot)
+
+    def remove(self, student_id: int) -> Optional[StudentDoc]:
+        slot = self.slots.pop(student_id, None)
+        if slot is None:
+            return None
+        doc = self.docs[slot]
+        self.docs[slot] = None
+        self.dead += 1
+        for word in set(doc.search_name.split()):
+            self.vocab[word] -= 1
+            self._delete(self.words, self.word_slots, word, slot)
+        if doc.phone_digits:
+            self._delete(self.phones, self.phone_slots, doc.phone_digits, slot)
+        return doc
+
+    def get(self, student_id: int) -> Optional[StudentDoc]:
+        slot = self.slots.get(student_id)
+        return None if slot is None else self.docs[slot]
+
+    # -----------------------------
+    # Queries
+    # -----------------------------
+
+    def by_phone(self, text: str, limit: int) -> List[StudentDoc]:
+        digits = re.sub(r'\D', '', text)
+        found = []
+        if len(digits) <= 18:
+            doc = self.get(int(digits))
+            if doc is not None:
+                found.append(doc)
+        seen = {doc.id for doc in found}
+        for prefix in (digits, COUNTRY_CODE + digits):
+            for i in _prefix_range(self.phones, prefix):
+                if len(found) >= limit:
+                    return found
+                doc = self.docs[self.phone_slots[i]]
+                if doc.id not in seen:
+                    seen.add(doc.id)
+                    found.append(doc)
+        return found
+
+    def by_name(self, name: str, limit: int) -> List[StudentDoc]:
+        query_words = name.split()
+        head = max(query_words, key=len)
+        rest = list(query_words)
+        rest.remove(head)
+
+        found, seen = [], set()
+        self._collect(_prefix_range(self.words, head), rest, limit, found, seen)
+        if len(found) < limit and len(head) >= 3:
+            for word in self._similar_words(head):
+                self._collect(_prefix_range(self.words, word), rest, limit, found, seen)
+                if len(found) >= limit:
+                    break
+        return found
+
+    def _collect(self, entries: range, rest: list, limit: int, found: list, seen: set):
+        for i in entries:
+            if len(found) >= limit:
+                return
+            slot = self.word_slots[i]
+            if slot in seen:
+                continue
+            doc = self.docs[slot]
+            words = doc.search_name.split()
+            if all(any(w.startswith(q) for w in words) for q in rest):
+                seen.add(slot)
+                found.append(doc)
+
+    def _similar_words(self, word: str) -> List[str]:
+        """Name words sharing most of `word`'s trigrams (or containing it), closest first."""
+        query_grams = _trigrams(word)
+        postings = sorted((self.grams[g] for g in query_grams if g in self.grams), key=len)
+        hits, budget = Counter(), FUZZY_SCAN_BUDGET
+        for posting in postings:
+            if len(posting) > budget:
+                break
+            budget -= len(posting)
+            hits.update(posting)
+        scored = []
+        for candidate, _ in hits.most_common(FUZZY_CANDIDATES):
+            if not self.vocab.get(candidate) or candidate.startswith(word):
+                continue  # unused, or already found by the prefix pass
+            score = 1.0 if word in candidate else len(query_grams & _trigrams(candidate)) / len(query_grams)
+            if score >= FUZZY_THRESHOLD:
+                scored.append((-score, candidate))
+        scored.sort()
+        return [candidate for _, candidate in scored]
+
+
+def fetch_docs(student_ids: Optional[Iterable[int]] = None) -> List[StudentDoc]:
+    """Students (all, or the given ids) with their active group titles, in name order."""
+    students = Student.objects.order_by('full_name', 'id')
+    enrollments = Enrollment.objects.filter(is_active=True)
+    if student_ids is not None:
+        student_ids = list(student_ids)
+        students = students.filter(id__in=student_ids)
+        enrollments = enrollments.filter(student_id__in=student_ids)
+    titles = {}
+    for sid, title in enrollments.order_by('group__title').values_list('student_id', 'group__title'):
+        titles.setdefault(sid, []).append(title)
+    return [
+        StudentDoc(sid, name, phone, search_name, digits, tuple(titles.get(sid, ())))
+        for sid, name, phone, search_name, digits in students.values_list(
+            'id', 'full_name', 'phone_number', 'search_name', 'phone_digits'
+        ).iterator(chunk_size=5000)
+    ]
+
+
+class StudentIndex:
+    def __init__(self, max_students: int = SEARCH_INDEX_MAX_STUDENTS):
+        self.max_students = max_students
+        self._lock = threading.Lock()
+        self._tables: Optional[_Tables] = None
+        self._loading = False
+        # Students changed by signals since the last load/check started
+        self._touched = set()
+
+    @property
+    def ready(self) -> bool:
+        return self._tables is not None
+
+    def stats(self) -> dict:
+        tables = self._tables
+        if tables is None:
+            return {'ready': False}
+        return {
+            'ready': True,
+            'students': len(tables),
+            'dead_slots': tables.dead,
+            'words': len(tables.vocab),
+            'trigrams': len(tables.grams),
+        }
+
+    def search(self, query: str, limit: int = 25) -> Optional[List[StudentDoc]]:
+        """Matches, best first; None when the index cannot answer (not loaded, empty query)."""
+        text = (query or '').strip()
+        if self._tables is None or not text:
+            return None
+        with self._lock:
+            tables = self._tables
+            if tables is None:
+                return None
+            if _PHONE_QUERY.match(text) and any(ch.isdigit() for ch in text):
+                return tables.by_phone(text, limit)
+            name = normalize_name(text)
+            return tables.by_name(name, limit) if name else []
+
+    # -----------------------------
+    # Loading and checks (run on the DB pool)
+    # -----------------------------
+
+    def load(self) -> bool:
+        with self._lock:
+            self._loading = True
+            self._touched = set()
+        try:
+            if Student.objects.count() > self.max_students:
+                logging.warning(f"Search index: more than {self.max_students} students, using DB search")
+                return False
+            tables = _Tables.build(fetch_docs())
+            with self._lock:
+                self._tables, touched = tables, self._touched
+                self._touched = set()
+        finally:
+            self._loading = False
+        # Changes that raced with the load
+        if touched:
+            self.refresh(touched)
+        logging.info(f"Search index: {len(tables)} students loaded")
+        return True
+
+    def check(self) -> int:
+        """Compare with the database and fix differences; returns how many students were fixed.
+
+        The comparison, and the rebuild once enough slots are dead or stale, run
+        without the lock; it is only held to apply the fixes or swap the tables in,
+        so searches on the event loop are not held up meanwhile.
+        """
+        tables = self._tables
+        if tables is None:
+            return 0
+        with self._lock:
+            self._touched = set()
+        docs = fetch_docs()
+        if len(docs) > self.max_students:
+            self.drop()
+            return 0
+
+        ids = {doc.id for doc in docs}
+        stale = [sid for sid in list(tables.slots) if sid not in ids]
+        changed = []
+        for doc in docs:
+            current = tables.get(doc.id)
+            if current is None or current.state() != doc.state():
+                changed.append(doc)
+        rebuilt = None
+        if tables.dead + len(stale) + len(changed) > max(1000, len(tables) // 5):
+            rebuilt = _Tables.build(docs)
+
+        with self._lock:
+            if self._tables is not tables:
+                return 0  # dropped or reloaded meanwhile
+            # Students changed by signals during the check keep their newer state
+            touched = self._touched
+            stale = [sid for sid in stale if sid not in touched]
+            changed = [doc for doc in changed if doc.id not in touched]
+            if rebuilt is not None:
+                for sid in touched:
+                    rebuilt.remove(sid)
+                    current = tables.get(sid)
+                    if current is not None:
+                        rebuilt.add(current)
+                self._tables = rebuilt
+            else:
+                for sid in stale:
+                    tables.remove(sid)
+                for doc in changed:
+                    tables.remove(doc.id)
+                    tables.add(doc)
+        return len(stale) + len(changed)
+
+    def drop(self):
+        with self._lock:
+            self._tables = None
+
+    # -----------------------------
+    # Incremental updates (from signals, on the saving thread)
+    # -----------------------------
+
+    def _tracking(self) -> bool:
+        return self._tables is not None or self._loading
+
+    def upsert(self, doc: StudentDoc):
+        with self._lock:
+            self._touched.add(doc.id)
+            tables = self._tables
+            if tables is None:
+                return
+            current = tables.get(doc.id)
+            if current is not None and current.state() == doc.state():
+                return
+            tables.remove(doc.id)
+            tables.add(doc)
+            over = len(tables) > self.max_students
+        if over:
+            logging.warning(f"Search index: more than {self.max_students} students, using DB search")
+            self.drop()
+
+    def remove(self, student_id: int):
+        with self._lock:
+            self._touched.add(student_id)
+            if self._tables is not None:
+                self._tables.remove(student_id)
+
+    def refresh(self, student_ids: Iterable[int]):
+        """Reload these students (e.g. after enrollment changes) from the database."""
+        student_ids = set(student_ids)
+        docs = fetch_docs(student_ids)
+        for doc in docs:
+            self.upsert(doc)
+        for sid in student_ids - {doc.id for doc in docs}:
+            self.remove(sid)
+
+
+student_index = StudentIndex()
+
+
+@receiver(post_save, sender=Student, dispatch_uid='student_search_index')
+def _index_student(sender, instance: Student, raw=False, **kwargs):
+    if raw or not student_index._tracking():
+        return
+    current = student_index._tables.get(instance.pk) if student_index._tables else None
+    doc = StudentDoc(
+        instance.pk, instance.full_name, instance.phone_number, instance.search_name, instance.phone_digits,
+        current.group_titles if current else (),
+    )
+    transaction.on_commit(lambda: student_index.upsert(doc))
+
+
+@receiver(post_delete, sender=Student, dispatch_uid='student_search_index')
+def _unindex_student(sender, instance: Student, **kwargs):
+    if student_index._tracking():
+        student_id = instance.pk
+        transaction.on_commit(lambda: student_index.remove(student_id))
+
+
+@receiver([post_save, post_delete], sender=Enrollment, dispatch_uid='student_search_index')
+def _index_enrollment(sender, instance: Enrollment, raw=False, **kwargs):
+    if raw or not student_index._tracking():
+        return
+    student_id = instance.student_id
+    transaction.on_commit(lambda: student_index.refresh([student_id]))
+
+
+@receiver(post_save, sender=Group, dispatch_uid='student_search_index')
+def _index_group(sender, instance: Group, created=False, raw=False, **kwargs):
+    if raw or created or not student_index._tracking():
+        return
+    group_id = instance.pk
+    transaction.on_commit(lambda: student_index.refresh(
+        Enrollment.objects.filter(group_id=group_id).values_list('student_id', flat=True)
+    ))
+
+
+async def search_index_loop(interval: int = SEARCH_INDEX_CHECK_INTERVAL):
+    while True:
+        try:
+            if not student_index.ready:
+                await db_async(student_index.load)()
+            else:
+                fixed = await db_async(student_index.check)()
+                if fixed:
+                    logging.info(f"Search index check: {fixed} student(s) fixed")
+        except Exception as err:
+            logging.exception(err)
+        await asyncio.sleep(interval)
+
+
+def start_search_index() -> asyncio.Task:
+    # Must be called from a running loop (e.g. on_startup); searches use the DB until the load finishes
+    return asyncio.create_task(search_index_loop())
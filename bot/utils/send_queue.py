@@ -0,0 +1,262 @@
+"""Outbound rate limiting and the send queue.
+
+Telegram lets a bot send about 30 messages per second overall, about one per
+second to a private chat and about 20 per minute to a group; beyond that it
+answers with RetryAfter (flood control). `ThrottledBot` makes every sending
+API call, from handlers and jobs alike, wait for a token from those buckets
+and retry flood errors after the time Telegram asks for. Edits in a private
+chat made in answer to a button tap only take a global token.
+
+`SendQueue` is for messages nobody waits on (payment notifications, startup
+notices): `send_queue.send_message(...)` returns at once, and a few workers
+deliver the messages concurrently, in order within each chat. The queue
+holds at most `SEND_QUEUE_SIZE` messages; beyond that new ones are dropped
+and logged.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+
+from aiogram import Bot, types
+from aiogram.utils.exceptions import RetryAfter
+
+# Message-sending API methods; answers to callback and inline queries are not limited
+LIMITED_PREFIXES = ('send', 'edit', 'copy', 'forward')
+UNLIMITED_METHODS = frozenset({'sendChatAction'})
+
+PRIVATE_RATE = 1.0  # messages per second to one private chat
+PRIVATE_BURST = 3
+GROUP_BURST = 5
+# Flood errors are retried this many times before the call fails
+MAX_RETRIES = 3
+# Per-chat buckets kept before idle (full) ones are dropped
+MAX_CHAT_BUCKETS = 10_000
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available (0 when one is)."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+def _is_group(chat_key: str) -> bool:
+    # Group and channel ids are negative; '@username' targets are channels
+    return chat_key.startswith(('-', '@'))
+
+
+def _answers_tap(method: str, chat_id) -> bool:
+    # Edits made while handling a button tap in a private chat (paging, toggles) go as
+    # fast as the user taps; the chat bucket would stall every page turn after the third
+    return (
+        method.startswith('edit')
+        and not _is_group(str(chat_id))
+        and types.CallbackQuery.get_current() is not None
+    )
+
+
+class RateLimiter:
+    """A global bucket plus one bucket per chat (group or private rate)."""
+
+    def __init__(self, rate: float, group_rate_per_minute: float):
+        self.group_rate = group_rate_per_minute / 60
+        self._global = TokenBucket(rate, max(rate, 1), time.monotonic())
+        self._chats = {}  # chat key -> TokenBucket
+        self._paused = {}  # chat key -> monotonic time a flood wait ends
+        self._lock = asyncio.Lock()
+
+    def _bucket(self, key: str, now: float) -> TokenBucket:
+        bucket = self._chats.get(key)
+        if bucket is None:
+            if len(self._chats) >= MAX_CHAT_BUCKETS:
+                # A full bucket carries no state, so dropping it changes nothing
+                self._chats = {k: b for k, b in self._chats.items() if not b.full(now)}
+            if _is_group(key):
+                bucket = TokenBucket(self.group_rate, GROUP_BURST, now)
+            else:
+                bucket = TokenBucket(PRIVATE_RATE, PRIVATE_BURST, now)
+            self._chats[key] = bucket
+        return bucket
+
+    def chat_delay(self, chat_id) -> float:
+        """Seconds until `chat_id` may be sent to again."""
+        key, now = str(chat_id), time.monotonic()
+        paused = self._paused.get(key, 0) - now
+        if paused <= 0:
+            self._paused.pop(key, None)
+        return max(paused, self._bucket(key, now).delay(now))
+
+    def pause(self, chat_id, seconds: float):
+        """Hold a chat back after Telegram asked to retry later."""
+        key = str(chat_id)
+        self._paused[key] = max(self._paused.get(key, 0), time.monotonic() + seconds)
+
+    async def acquire(self, chat_id=None):
+        """Wait for a chat token (when `chat_id` is given) and a global one, and take them."""
+        if chat_id is not None:
+            while True:
+                wait = self.chat_delay(chat_id)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+        # Waiters take global tokens one at a time, in arrival order
+        async with self._lock:
+            wait = self._global.delay(time.monotonic())
+            if wait > 0:
+                await asyncio.sleep(wait)
+            now = time.monotonic()
+            self._global.take(now)
+        if chat_id is not None:
+            self._bucket(str(chat_id), now).take(now)
+
+
+class ThrottledBot(Bot):
+    """Bot whose sending calls wait for rate-limit tokens and retry RetryAfter."""
+
+    def __init__(self, *args, limiter: RateLimiter, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.limiter = limiter
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        if not method.startswith(LIMITED_PREFIXES) or method in UNLIMITED_METHODS:
+            return await super().request(method, data, files, **kwargs)
+        chat_id = (data or {}).get('chat_id')
+        bucket = None if chat_id is None or _answers_tap(method, chat_id) else chat_id
+        attempt = 0
+        while True:
+            await self.limiter.acquire(bucket)
+            try:
+                return await super().request(method, data, files, **kwargs)
+            except RetryAfter as err:
+                if chat_id is not None:
+                    self.limiter.pause(chat_id, err.timeout)
+                attempt += 1
+                # Uploaded files were consumed by the first attempt
+                if files or attempt > MAX_RETRIES:
+                    raise
+                logging.warning(f"{method} to {chat_id}: flood control, retrying in {err.timeout}s")
+                if bucket is None:
+                    await asyncio.sleep(err.timeout)
+
+
+class SendQueueFull(Exception):
+    pass
+
+
+def _consume_exception(future: asyncio.Future):
+    # Failures are logged by the worker; callers that do not await must not trigger
+    # "exception was never retrieved"
+    if not future.cancelled():
+        future.exception()
+
+
+class SendQueue:
+    """Fire-and-forget sends through `bot`, by `workers` concurrent tasks, in order per chat."""
+
+    def __init__(self, bot: ThrottledBot, maxsize: int, workers: int):
+        self.bot = bot
+        self.maxsize = maxsize
+        self.workers = max(workers, 1)
+        self._pending = {}  # chat key -> deque of (method, chat_id, args, kwargs, future)
+        self._size = 0
+        self._ready = None  # chat keys with a message to send; each key at most once
+        self._tasks = []
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self._size
+
+    def _start(self):
+        # Workers start with the first message, inside the running loop
+        if not self._tasks:
+            self._ready = asyncio.Queue()
+            self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+
+    def submit(self, method: str, chat_id, *args, **kwargs) -> asyncio.Future:
+        """Queue `bot.<method>(chat_id, *args, **kwargs)`; the future resolves with its result.
+
+        Awaiting the future is optional; when the queue is full it fails with SendQueueFull.
+        """
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume_exception)
+        if self._size >= self.maxsize:
+            self.dropped += 1
+            logging.warning(f"Send queue full ({self._size}), dropped {method} to {chat_id}")
+            future.set_exception(SendQueueFull(chat_id))
+            return future
+        self._start()
+        key = str(chat_id)
+        queue = self._pending.get(key)
+        if queue is None:
+            queue = self._pending[key] = deque()
+            self._ready.put_nowait(key)
+        queue.append((method, chat_id, args, kwargs, future))
+        self._size += 1
+        return future
+
+    def send_message(self, chat_id, text: str, **kwargs) -> asyncio.Future:
+        return self.submit('send_message', chat_id, text, **kwargs)
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            key = await self._ready.get()
+            wait = self.bot.limiter.chat_delay(key)
+            if wait > 0:
+                # Keep the worker for chats that can be sent to now
+                loop.call_later(wait, self._ready.put_nowait, key)
+                continue
+            queue = self._pending[key]
+            method, chat_id, args, kwargs, future = queue[0]
+            try:
+                result = await getattr(self.bot, method)(chat_id, *args, **kwargs)
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                self.failed += 1
+                logging.warning(f"Send queue: {method} to {chat_id} failed: {err}")
+                if not future.done():
+                    future.set_exception(err)
+            else:
+                self.sent += 1
+                if not future.done():
+                    future.set_result(result)
+            queue.popleft()
+            self._size -= 1
+            if queue:
+                self._ready.put_nowait(key)
+            else:
+                del self._pending[key]
+
+    async def close(self, timeout: float = 10):
+        """Give pending messages up to `timeout` seconds, then stop the workers."""
+        deadline = time.monotonic() + timeout
+        while self._size and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
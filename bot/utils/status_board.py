@@ -0,0 +1,220 @@
+"""Pinned monthly status boards in group chats.
+
+For groups with `Group.status_board` set, accepted payments do not post a
+message each; the group's board for the month (one pinned message listing
+who has paid, see main.models.StatusBoard) is edited instead. `touch()` marks
+a group's board stale and the edit follows BOARD_DEBOUNCE seconds later, so
+a burst of payments costs one edit. The first update of a month posts and
+pins a new board.
+
+Boards are rendered from the group's rollup row and one grouped query over
+its enrollments (main.reports.status_board_data). At startup every board is
+refreshed, which also covers payments made while the bot was down; after that
+the month's posted boards are re-read every BOARD_REFRESH_INTERVAL seconds for
+changes made outside the bot (the admin site) and edited only when their
+figures changed.
+"""
+import asyncio
+import logging
+from html import escape
+
+from aiogram.utils.exceptions import (
+    MessageCantBeEdited, MessageNotModified, MessageToEditNotFound, TelegramAPIError,
+)
+from django.utils import timezone
+
+from bot.data.config import BOARD_DEBOUNCE, BOARD_REFRESH_INTERVAL
+from bot.utils.db_api.executor import db_async
+from main.ledger import current_month
+from main.models import Group, StatusBoard
+from main.reports import status_board_data
+
+# Telegram's limit, in UTF-16 code units (emoji take two)
+MESSAGE_LIMIT = 4096
+UZ_MONTHS = [
+    "Yanvar", "Fevral", "Mart", "Aprel", "May", "Iyun",
+    "Iyul", "Avgust", "Sentabr", "Oktyabr", "Noyabr", "Dekabr",
+]
+
+
+def fmt_amount(n: int) -> str:
+    return f"{int(n):,}".replace(",", " ")
+
+
+def _length(line: str) -> int:
+    return len(line.encode('utf-16-le')) // 2 + 1  # with its newline
+
+
+def render_board(title: str, month, rollup, students: list, now=None) -> str:
+    now = timezone.localtime(now or timezone.now())
+    paid_count = sum(1 for s in students if s['fee'] and s['paid'] >= s['fee'])
+    head = [
+        f"📋 <b>{escape(title, quote=False)}</b> — {UZ_MONTHS[month.month - 1]} {month.year}",
+        f"To'laganlar: {paid_count}/{len(students)} · {fmt_amount(rollup.active_collected)} / {fmt_amount(rollup.expected)} so'm",
+        "",
+    ]
+    lines = []
+    for s in students:
+        name = escape(s['name'], quote=False)
+        due = max(s['fee'] - s['paid'], 0)
+        if not due:
+            lines.append(f"✅ {name}")
+        elif s['paid']:
+            lines.append(f"🟡 {name} — {fmt_amount(due)} qoldi")
+        else:
+            lines.append(f"⬜ {name}")
+    foot = ["", f"🕒 Yangilandi: {now:%d.%m %H:%M}"]
+
+    # Keep within Telegram's message size, saying how many rows were left out
+    size = sum(_length(line) for line in head + foot)
+    shown = []
+    for i, line in enumerate(lines):
+        rest = f"… va yana {len(lines) - i} ta o'quvchi"
+        if size + _length(line) + _length(rest) > MESSAGE_LIMIT:
+            shown.append(rest)
+            break
+        shown.append(line)
+        size += _length(line)
+    return "\n".join(head + shown + foot)
+
+
+def _board_state(group_id: int, month):
+    """(chat id, existing board or None, text, figures), or None when the group has no board.
+
+    `figures` is everything the text shows except the time, to tell whether a board changed.
+    """
+    group = Group.objects.get(id=group_id)
+    chat_id = (group.chat_id or '').strip()
+    if not chat_id or not group.status_board:
+        return None
+    board = StatusBoard.objects.filter(group_id=group_id, month=month).first()
+    rollup, students = status_board_data(group_id, month)
+    figures = (
+        group.title, rollup.active_collected, rollup.expected,
+        tuple((s['name'], s['fee'], s['paid']) for s in students),
+    )
+    return chat_id, board, render_board(group.title, month, rollup, students), figures
+
+
+def _boards_in_use(month) -> list:
+    """Ids of the groups whose board for `month` has been posted and is still enabled."""
+    return list(
+        StatusBoard.objects.filter(month=month, group__status_board=True)
+        .values_list('group_id', flat=True)
+    )
+
+
+def _save_board(group_id: int, month, chat_id: str, message_id: int):
+    StatusBoard.objects.update_or_create(
+        group_id=group_id, month=month, defaults={'chat_id': chat_id, 'message_id': message_id},
+    )
+
+
+class StatusBoardUpdater:
+    def __init__(self, debounce: float = BOARD_DEBOUNCE, refresh_interval: float = BOARD_REFRESH_INTERVAL):
+        self.debounce = debounce
+        self.refresh_interval = refresh_interval
+        self.bot = None
+        self.edits = 0
+        self._timers = {}  # group id -> TimerHandle of the scheduled update
+        self._locks = {}  # group id -> Lock; one update of a board at a time
+        self._shown = {}  # group id -> (month, figures) the board last showed
+        self._tasks = set()
+        self._refresher = None
+
+    def start(self, bot):
+        # Must be called from a running loop (e.g. on_startup)
+        self.bot = bot
+        task = asyncio.create_task(self._refresh_all())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self._refresher = asyncio.create_task(self._refresh_loop())
+
+    def touch(self, group_id: int):
+        """Update the group's board after the debounce delay; further touches until then are merged."""
+        if self.bot is None or group_id in self._timers:
+            return
+        loop = asyncio.get_running_loop()
+        self._timers[group_id] = loop.call_later(self.debounce, self._run, group_id)
+
+    def _run(self, group_id: int):
+        self._timers.pop(group_id, None)
+        task = asyncio.ensure_future(self.update(group_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def close(self, timeout: float = 10):
+        """Apply the scheduled updates now and wait for them."""
+        if self._refresher is not None:
+            self._refresher.cancel()
+            self._refresher = None
+        for group_id, timer in list(self._timers.items()):
+            timer.cancel()
+            self._run(group_id)
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+    async def _refresh_all(self):
+        try:
+            group_ids = await db_async(lambda: list(
+                Group.objects.filter(status_board=True, is_active=True)
+                .exclude(chat_id__isnull=True).exclude(chat_id='')
+                .values_list('id', flat=True)
+            ))()
+        except Exception as err:
+            logging.exception(err)
+            return
+        for group_id in group_ids:
+            self.touch(group_id)
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                group_ids = await db_async(_boards_in_use)(current_month())
+            except Exception as err:
+                logging.exception(err)
+                continue
+            for group_id in group_ids:
+                # One at a time: this is background work, and each board is a few queries
+                await self.update(group_id, only_changed=True)
+
+    async def update(self, group_id: int, only_changed: bool = False):
+        lock = self._locks.setdefault(group_id, asyncio.Lock())
+        async with lock:
+            try:
+                await self._update(group_id, only_changed)
+            except Exception as err:
+                logging.exception(f"Status board of group {group_id}: {err}")
+
+    async def _update(self, group_id: int, only_changed: bool = False):
+        month = current_month()
+        state = await db_async(_board_state)(group_id, month)
+        if state is None:
+            return
+        chat_id, board, text, figures = state
+        if only_changed and board is not None and self._shown.get(group_id) == (month, figures):
+            return
+        if board is not None and board.chat_id == chat_id:
+            try:
+                await self.bot.edit_message_text(text, chat_id, board.message_id)
+                self.edits += 1
+                self._shown[group_id] = (month, figures)
+                return
+            except MessageNotModified:
+                self._shown[group_id] = (month, figures)
+                return
+            except (MessageToEditNotFound, MessageCantBeEdited):
+                pass  # Deleted from the chat: post a new one
+
+        message = await self.bot.send_message(chat_id, text, disable_notification=True)
+        self._shown[group_id] = (month, figures)
+        await db_async(_save_board)(group_id, month, chat_id, message.message_id)
+        try:
+            await self.bot.pin_chat_message(chat_id, message.message_id, disable_notification=True)
+        except TelegramAPIError as err:
+            # The bot may lack the right to pin; the board still works unpinned
+            logging.warning(f"Status board of group {group_id}: cannot pin: {err}")
+
+
+status_boards = StatusBoardUpdater()
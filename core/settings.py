@@ -51,6 +51,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     # Local apps
     "apps.botapp",
     "main",
@@ -97,6 +98,13 @@ DATABASES = {
         "PASSWORD": env("POSTGRES_PASSWORD"),
         "HOST": env("DB_HOST"),
         "PORT": env("DB_PORT"),
+        # Keep connections open between bot DB-pool calls (and requests)
+        "CONN_MAX_AGE": env.int("DB_CONN_MAX_AGE", default=60),
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {
+            # Fuzzy student search cut-off (main.search); the default 0.6 misses one-letter typos
+            "options": "-c pg_trgm.word_similarity_threshold=%s" % env.float("SEARCH_SIMILARITY_THRESHOLD", default=0.3),
+        },
     }
 }
 
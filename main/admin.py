@@ -1,9 +1,219 @@
+from datetime import timedelta
+
+from django import forms
 from django.contrib import admin
-from django.db.models import Count, Sum
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.utils import get_last_value_from_parameters
+from django.contrib.admin.views.main import ERROR_FLAG, ChangeList
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.paginator import EmptyPage, Paginator
+from django.db import connections
+from django.db.models import Count, Q, Sum
 from django.db.models.functions import Coalesce
+from django.http import Http404, HttpResponseRedirect, StreamingHttpResponse
+from django.urls import path, reverse
 from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.translation import gettext as _
+
+from .exports import WRITERS, stream_export
+from .models import Group, Student, Enrollment, Payment, Charge, MonthlyRollup
+from .rollups import month_rollups, next_month
+
+
+class ExportChangeList(ChangeList):
+    """ChangeList that only resolves filters; the export needs no counts or first page."""
+
+    def get_results(self, request):
+        self.result_count = self.full_result_count = 0
+        self.result_list = []
+        self.can_show_all = False
+        self.multi_page = False
+        self.paginator = None
+
+
+class ExportMixin:
+    """CSV/XLSX export of `export_columns` ((header, field) pairs) for the selected rows
+    (actions) or for everything the changelist's filters, search and date
+    hierarchy match (changelist buttons).
+
+    Rows are streamed from a server-side cursor, so the worker's memory does
+    not grow with the export.
+    """
+    change_list_template = "admin/main/export_change_list.html"
+    export_columns = ()
+    # Changelist query parameters that are not lookups (e.g. the payment report's month)
+    export_ignored_params = ()
+
+    def get_urls(self):
+        info = self.opts.app_label, self.opts.model_name
+        return [
+            path("export/<str:fmt>/", self.admin_site.admin_view(self.export_view), name="%s_%s_export" % info),
+        ] + super().get_urls()
+
+    def export_response(self, queryset, fmt: str):
+        writer = WRITERS[fmt]
+        response = StreamingHttpResponse(stream_export(queryset, self.export_columns, fmt), content_type=writer.content_type)
+        filename = f"{self.opts.model_name}-{timezone.localtime():%Y%m%d-%H%M}.{writer.extension}"
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+    def export_view(self, request, fmt):
+        if fmt not in WRITERS:
+            raise Http404
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        request.GET = request.GET.copy()
+        for param in self.export_ignored_params:
+            request.GET.pop(param, None)
+        request.exporting = True
+        try:
+            queryset = self.get_changelist_instance(request).get_queryset(request)
+        except IncorrectLookupParameters:
+            # Bad filter values: back to the changelist, as changelist_view does
+            info = self.opts.app_label, self.opts.model_name
+            return HttpResponseRedirect(reverse("admin:%s_%s_changelist" % info) + "?" + ERROR_FLAG + "=1")
+        return self.export_response(queryset, fmt)
+
+    def get_changelist(self, request, **kwargs):
+        if getattr(request, "exporting", False):
+            return ExportChangeList
+        return super().get_changelist(request, **kwargs)
+
+    @admin.action(description="Export selected to CSV")
+    def export_csv(self, request, queryset):
+        return self.export_response(queryset, "csv")
+
+    @admin.action(description="Export selected to Excel")
+    def export_xlsx(self, request, queryset):
+        return self.export_response(queryset, "xlsx")
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = extra_context or {}
+        extra_context["export_formats"] = list(WRITERS)
+        return super().changelist_view(request, extra_context=extra_context)
 
-from .models import Group, Student, Enrollment, Payment
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that takes the count of an unfiltered changelist from the table statistics.
+
+    An exact COUNT(*) reads every row; pg_class.reltuples (kept by ANALYZE and
+    autovacuum) costs nothing. Filtered or searched lists are counted exactly,
+    since the planner's guess for a WHERE clause can be far off and pages past
+    a wrong count would not open. Tables under `exact_below` rows are counted
+    exactly too.
+    """
+    exact_below = 10_000
+    # Set once `count` came from the estimate
+    estimated = False
+
+    @cached_property
+    def count(self):
+        qs = self.object_list
+        if connections[qs.db].vendor != "postgresql" or qs.query.where or qs.query.distinct:
+            return super().count
+        with connections[qs.db].cursor() as cursor:
+            cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [qs.model._meta.db_table])
+            row = cursor.fetchone()
+        # -1 until the table is first analyzed
+        estimate = int(row[0]) if row else -1
+        if estimate < self.exact_below:
+            return super().count
+        self.estimated = True
+        return estimate
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            # The statistics can lag behind the table: past the estimated last
+            # page comes an empty page rather than an error
+            if self.estimated and int(number) >= 1:
+                return int(number)
+            raise
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if not self.estimated:
+            return super().page(number)
+        # Not cut off at the estimated count, which may be a little low
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
+
+
+class AutocompleteFilter(admin.FieldListFilter):
+    """Foreign key filter picked through the admin's autocomplete instead of a list of every row.
+
+    The related model's admin must define `search_fields`; the ModelAdmin
+    using the filter adds `AutocompleteFilter.media(...)` to its media.
+    """
+    template = "admin/main/autocomplete_filter.html"
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.lookup_kwarg = "%s__%s__exact" % (field_path, field.target_field.name)
+        self.lookup_kwarg_isnull = "%s__isnull" % field_path
+        self.lookup_val = get_last_value_from_parameters(params, self.lookup_kwarg)
+        self.lookup_val_isnull = get_last_value_from_parameters(params, self.lookup_kwarg_isnull)
+        super().__init__(field, request, params, model, model_admin, field_path)
+        self.admin_site = model_admin.admin_site
+        self.empty_value_display = model_admin.get_empty_value_display()
+
+    @staticmethod
+    def media(field, admin_site):
+        return AutocompleteSelect(field, admin_site).media
+
+    def expected_parameters(self):
+        return [self.lookup_kwarg, self.lookup_kwarg_isnull]
+
+    def choices(self, changelist):
+        yield {
+            "selected": self.lookup_val is None and not self.lookup_val_isnull,
+            "query_string": changelist.get_query_string(remove=[self.lookup_kwarg, self.lookup_kwarg_isnull]),
+            "display": _("All"),
+        }
+        if self.field.null:
+            yield {
+                "selected": self.lookup_val_isnull == "True",
+                "query_string": changelist.get_query_string({self.lookup_kwarg_isnull: "True"}, [self.lookup_kwarg]),
+                "display": self.empty_value_display,
+            }
+
+    def widget(self):
+        """The autocomplete select, showing the chosen object (one query when a value is set)."""
+        related = self.field.remote_field.model
+        form_field = forms.ModelChoiceField(
+            queryset=related._default_manager.all(),
+            to_field_name=self.field.target_field.name,
+            required=False,
+            widget=AutocompleteSelect(self.field, self.admin_site),
+        )
+        return form_field.widget.render(
+            self.lookup_kwarg, self.lookup_val, attrs={"id": "filter_%s" % self.field_path, "style": "width: 100%"}
+        )
+
+
+class PaymentMonthFilter(admin.SimpleListFilter):
+    """Payment month choices from the rollup table instead of a DISTINCT over every payment."""
+    title = "month"
+    parameter_name = "month"
+
+    def lookups(self, request, model_admin):
+        months = (
+            MonthlyRollup.objects.filter(payments_count__gt=0)
+            .order_by("month").values_list("month", flat=True).distinct()
+        )
+        return [(m.isoformat(), m.strftime("%Y-%m")) for m in months]
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        try:
+            month = forms.DateField().clean(self.value()).replace(day=1)
+        except ValidationError as e:
+            raise IncorrectLookupParameters(e)
+        return queryset.filter(month__gte=month, month__lt=next_month(month))
 
 
 # Inlines
@@ -67,7 +277,7 @@ class GroupAdmin(admin.ModelAdmin):
 
     fieldsets = (
         (None, {
-            "fields": ("title", "description", "chat_id")
+            "fields": ("title", "description", "chat_id", "status_board")
         }),
         ("Finance", {
             "fields": ("monthly_fee",)
@@ -80,7 +290,7 @@ class GroupAdmin(admin.ModelAdmin):
 
 # Student Admin
 @admin.register(Student)
-class StudentAdmin(admin.ModelAdmin):
+class StudentAdmin(ExportMixin, admin.ModelAdmin):
     list_display = ("full_name", "phone_number", "groups_count")
     search_fields = ("full_name", "phone_number", "enrollments__group__title")
     list_filter = ("enrollments__group",)
@@ -97,6 +307,14 @@ class StudentAdmin(admin.ModelAdmin):
     def groups_count(self, obj):
         return obj.groups_count_agg
 
+    actions = ["export_csv", "export_xlsx"]
+    export_columns = (
+        ("ID", "id"),
+        ("Full name", "full_name"),
+        ("Phone", "phone_number"),
+        ("Groups", "groups_count_agg"),
+    )
+
     fieldsets = (
         (None, {
             "fields": ("full_name", "phone_number")
@@ -106,7 +324,7 @@ class StudentAdmin(admin.ModelAdmin):
 
 # Enrollment Admin
 @admin.register(Enrollment)
-class EnrollmentAdmin(admin.ModelAdmin):
+class EnrollmentAdmin(ExportMixin, admin.ModelAdmin):
     list_display = (
         "student",
         "group",
@@ -114,6 +332,8 @@ class EnrollmentAdmin(admin.ModelAdmin):
         "joined_at",
         "payments_count",
         "total_paid",
+        "balance",
+        "paid_through",
     )
     list_filter = ("group", "joined_at")
     search_fields = ("student__full_name", "group__title")
@@ -122,6 +342,7 @@ class EnrollmentAdmin(admin.ModelAdmin):
     list_select_related = ("student", "group")
     inlines = [PaymentInline]
     autocomplete_fields = ("student", "group")
+    readonly_fields = ("balance", "paid_through")
     list_per_page = 50
 
     def get_queryset(self, request):
@@ -139,30 +360,59 @@ class EnrollmentAdmin(admin.ModelAdmin):
     def total_paid(self, obj):
         return obj.total_paid_agg
 
+    actions = ["export_csv", "export_xlsx"]
+    export_columns = (
+        ("ID", "id"),
+        ("Student", "student__full_name"),
+        ("Group", "group__title"),
+        ("Monthly fee", "monthly_fee"),
+        ("Joined at", "joined_at"),
+        ("Active", "is_active"),
+        ("Payments", "payments_count_agg"),
+        ("Total paid", "total_paid_agg"),
+        ("Balance", "balance"),
+        ("Paid through", "paid_through"),
+    )
+
     fieldsets = (
         (None, {
             "fields": ("student", "group")
         }),
         ("Finance & Dates", {
-            "fields": ("monthly_fee", "joined_at")
+            "fields": ("monthly_fee", "joined_at", "balance", "paid_through")
         }),
     )
 
 
 # Payment Admin
 @admin.register(Payment)
-class PaymentAdmin(admin.ModelAdmin):
+class PaymentAdmin(ExportMixin, admin.ModelAdmin):
     change_list_template = "admin/main/payment/change_list.html"
 
     list_display = ("enrollment", "student", "group", "amount", "month", "paid_at", "creator")
-    list_filter = ("enrollment__group", "enrollment__student", "created_by", "month", "paid_at")
+    # Students and users are picked by autocomplete; a plain filter would list every row
+    list_filter = (
+        "enrollment__group",
+        ("enrollment__student", AutocompleteFilter),
+        ("created_by", AutocompleteFilter),
+        PaymentMonthFilter,
+        "paid_at",
+    )
     search_fields = ("enrollment__student__full_name", "enrollment__group__title")
     date_hierarchy = "paid_at"
     ordering = ("-paid_at",)
-    list_select_related = ("enrollment__student", "enrollment__group")
+    list_select_related = ("enrollment__student", "enrollment__group", "created_by")
     autocomplete_fields = ("enrollment",)
     readonly_fields = ("paid_at",)
     list_per_page = 50
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+    report_cache_timeout = 60
+
+    @property
+    def media(self):
+        return super().media + AutocompleteFilter.media(Payment._meta.get_field("created_by"), self.admin_site)
 
     @admin.display(ordering="enrollment__student__full_name", description="Student")
     def student(self, obj):
@@ -176,6 +426,19 @@ class PaymentAdmin(admin.ModelAdmin):
     def creator(self, obj):
         return obj.created_by or "—"
 
+    actions = ["export_csv", "export_xlsx"]
+    export_columns = (
+        ("ID", "id"),
+        ("Student", "enrollment__student__full_name"),
+        ("Phone", "enrollment__student__phone_number"),
+        ("Group", "enrollment__group__title"),
+        ("Month", "month"),
+        ("Amount", "amount"),
+        ("Paid at", "paid_at"),
+        ("Created by", "created_by__username"),
+    )
+    export_ignored_params = ("target_month",)
+
     def _fmt(self, n: int) -> str:
         try:
             return f"{int(n):,}".replace(",", " ")
@@ -205,27 +468,45 @@ class PaymentAdmin(admin.ModelAdmin):
         group_id = request.GET.get("enrollment__group__id__exact")
         student_id = request.GET.get("enrollment__student__id__exact")
 
-        enr_qs = Enrollment.objects.filter(is_active=True)
-        if group_id:
-            enr_qs = enr_qs.filter(group_id=group_id)
-        # If student filter applied, restrict to that student's active enrollments
-        if student_id:
-            enr_qs = enr_qs.filter(student_id=student_id)
-
-        expected_current = enr_qs.aggregate(total=Coalesce(Sum("monthly_fee"), 0))["total"] or 0
-        expected_selected = expected_current if sel_m == cur_m else enr_qs.aggregate(total=Coalesce(Sum("monthly_fee"), 0))["total"] or 0
+        key = f"payment-report:{group_id}:{student_id}:{sel_m:%Y-%m}:{cur_m:%Y-%m}"
+        data = cache.get(key)
+        if data is None:
+            data = self._report_data(group_id, student_id, cur_m, sel_m)
+            cache.set(key, data, self.report_cache_timeout)
+        return data
 
-        pay_sel = Payment.objects.filter(month=sel_m.date())
-        pay_cur = Payment.objects.filter(month=cur_m.date())
-        if group_id:
-            pay_sel = pay_sel.filter(enrollment__group_id=group_id)
-            pay_cur = pay_cur.filter(enrollment__group_id=group_id)
+    def _report_data(self, group_id, student_id, cur_m, sel_m):
         if student_id:
-            pay_sel = pay_sel.filter(enrollment__student_id=student_id)
-            pay_cur = pay_cur.filter(enrollment__student_id=student_id)
-
-        collected_selected = pay_sel.aggregate(total=Coalesce(Sum("amount"), 0))["total"] or 0
-        collected_current = pay_cur.aggregate(total=Coalesce(Sum("amount"), 0))["total"] or 0
+            # Rollups are per group; a single student's figures come from raw rows,
+            # with the rollups' definition of expected (active enrollments joined by the month's end)
+            enr_qs = Enrollment.objects.filter(is_active=True, student_id=student_id)
+            pay_qs = Payment.objects.filter(month__in=[sel_m.date(), cur_m.date()], enrollment__student_id=student_id)
+            if group_id:
+                enr_qs = enr_qs.filter(group_id=group_id)
+                pay_qs = pay_qs.filter(enrollment__group_id=group_id)
+
+            expected = enr_qs.aggregate(
+                current=Coalesce(Sum("monthly_fee", filter=Q(joined_at__lt=self._month_start(cur_m + timedelta(days=32)))), 0),
+                selected=Coalesce(Sum("monthly_fee", filter=Q(joined_at__lt=self._month_start(sel_m + timedelta(days=32)))), 0),
+            )
+            collected = pay_qs.aggregate(
+                current=Coalesce(Sum("amount", filter=Q(month=cur_m.date())), 0),
+                selected=Coalesce(Sum("amount", filter=Q(month=sel_m.date())), 0),
+            )
+            expected_current, expected_selected = expected["current"], expected["selected"]
+            collected_current, collected_selected = collected["current"], collected["selected"]
+        else:
+            def _month_totals(month):
+                rows = month_rollups(month)
+                if group_id:
+                    rows = [r for r in rows if str(r["id"]) == str(group_id)]
+                return sum(r["expected"] for r in rows), sum(r["collected"] for r in rows)
+
+            expected_current, collected_current = _month_totals(cur_m)
+            if sel_m == cur_m:
+                expected_selected, collected_selected = expected_current, collected_current
+            else:
+                expected_selected, collected_selected = _month_totals(sel_m)
 
         data = {
             "current_month_str": f"{cur_m.year:04d}-{cur_m.month:02d}",
@@ -244,9 +525,40 @@ class PaymentAdmin(admin.ModelAdmin):
         except Exception:
             # Fallback if something goes wrong; avoid breaking admin
             extra_context["report"] = None
+        # The report's month is not a lookup; left in, the changelist rejects it
+        request.GET = request.GET.copy()
+        request.GET.pop("target_month", None)
         return super().changelist_view(request, extra_context=extra_context)
 
 
+# Charge Admin
+@admin.register(Charge)
+class ChargeAdmin(admin.ModelAdmin):
+    list_display = ("enrollment", "month", "amount", "created_at")
+    list_filter = ("month", "enrollment__group")
+    search_fields = ("enrollment__student__full_name", "enrollment__group__title")
+    ordering = ("-month",)
+    list_select_related = ("enrollment__student", "enrollment__group")
+    autocomplete_fields = ("enrollment",)
+    readonly_fields = ("created_at",)
+    list_per_page = 50
+
+
+# Monthly Rollup Admin
+@admin.register(MonthlyRollup)
+class MonthlyRollupAdmin(admin.ModelAdmin):
+    list_display = ("group", "month", "expected", "collected", "inactive_collected", "payments_count", "updated_at")
+    list_filter = ("month",)
+    search_fields = ("group__title",)
+    ordering = ("-month", "group__title")
+    list_select_related = ("group",)
+    readonly_fields = ("group", "month", "expected", "collected", "inactive_collected", "payments_count", "updated_at")
+    list_per_page = 50
+
+    def has_add_permission(self, request):
+        return False
+
+
 # Admin site titles
 admin.site.site_header = "LC Payments Administration"
 admin.site.site_title = "LC Payments Admin"
@@ -0,0 +1,265 @@
+"""Streaming CSV/XLSX exports.
+
+Rows are read with a server-side cursor (`.iterator(chunk_size=...)`) and
+written straight to a file object, so memory stays flat however many rows
+the queryset has. The XLSX writer is a minimal single-sheet workbook
+streamed into a zip; it needs no third-party package and works on
+unseekable outputs.
+"""
+import csv
+import zipfile
+from datetime import date, datetime
+from xml.sax.saxutils import escape
+
+from django.db import transaction
+from django.utils import timezone
+
+CHUNK_SIZE = 2000
+
+# (header, values_list field)
+PAYMENT_COLUMNS = (
+    ('ID', 'id'),
+    ("O'quvchi", 'enrollment__student__full_name'),
+    ('Telefon', 'enrollment__student__phone_number'),
+    ('Guruh', 'enrollment__group__title'),
+    ("To'lov oyi", 'month'),
+    ('Summa', 'amount'),
+    ("To'langan vaqt", 'paid_at'),
+    ('Qabul qilgan', 'created_by__username'),
+)
+
+
+def iter_rows(qs, columns):
+    """Tuples of the columns' values, datetimes in local time, without caching the queryset."""
+    # Outside a transaction the cursor is declared WITH HOLD, and Postgres
+    # materialises the whole result before the first row; inside one, rows
+    # stream as they are fetched (and come from a single snapshot).
+    with transaction.atomic(using=qs.db):
+        rows = qs.values_list(*(field for _, field in columns)).iterator(chunk_size=CHUNK_SIZE)
+        for row in rows:
+            yield tuple(timezone.localtime(v).replace(tzinfo=None) if isinstance(v, datetime) else v for v in row)
+
+
+class CsvWriter:
+    extension = 'csv'
+    content_type = 'text/csv'
+    MAX_ROWS = None
+
+    def __init__(self, fileobj):
+        self._file = fileobj
+        # The BOM makes Excel read the file as UTF-8
+        self._file.write('\ufeff'.encode())
+        self._stream = _Utf8(fileobj)
+        self._csv = csv.writer(self._stream)
+
+    def writerow(self, row):
+        self._csv.writerow(_csv_value(v) for v in row)
+
+    def close(self):
+        pass
+
+
+class _Utf8:
+    def __init__(self, fileobj):
+        self._file = fileobj
+
+    def write(self, text: str):
+        return self._file.write(text.encode())
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="xl/workbook.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+    '</Relationships>'
+)
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+    '<Relationship Id="rId2" Target="styles.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles"/>'
+    '</Relationships>'
+)
+# Cell styles: 0 general, 1 date (built-in format 14), 2 date and time (built-in format 22)
+_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="3">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="22" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '</cellXfs>'
+    '</styleSheet>'
+)
+_SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+_SHEET_END = '</sheetData></worksheet>'
+
+_EXCEL_EPOCH = datetime(1899, 12, 30)
+# Characters XML 1.0 does not allow
+_XML_ILLEGAL = dict.fromkeys(c for c in range(32) if c not in (9, 10, 13))
+
+
+def _xlsx_cell(value) -> str:
+    if value is None:
+        return '<c/>'
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c><v>{value}</v></c>'
+    if isinstance(value, datetime):
+        delta = value - _EXCEL_EPOCH
+        return f'<c s="2"><v>{delta.days + delta.seconds / 86400:.6f}</v></c>'
+    if isinstance(value, date):
+        return f'<c s="1"><v>{(value - _EXCEL_EPOCH.date()).days}</v></c>'
+    text = escape(str(value).translate(_XML_ILLEGAL))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+class XlsxWriter:
+    extension = 'xlsx'
+    content_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+    # Excel opens at most this many rows per sheet
+    MAX_ROWS = 1_048_576
+
+    def __init__(self, fileobj):
+        self._zip = zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_DEFLATED)
+        for name, data in (
+            ('[Content_Types].xml', _CONTENT_TYPES),
+            ('_rels/.rels', _ROOT_RELS),
+            ('xl/workbook.xml', _WORKBOOK),
+            ('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS),
+            ('xl/styles.xml', _STYLES),
+        ):
+            self._zip.writestr(name, data)
+        self._sheet = self._zip.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True)
+        self._sheet.write(_SHEET_START.encode())
+
+    def writerow(self, row):
+        self._sheet.write(('<row>' + ''.join(_xlsx_cell(v) for v in row) + '</row>').encode())
+
+    def close(self):
+        self._sheet.write(_SHEET_END.encode())
+        self._sheet.close()
+        self._zip.close()
+
+
+WRITERS = {
+    'csv': CsvWriter,
+    'xlsx': XlsxWriter,
+}
+
+
+def write_export(qs, columns, fmt: str, fileobj) -> int:
+    """Write the header and every row of `qs` to `fileobj`; returns the row count."""
+    writer = WRITERS[fmt](fileobj)
+    writer.writerow([header for header, _ in columns])
+    count = 0
+    for row in iter_rows(qs, columns):
+        writer.writerow(row)
+        count += 1
+    writer.close()
+    return count
+
+
+class _Chunks:
+    """Write-only file object whose contents are taken out as they are produced."""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def stream_export(qs, columns, fmt: str, rows_per_chunk: int = 500):
+    """Yield the export as byte chunks (for `StreamingHttpResponse`), one per `rows_per_chunk` rows."""
+    out = _Chunks()
+    writer = WRITERS[fmt](out)
+    writer.writerow([header for header, _ in columns])
+    for i, row in enumerate(iter_rows(qs, columns), start=1):
+        writer.writerow(row)
+        if i % rows_per_chunk == 0:
+            data = out.take()
+            if data:
+                yield data
+    writer.close()
+    yield out.take()
+
+
+def write_export_parts(qs, columns, fmt: str, path_for, max_bytes: int) -> list:
+    """Like `write_export`, split into files of about `max_bytes` (and within the format's row limit).
+
+    `path_for(n)` names part n (from 1). Returns [(path, row count)]; there is
+    always at least one part, with just the header when `qs` is empty.
+    """
+    header = [header for header, _ in columns]
+    rows = iter_rows(qs, columns)
+    row = next(rows, None)
+    parts = []
+    while row is not None or not parts:
+        path = path_for(len(parts) + 1)
+        with open(path, 'wb') as fileobj:
+            writer = WRITERS[fmt](fileobj)
+            writer.writerow(header)
+            count = 0
+            while row is not None:
+                writer.writerow(row)
+                count += 1
+                row = next(rows, None)
+                if writer.MAX_ROWS and count >= writer.MAX_ROWS - 1:
+                    break
+                # The file size lags the zip's compression buffer a little; callers leave a margin
+                if fileobj.tell() >= max_bytes:
+                    break
+            writer.close()
+        parts.append((path, count))
+    return parts
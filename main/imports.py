@@ -0,0 +1,143 @@
+"""Payment lists pasted into the bot or sent as a .txt/.csv file.
+
+Each line reads "student or phone; group; YYYY-MM; amount" (tabs or commas
+separate the fields of a text without semicolons). Students are matched
+exactly on their name or phone search key (main.translit), groups on their
+title folded the same way, and months and amounts follow the rules of the
+one-by-one payment flow (main.payments). Resolving costs two queries however
+many lines there are: the groups, and the active enrollments of every named
+student in the named groups.
+"""
+import csv
+from collections import defaultdict
+
+from django.db.models import Q
+
+from .models import Enrollment, Group
+from .payments import parse_amount, parse_month
+from .search import is_phone_query
+from .translit import normalize_name, normalize_phone
+
+MAX_LINES = 5000
+
+# Why a line was left out (shown to the admin)
+BAD_FIELDS = "4 ta maydon kerak: o'quvchi; guruh; YYYY-MM; summa"
+BAD_MONTH = "oy noto'g'ri (YYYY-MM)"
+BAD_AMOUNT = "summa noto'g'ri"
+NO_GROUP = "guruh topilmadi"
+MANY_GROUPS = "bu nomda bir nechta guruh bor"
+NO_STUDENT = "o'quvchi bu guruhda topilmadi"
+MANY_STUDENTS = "guruhda bu nomda bir nechta o'quvchi bor"
+DUPLICATE = "takroriy qator"
+TOO_MANY = f"{MAX_LINES} qatordan ortig'i o'qilmadi"
+
+
+def _delimiter(text: str) -> str:
+    if ';' in text:
+        return ';'
+    return '\t' if '\t' in text else ','
+
+
+def parse_lines(text: str) -> tuple:
+    """(rows, errors) from the raw text.
+
+    Rows are dicts with line, text, student (search key), phone (whether the
+    key is a phone number), group (title key), month and amount; errors are
+    (line number, text, reason) tuples. Blank lines and a header line are skipped.
+    """
+    rows, errors = [], []
+    delimiter = _delimiter(text)
+    for number, raw in enumerate(text.splitlines(), start=1):
+        raw = raw.strip()
+        # One line at a time, so a stray quote cannot swallow the lines after it
+        fields = [f.strip() for f in next(csv.reader([raw], delimiter=delimiter), [])]
+        if not any(fields):
+            continue
+        if len(rows) + len(errors) >= MAX_LINES:
+            errors.append((number, '', TOO_MANY))
+            break
+        if len(fields) != 4 or not fields[0] or not fields[1]:
+            errors.append((number, raw, BAD_FIELDS))
+            continue
+        student, group, month, amount = fields
+        month, amount = parse_month(month), parse_amount(amount)
+        if month is None and amount is None and not rows and not errors:
+            continue  # column titles
+        if month is None:
+            errors.append((number, raw, BAD_MONTH))
+            continue
+        if amount is None:
+            errors.append((number, raw, BAD_AMOUNT))
+            continue
+        phone = is_phone_query(student)
+        rows.append({
+            'line': number,
+            'text': raw,
+            'student': normalize_phone(student) if phone else normalize_name(student),
+            'phone': phone,
+            'group': normalize_name(group),
+            'month': month,
+            'amount': amount,
+        })
+    return rows, errors
+
+
+def resolve(rows: list) -> tuple:
+    """(payments, errors) for parsed rows, in two queries.
+
+    Payments are dicts with line, enrollment_id, group_id, name, title, month
+    and amount; errors are (line number, text, reason) tuples.
+    """
+    groups = defaultdict(list)  # title key -> [(id, title)]
+    for group_id, title in Group.objects.values_list('id', 'title'):
+        groups[normalize_name(title)].append((group_id, title))
+
+    group_ids = {groups[key][0][0] for key in {r['group'] for r in rows} if len(groups.get(key, ())) == 1}
+    names = {r['student'] for r in rows if not r['phone']}
+    phones = {r['student'] for r in rows if r['phone']}
+    enrollments = defaultdict(list)  # (group id, phone?, key) -> [(enrollment id, full name)]
+    if group_ids and (names or phones):
+        for enrollment_id, group_id, name_key, phone_key, full_name in (
+            Enrollment.objects.filter(is_active=True, group_id__in=group_ids)
+            .filter(Q(student__search_name__in=names) | Q(student__phone_digits__in=phones))
+            .values_list('id', 'group_id', 'student__search_name', 'student__phone_digits', 'student__full_name')
+        ):
+            if name_key in names:
+                enrollments[(group_id, False, name_key)].append((enrollment_id, full_name))
+            if phone_key in phones:
+                enrollments[(group_id, True, phone_key)].append((enrollment_id, full_name))
+
+    payments, errors, seen = [], [], {}
+    for row in rows:
+        matches = groups.get(row['group'], [])
+        if len(matches) != 1:
+            errors.append((row['line'], row['text'], MANY_GROUPS if matches else NO_GROUP))
+            continue
+        group_id, title = matches[0]
+        students = enrollments.get((group_id, row['phone'], row['student']), [])
+        if len(students) != 1:
+            errors.append((row['line'], row['text'], MANY_STUDENTS if students else NO_STUDENT))
+            continue
+        enrollment_id, name = students[0]
+        key = (enrollment_id, row['month'], row['amount'])
+        if key in seen:
+            errors.append((row['line'], row['text'], f"{DUPLICATE} ({seen[key]}-qator bilan)"))
+            continue
+        seen[key] = row['line']
+        payments.append({
+            'line': row['line'],
+            'enrollment_id': enrollment_id,
+            'group_id': group_id,
+            'name': name,
+            'title': title,
+            'month': row['month'],
+            'amount': row['amount'],
+        })
+    return payments, errors
+
+
+def prepare_import(text: str) -> tuple:
+    """(payments, errors) for a pasted list; see `parse_lines()` and `resolve()`."""
+    rows, errors = parse_lines(text)
+    payments, unresolved = resolve(rows)
+    return payments, sorted(errors + unresolved)
@@ -0,0 +1,124 @@
+"""Monthly charge ledger.
+
+Every active enrollment is charged its monthly fee once per month. An
+enrollment's balance is the sum of its charges minus the sum of its payments,
+and `Enrollment.balance` / `Enrollment.paid_through` hold that result so debt
+lookups never have to walk payments.
+"""
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from .models import Charge, Enrollment, Payment
+from .rollups import as_month, next_month
+
+
+def current_month():
+    return as_month(datetime.now(dt_timezone.utc))
+
+
+def _sum_subquery(model, field='amount', **filters):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(enrollment=OuterRef('pk'), **filters)
+            .values('enrollment')
+            .annotate(total=Sum(field))
+            .values('total')[:1]
+        ),
+        0,
+    )
+
+
+def sync_balances(enrollments):
+    """Recompute balance and paid_through for an Enrollment queryset with two UPDATEs."""
+    enrollments.update(balance=_sum_subquery(Charge) - _sum_subquery(Payment))
+    # A charge is covered when the charges after it add up to at least the balance
+    later_charges = Coalesce(
+        Subquery(
+            Charge.objects.filter(enrollment=OuterRef('enrollment'), month__gt=OuterRef('month'))
+            .values('enrollment')
+            .annotate(total=Sum('amount'))
+            .values('total')[:1]
+        ),
+        0,
+    )
+    enrollments.update(paid_through=Subquery(
+        Charge.objects.filter(enrollment=OuterRef('pk'))
+        .annotate(later=later_charges)
+        .filter(later__gte=OuterRef('balance'))
+        .order_by('-month')
+        .values('month')[:1]
+    ))
+
+
+@transaction.atomic
+def charge_month(month=None) -> int:
+    """Charge every active enrollment that joined by `month`. Safe to run repeatedly.
+
+    Returns the number of new charges.
+    """
+    month = as_month(month or current_month())
+    nm = next_month(month)
+    pending = list(
+        Enrollment.objects.filter(is_active=True, joined_at__lt=datetime(nm.year, nm.month, 1, tzinfo=dt_timezone.utc))
+        .exclude(charges__month=month)
+        .values_list('id', 'monthly_fee')
+    )
+    if not pending:
+        return 0
+    Charge.objects.bulk_create(
+        [Charge(enrollment_id=eid, month=month, amount=fee or 0) for eid, fee in pending],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    sync_balances(Enrollment.objects.filter(id__in=[eid for eid, _ in pending]))
+    from .signals import month_charged  # main.signals imports this module
+    transaction.on_commit(lambda: month_charged.send(sender=Charge, month=month, count=len(pending)))
+    return len(pending)
+
+
+@transaction.atomic
+def charge_enrollment(enrollment_id: int, month=None) -> bool:
+    """Charge one enrollment for `month` unless it already is. Returns True if charged."""
+    month = as_month(month or current_month())
+    fee = Enrollment.objects.values_list('monthly_fee', flat=True).get(pk=enrollment_id)
+    _, created = Charge.objects.get_or_create(enrollment_id=enrollment_id, month=month, defaults={'amount': fee or 0})
+    return created
+
+
+@transaction.atomic
+def backfill(enrollments=None, until=None) -> int:
+    """Charge active enrollments for every month from their join month to `until`.
+
+    Uses the current monthly fee for past months; months already charged are
+    kept as they are. Returns the number of enrollments processed.
+    """
+    until = as_month(until or current_month())
+    qs = Enrollment.objects.filter(is_active=True) if enrollments is None else enrollments.filter(is_active=True)
+    charges = []
+    ids = []
+    for eid, fee, joined_at in qs.values_list('id', 'monthly_fee', 'joined_at').iterator(chunk_size=2000):
+        ids.append(eid)
+        month = as_month(joined_at)
+        while month <= until:
+            charges.append(Charge(enrollment_id=eid, month=month, amount=fee or 0))
+            month = next_month(month)
+        if len(charges) >= 5000:
+            Charge.objects.bulk_create(charges, batch_size=1000, ignore_conflicts=True)
+            charges = []
+    Charge.objects.bulk_create(charges, batch_size=1000, ignore_conflicts=True)
+    if ids:
+        sync_balances(Enrollment.objects.filter(id__in=ids))
+    return len(ids)
+
+
+def group_debt_totals(group_ids=None) -> dict:
+    """group_id -> total debt of its active enrollments, in one grouped query."""
+    qs = Enrollment.objects.filter(is_active=True, balance__gt=0)
+    if group_ids is not None:
+        qs = qs.filter(group_id__in=group_ids)
+    rows = qs.values('group_id').annotate(total=Sum('balance')).order_by()
+    return {r['group_id']: r['total'] for r in rows}
+
@@ -0,0 +1,125 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+
+from main import search
+from main.models import Student
+from main.translit import normalize_name, normalize_phone
+
+FIRST = [
+    'Ali', 'Vali', 'Aziz', 'Jasur', 'Shoxrux', 'Sardor', 'Dilnoza', 'Gulnora', 'Malika', 'Nodir',
+    'Otabek', 'Umid', 'Bekzod', 'Farrux', 'Zarina', 'Kamola', "G'ayrat", "O'tkir", 'Xurshid', 'Sevara',
+]
+LAST = [
+    'Aliyev', 'Valiyev', 'Karimov', 'Toshmatov', 'Xasanov', 'Rahimov', 'Yusupov', "Qo'chqorov",
+    'Ergashev', 'Sobirov', 'Nazarov', 'Mirzayev', 'Abdullayev', 'Qodirov', 'Saidov',
+]
+CYRILLIC = {'Ali': 'Али', 'Karimov': 'Каримов', 'Xasanov': 'Хасанов', 'Toshmatov': 'Тошматов', 'Sardor': 'Сардор'}
+
+# What admins type in inline mode, keystroke by keystroke: short and full names,
+# Cyrillic, transliteration variants, typos and phone fragments
+QUERIES = {
+    'name prefix (1-2 letters)': ['a', 'al', 'ka'],
+    'name (3+ letters)': ['ali', 'aliy', 'aliyev', 'kari', 'karimov', 'sard', 'qochqorov a'],
+    'cyrillic / transliteration': ['тош', 'Тошматов', 'xasanov', 'hasanov', 'khasanov'],
+    'typo': ['karimv', 'toshmatvo', 'abdulayev'],
+    'phone': ['90', '9012', '90 123', '+99890123', '998 93 45'],
+}
+
+
+def _generate(count: int, seed: int) -> list:
+    """Students named like the centre's (a fifth in Cyrillic), with random Uzbek mobile numbers."""
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(count):
+        first, last = rng.choice(FIRST), rng.choice(LAST)
+        if rng.random() < 0.2:
+            first, last = CYRILLIC.get(first, first), CYRILLIC.get(last, last)
+        name = f"{last} {first}" + ('' if rng.random() < 0.7 else f" {rng.choice(FIRST)}ovich")
+        phone = f"+998{rng.choice(['90', '91', '93', '94', '97', '99', '33', '88'])}{rng.randint(0, 9_999_999):07d}"
+        rows.append(Student(
+            full_name=name, phone_number=phone, search_name=normalize_name(name), phone_digits=normalize_phone(phone),
+        ))
+    return rows
+
+
+def _icontains(query: str) -> list:
+    """The search the bot ran before main.search, for comparison."""
+    cond = Q(full_name__icontains=query) | Q(phone_number__icontains=query)
+    if query.isdigit():
+        cond |= Q(id=int(query))
+    return list(Student.objects.filter(cond).order_by('full_name', 'id')[:25])
+
+
+def _search(query: str) -> list:
+    return search.search_students(query, 25)
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure student search latency (main.search, as used by inline mode) against the '
+        'icontains search it replaced: p50/p95 per kind of query. With --generate, synthetic '
+        'students are added inside a transaction that is rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--generate', type=int, default=0, metavar='N',
+                            help='Add N generated students for the run (rolled back; default 0)')
+        parser.add_argument('--runs', type=int, default=15, help='Times each query is run (default 15)')
+        parser.add_argument('--seed', type=int, default=7)
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1 or options['generate'] < 0:
+            raise CommandError('--runs must be positive and --generate not negative.')
+        with transaction.atomic():
+            if options['generate']:
+                self._add_students(options['generate'], options['seed'])
+            self._report(options['runs'])
+            transaction.set_rollback(True)
+
+    def _add_students(self, count: int, seed: int):
+        started = time.perf_counter()
+        Student.objects.bulk_create(_generate(count, seed), batch_size=5000)
+        with connection.cursor() as cursor:
+            # Move fresh GIN entries out of the pending list, which every search would scan otherwise
+            cursor.execute(
+                "SELECT gin_clean_pending_list(indexrelid::regclass) FROM pg_index i "
+                "JOIN pg_class c ON c.oid = i.indexrelid JOIN pg_am am ON am.oid = c.relam "
+                "WHERE i.indrelid = 'main_student'::regclass AND am.amname = 'gin'"
+            )
+            cursor.execute('ANALYZE main_student')
+        self.stdout.write(f'Added {count} students in {time.perf_counter() - started:.1f} s (rolled back at the end)')
+
+    def _report(self, runs: int):
+        with connection.cursor() as cursor:
+            cursor.execute('SHOW server_version')
+            version = cursor.fetchone()[0]
+        trigram = search.trigram_enabled()
+        self.stdout.write(
+            f'{Student.objects.count()} students, PostgreSQL {version}, '
+            + ('pg_trgm: yes (GiST nearest-first path)' if trigram else 'pg_trgm: NO (substring fallback path)')
+        )
+        for label, func in (('icontains (before)', _icontains), ('main.search', _search)):
+            func('x')  # connection and plan caches
+            everything = []
+            self.stdout.write(f'\n{label}')
+            for kind, queries in QUERIES.items():
+                timings = []
+                for _ in range(runs):
+                    for query in queries:
+                        started = time.perf_counter()
+                        func(query)
+                        timings.append((time.perf_counter() - started) * 1000)
+                everything += timings
+                self.stdout.write(f'  {kind:28} {self._percentiles(timings)}')
+            self.stdout.write(f'  {"all":28} {self._percentiles(everything)}')
+
+    @staticmethod
+    def _percentiles(timings: list) -> str:
+        timings = sorted(timings)
+        p95 = timings[min(int(len(timings) * 0.95), len(timings) - 1)]
+        return f'p50 {statistics.median(timings):6.1f} ms   p95 {p95:6.1f} ms'
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from main import rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-group monthly rollup table from raw payments and enrollments'
+
+    def handle(self, *args, **options):
+        count = rollups.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} rollup row(s).'))
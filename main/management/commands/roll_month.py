@@ -0,0 +1,31 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main import ledger
+
+
+class Command(BaseCommand):
+    help = 'Charge every active enrollment for the month (month-rollover job); safe to run repeatedly'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help='Month to charge as YYYY-MM (default: current month)')
+        parser.add_argument(
+            '--backfill', action='store_true',
+            help='Charge every month since each enrollment joined, up to --month',
+        )
+
+    def handle(self, *args, **options):
+        month = None
+        if options['month']:
+            try:
+                month = datetime.strptime(options['month'], '%Y-%m').date()
+            except ValueError:
+                raise CommandError('--month must look like YYYY-MM')
+
+        if options['backfill']:
+            count = ledger.backfill(until=month)
+            self.stdout.write(self.style.SUCCESS(f'Backfilled charges for {count} enrollment(s).'))
+        else:
+            count = ledger.charge_month(month)
+            self.stdout.write(self.style.SUCCESS(f'Created {count} charge(s).'))
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-18 01:37
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicate_enrollments(apps, schema_editor):
+    """Fold repeated (student, group) enrollments into one before the unique constraint.
+
+    The active row (the oldest, if several are) is kept with the earliest join
+    date, and the payments of the others are moved onto it.
+    """
+    Enrollment = apps.get_model('main', 'Enrollment')
+    Payment = apps.get_model('main', 'Payment')
+    duplicates = (
+        Enrollment.objects.values('student_id', 'group_id')
+        .annotate(rows=Count('id'), joined_at=Min('joined_at'))
+        .filter(rows__gt=1)
+        .order_by()
+    )
+    for dup in duplicates:
+        rows = list(
+            Enrollment.objects.filter(student_id=dup['student_id'], group_id=dup['group_id'])
+            .order_by('-is_active', 'id')
+            .values_list('id', flat=True)
+        )
+        keep, others = rows[0], rows[1:]
+        Payment.objects.filter(enrollment_id__in=others).update(enrollment_id=keep)
+        Enrollment.objects.filter(id__in=others).delete()
+        Enrollment.objects.filter(id=keep).update(joined_at=dup['joined_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_enrollments, migrations.RunPython.noop),
+    ]
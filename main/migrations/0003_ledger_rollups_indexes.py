@@ -0,0 +1,103 @@
+# Generated by Django 5.2.6 on 2026-10-18 01:37
+#
+# Existing installs fill the new tables afterwards with
+#   python manage.py roll_month --backfill && python manage.py rebuild_rollups
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('botapp', '0002_botuser_username_idx'),
+        ('main', '0002_merge_duplicate_enrollments'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='enrollment',
+            name='balance',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='enrollment',
+            name='paid_through',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='enrollment',
+            name='student',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='enrollments', to='main.student'),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='created_by',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='botapp.botuser'),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='enrollment',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='payments', to='main.enrollment'),
+        ),
+        migrations.CreateModel(
+            name='Charge',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('amount', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('enrollment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='charges', to='main.enrollment')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('enrollment', 'month'), name='uniq_charge_enrollment_month')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MonthlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('expected', models.BigIntegerField(default=0)),
+                ('collected', models.BigIntegerField(default=0)),
+                ('payments_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='main.group')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('group', 'month'), name='uniq_rollup_group_month')],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='group',
+            index=models.Index(fields=['created_at', 'id'], name='group_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['full_name', 'id'], name='student_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['paid_at', 'id'], name='payment_paid_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['month'], name='payment_month_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['enrollment', 'month'], name='payment_enrollment_month_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['created_by', 'paid_at'], name='payment_creator_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='enrollment',
+            index=models.Index(condition=models.Q(('balance__gt', 0), ('is_active', True)), fields=['group', '-balance'], name='enrollment_debtor_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='enrollment',
+            constraint=models.UniqueConstraint(fields=('student', 'group'), name='uniq_enrollment_student_group'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.6 on 2026-10-18 01:42
+
+from django.db import migrations, models
+
+from main.translit import normalize_name, normalize_phone
+
+TRIGRAM_INDEXES = {
+    'student_search_trgm_idx': 'search_name',
+    'student_phone_trgm_idx': 'phone_digits',
+}
+
+
+def fill_search_keys(apps, schema_editor):
+    Student = apps.get_model('main', 'Student')
+    batch = []
+    for student in Student.objects.only('id', 'full_name', 'phone_number').iterator(chunk_size=2000):
+        student.search_name = normalize_name(student.full_name)
+        student.phone_digits = normalize_phone(student.phone_number)
+        batch.append(student)
+        if len(batch) >= 2000:
+            Student.objects.bulk_update(batch, ['search_name', 'phone_digits'])
+            batch = []
+    Student.objects.bulk_update(batch, ['search_name', 'phone_digits'])
+
+
+def create_trigram_indexes(apps, schema_editor):
+    """GIN trigram indexes, where the server ships pg_trgm (search falls back to LIKE otherwise)."""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, column in TRIGRAM_INDEXES.items():
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON main_student USING gin ({column} gin_trgm_ops)')
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_ledger_rollups_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='student',
+            name='phone_digits',
+            field=models.CharField(default='', editable=False, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='student',
+            name='search_name',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(fill_search_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['search_name'], name='student_search_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['phone_digits'], name='student_phone_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
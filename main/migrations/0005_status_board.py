@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-18 02:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_student_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='group',
+            name='status_board',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='StatusBoard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('chat_id', models.CharField(max_length=255)),
+                ('message_id', models.BigIntegerField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='boards', to='main.group')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('group', 'month'), name='uniq_board_group_month')],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.6 on 2026-10-18 03:08
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_inactive_collected(apps, schema_editor):
+    """Payments of enrollments that are already inactive, per (group, month)."""
+    MonthlyRollup = apps.get_model('main', 'MonthlyRollup')
+    Payment = apps.get_model('main', 'Payment')
+    rows = (
+        Payment.objects.filter(enrollment__is_active=False)
+        .values('enrollment__group_id', 'month')
+        .annotate(total=Sum('amount'))
+        .order_by()
+    )
+    for r in rows:
+        MonthlyRollup.objects.filter(group_id=r['enrollment__group_id'], month=r['month']).update(
+            inactive_collected=r['total'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_status_board'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='monthlyrollup',
+            name='inactive_collected',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_inactive_collected, migrations.RunPython.noop),
+    ]
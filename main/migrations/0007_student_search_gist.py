@@ -0,0 +1,40 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:20
+
+from django.db import migrations
+
+
+def create_gist_index(apps, schema_editor):
+    """Swap the GIN name index for GiST, which can return matches nearest first (ORDER BY distance LIMIT n)."""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS student_search_gist_idx ON main_student '
+        'USING gist (search_name gist_trgm_ops(siglen=256))'
+    )
+    schema_editor.execute('DROP INDEX IF EXISTS student_search_trgm_idx')
+
+
+def drop_gist_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+    schema_editor.execute('CREATE INDEX IF NOT EXISTS student_search_trgm_idx ON main_student USING gin (search_name gin_trgm_ops)')
+    schema_editor.execute('DROP INDEX IF EXISTS student_search_gist_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_rollup_inactive_collected'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_gist_index, drop_gist_index),
+    ]
@@ -1,6 +1,9 @@
 from django.db import models
 from django.utils import timezone
 from typing import TYPE_CHECKING
+
+from .translit import normalize_name, normalize_phone
+
 if TYPE_CHECKING:
     from apps.botapp.models import BotUser
 
@@ -10,10 +13,18 @@ class Group(models.Model):
     description = models.TextField(null=True, blank=True)
     monthly_fee = models.BigIntegerField(default=0)
     chat_id = models.CharField(max_length=255, null=True, blank=True)
+    # Payments update one pinned board message in the chat instead of posting a message each
+    status_board = models.BooleanField(default=False)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
+
+    class Meta:
+        indexes = [
+            # Groups list, newest first
+            models.Index(fields=['created_at', 'id'], name='group_created_idx'),
+        ]
     
     def __str__(self):
         return self.title
@@ -23,18 +34,58 @@ class Student(models.Model):
     full_name = models.CharField(max_length=255)
     phone_number = models.CharField(max_length=20, null=True, blank=True)
     groups = models.ManyToManyField(Group, through="Enrollment", related_name='students')
+
+    # Search keys (see main.translit), filled in on save
+    search_name = models.CharField(max_length=255, default='', editable=False)
+    phone_digits = models.CharField(max_length=20, default='', editable=False)
+
+    class Meta:
+        indexes = [
+            # Student lists are ordered by name
+            models.Index(fields=['full_name', 'id'], name='student_name_idx'),
+            # Prefix lookups; trigram (GIN) indexes are added by migration 0002 where pg_trgm exists
+            models.Index(fields=['search_name'], name='student_search_prefix_idx', opclasses=['varchar_pattern_ops']),
+            models.Index(fields=['phone_digits'], name='student_phone_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.search_name = normalize_name(self.full_name)
+        self.phone_digits = normalize_phone(self.phone_number)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'search_name', 'phone_digits'}
+        super().save(*args, **kwargs)
     
     def __str__(self):
         return self.full_name
     
 
 class Enrollment(models.Model):
-    student: "Student" = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='enrollments')
+    # Indexed by the (student, group) constraint
+    student: "Student" = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='enrollments', db_index=False)
     group: "Group" = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='enrollments')
     chat_id = models.CharField(max_length=255, null=True, blank=True)
     monthly_fee = models.BigIntegerField(default=0)
     joined_at = models.DateTimeField(default=timezone.now)
     is_active = models.BooleanField(default=True)
+
+    # Denormalized from the charge ledger (see main.ledger): charges minus payments,
+    # and the last charged month fully covered by payments (oldest first)
+    balance = models.BigIntegerField(default=0)
+    paid_through = models.DateField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['student', 'group'], name='uniq_enrollment_student_group'),
+        ]
+        indexes = [
+            # Debtor lists and debt totals only ever read active enrollments that owe
+            models.Index(
+                fields=['group', '-balance'],
+                name='enrollment_debtor_idx',
+                condition=models.Q(is_active=True, balance__gt=0),
+            ),
+        ]
     
     def save(self, *args, **kwargs):
         if not self.monthly_fee:
@@ -48,10 +99,88 @@ class Enrollment(models.Model):
     
 
 class Payment(models.Model):
-    enrollment: "Enrollment" = models.ForeignKey(Enrollment, on_delete=models.CASCADE, related_name='payments')
+    # Both foreign keys are indexed by the composite indexes below
+    enrollment: "Enrollment" = models.ForeignKey(Enrollment, on_delete=models.CASCADE, related_name='payments', db_index=False)
     amount = models.BigIntegerField()
     month = models.DateField() # Represents the month for which the payment is made
     paid_at = models.DateTimeField(auto_now_add=True)
     
-    created_by: "BotUser" = models.ForeignKey("botapp.BotUser", on_delete=models.SET_NULL, null=True, blank=True)
-    
\ No newline at end of file
+    created_by: "BotUser" = models.ForeignKey("botapp.BotUser", on_delete=models.SET_NULL, null=True, blank=True, db_index=False)
+
+    class Meta:
+        indexes = [
+            # Payments list (newest first) and the dashboard's today/week/month windows
+            models.Index(fields=['paid_at', 'id'], name='payment_paid_at_idx'),
+            # Month reports and rollup rebuilds
+            models.Index(fields=['month'], name='payment_month_idx'),
+            # Per-enrollment payments for a month (student card, ledger)
+            models.Index(fields=['enrollment', 'month'], name='payment_enrollment_month_idx'),
+            # Payments list filtered by the admin who took them
+            models.Index(fields=['created_by', 'paid_at'], name='payment_creator_idx'),
+        ]
+    
+
+class Charge(models.Model):
+    """One month's fee billed to an enrollment; balances are charges minus payments."""
+    enrollment: "Enrollment" = models.ForeignKey(Enrollment, on_delete=models.CASCADE, related_name='charges')
+    month = models.DateField()
+    amount = models.BigIntegerField()
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['enrollment', 'month'], name='uniq_charge_enrollment_month'),
+        ]
+
+    def __str__(self):
+        return f"{self.enrollment_id} {self.month:%Y-%m}: {self.amount}"
+
+
+class MonthlyRollup(models.Model):
+    """Per-group totals for one month, kept in step with payments and enrollments.
+
+    `expected` is the sum of monthly fees of active enrollments that had joined by
+    that month; `collected` and `payments_count` cover every payment for the month,
+    and `inactive_collected` is the part of `collected` paid to enrollments that
+    are inactive now.
+    """
+    group: "Group" = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='rollups')
+    month = models.DateField()
+    expected = models.BigIntegerField(default=0)
+    collected = models.BigIntegerField(default=0)
+    inactive_collected = models.BigIntegerField(default=0)
+    payments_count = models.IntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['group', 'month'], name='uniq_rollup_group_month'),
+        ]
+
+    def __str__(self):
+        return f"{self.group.title} — {self.month:%Y-%m}"
+
+    @property
+    def active_collected(self) -> int:
+        """What the group's active enrollments paid for the month."""
+        return self.collected - self.inactive_collected
+
+
+class StatusBoard(models.Model):
+    """The pinned "who has paid this month" message of a group chat, one per month."""
+    group: "Group" = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='boards')
+    month = models.DateField()
+    chat_id = models.CharField(max_length=255)
+    message_id = models.BigIntegerField()
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['group', 'month'], name='uniq_board_group_month'),
+        ]
+
+    def __str__(self):
+        return f"{self.group_id} — {self.month:%Y-%m}"
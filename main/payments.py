@@ -0,0 +1,75 @@
+"""Payment input rules and recording many payments at once.
+
+A payment saved on its own keeps the rollups and enrollment balances in step
+through `main.signals`. `bulk_create` sends no signals, so `record_payments()`
+applies the same changes for the whole batch: one INSERT, one rollup update
+per (group, month) and one balance sync over the enrollments involved. Caches
+that listen to payment saves subscribe to `main.signals.payments_recorded`.
+"""
+from datetime import date, datetime
+
+from django.db import transaction
+
+from . import ledger, rollups
+from .models import Enrollment, Payment
+from .reports import group_month_payments
+from .signals import payments_recorded
+
+
+def parse_amount(text: str | None) -> int | None:
+    """A positive amount in so'm, spaces and commas allowed ("1 200 000"); None when invalid."""
+    try:
+        amount = int((text or '').replace(' ', '').replace(',', ''))
+    except ValueError:
+        return None
+    return amount if amount > 0 else None
+
+
+def parse_month(text: str | None) -> date | None:
+    """First day of a "YYYY-MM" month; None when invalid."""
+    try:
+        return datetime.strptime((text or '').strip(), "%Y-%m").date()
+    except ValueError:
+        return None
+
+
+def record_payments(items, created_by=None) -> list:
+    """Create payments from (enrollment_id, month, amount) items in one transaction; returns them in order."""
+    payments = [Payment(enrollment_id=e, month=m, amount=a, created_by=created_by) for e, m, a in items]
+    if not payments:
+        return []
+    with transaction.atomic():
+        Payment.objects.bulk_create(payments, batch_size=1000)
+        enrollment_ids = {p.enrollment_id for p in payments}
+        enrollments = {eid: (gid, active) for eid, gid, active in (
+            Enrollment.objects.filter(id__in=enrollment_ids).values_list('id', 'group_id', 'is_active')
+        )}
+        for active in (True, False):
+            rollups.add_collected_bulk([
+                (enrollments[p.enrollment_id][0], p.month, p.amount)
+                for p in payments if enrollments[p.enrollment_id][1] is active
+            ], inactive=not active)
+        ledger.sync_balances(Enrollment.objects.filter(id__in=enrollment_ids))
+        transaction.on_commit(lambda: payments_recorded.send(sender=Payment, payments=payments))
+    return payments
+
+
+def pay_month_dues(group_id: int, month, enrollment_ids, created_by=None) -> list:
+    """Pay what the given enrollments of a group still owe for `month`; returns [(payment, student name)].
+
+    Dues are read again with the enrollments locked, so one already paid in the
+    meantime (by hand or by a concurrent call) is skipped rather than paid twice.
+    """
+    enrollment_ids = set(enrollment_ids)
+    with transaction.atomic():
+        # Locked in id order, so concurrent calls cannot deadlock
+        list(
+            Enrollment.objects.select_for_update()
+            .filter(group_id=group_id, id__in=enrollment_ids).order_by('id').values_list('id')
+        )
+        due = [
+            r for r in group_month_payments(group_id, month)
+            if r['id'] in enrollment_ids and r['fee'] > r['paid']
+        ]
+        payments = record_payments(((r['id'], month, r['fee'] - r['paid']) for r in due), created_by=created_by)
+    return [(p, r['name']) for p, r in zip(payments, due)]
@@ -0,0 +1,105 @@
+"""Student profile for the bot's student card.
+
+`student_profile` loads everything the card shows in three queries: the
+student with payment totals, the enrollments with this month's payments, and
+the latest payments. The result is plain data, so rendering runs no queries.
+"""
+from datetime import date, datetime
+
+from django.db.models import Count, FilteredRelation, Prefetch, Q, Sum
+from django.db.models.functions import Coalesce
+
+from .ledger import current_month
+from .models import Enrollment, Payment, Student
+
+LAST_PAYMENTS = 5
+
+
+class EnrollmentLine:
+    __slots__ = ('group_title', 'monthly_fee', 'month_paid', 'balance')
+
+    def __init__(self, group_title: str, monthly_fee: int, month_paid: int, balance: int):
+        self.group_title = group_title
+        self.monthly_fee = monthly_fee
+        self.month_paid = month_paid
+        self.balance = balance
+
+    @property
+    def month_due(self) -> int:
+        return max(self.monthly_fee - self.month_paid, 0)
+
+
+class PaymentLine:
+    __slots__ = ('month', 'group_title', 'amount', 'paid_at', 'created_by')
+
+    def __init__(self, month: date, group_title: str, amount: int, paid_at: datetime, created_by: str | None):
+        self.month = month
+        self.group_title = group_title
+        self.amount = amount
+        self.paid_at = paid_at
+        self.created_by = created_by
+
+
+class StudentProfile:
+    __slots__ = ('id', 'full_name', 'phone_number', 'payments_count', 'total_paid', 'enrollments', 'last_payments')
+
+    def __init__(self, id: int, full_name: str, phone_number: str | None, payments_count: int, total_paid: int,
+                 enrollments: list[EnrollmentLine], last_payments: list[PaymentLine]):
+        self.id = id
+        self.full_name = full_name
+        self.phone_number = phone_number
+        self.payments_count = payments_count
+        self.total_paid = total_paid
+        self.enrollments = enrollments
+        self.last_payments = last_payments
+
+    @property
+    def arrears(self) -> int:
+        """Total debt from the charge ledger balances."""
+        return sum(max(e.balance, 0) for e in self.enrollments)
+
+
+def _creator_name(user) -> str | None:
+    if user is None:
+        return None
+    return user.username or user.full_name or str(user)
+
+
+def student_profile(student_id: int, month: date | None = None) -> StudentProfile:
+    """The card data for one student; raises Student.DoesNotExist. Runs queries; call from the DB pool."""
+    month = month or current_month()
+    enrollments = (
+        Enrollment.objects.select_related('group')
+        .annotate(month_payments=FilteredRelation('payments', condition=Q(payments__month=month)))
+        .annotate(month_paid=Coalesce(Sum('month_payments__amount'), 0))
+        .order_by('id')
+    )
+    student = (
+        Student.objects
+        .annotate(
+            payments_count=Count('enrollments__payments'),
+            total_paid=Coalesce(Sum('enrollments__payments__amount'), 0),
+        )
+        .prefetch_related(Prefetch('enrollments', queryset=enrollments))
+        .get(id=student_id)
+    )
+    last_payments = (
+        Payment.objects.select_related('enrollment__group', 'created_by')
+        .filter(enrollment__student_id=student_id)
+        .order_by('-paid_at', '-id')[:LAST_PAYMENTS]
+    )
+    return StudentProfile(
+        id=student.id,
+        full_name=student.full_name,
+        phone_number=student.phone_number,
+        payments_count=student.payments_count,
+        total_paid=student.total_paid,
+        enrollments=[
+            EnrollmentLine(e.group.title, e.monthly_fee or 0, e.month_paid, e.balance)
+            for e in student.enrollments.all()
+        ],
+        last_payments=[
+            PaymentLine(p.month, p.enrollment.group.title, p.amount, p.paid_at, _creator_name(p.created_by))
+            for p in last_payments
+        ],
+    )
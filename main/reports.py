@@ -0,0 +1,220 @@
+from datetime import timedelta
+
+from django.db.models import Count, F, FilteredRelation, Max, OuterRef, Q, Subquery, Sum, Window
+from django.db.models.functions import Coalesce, Least
+from django.utils import timezone
+
+from .ledger import group_debt_totals
+from .models import Enrollment, Payment
+from .rollups import group_month_rollup, month_rollups
+
+
+def month_start(dt):
+    return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def creator_name(row: dict) -> str:
+    return (
+        row['created_by__username']
+        or f"{(row['created_by__first_name'] or '')} {(row['created_by__last_name'] or '')}".strip()
+        or "Noma'lum"
+    )
+
+
+def _creator_totals(windows: dict):
+    """One grouped pass over payments since the earliest window start.
+
+    Returns (totals, per_creator), both keyed like `windows`.
+    """
+    annotations = {}
+    for key, start in windows.items():
+        annotations[f'{key}_total'] = Coalesce(Sum('amount', filter=Q(paid_at__gte=start)), 0)
+        annotations[f'{key}_count'] = Count('id', filter=Q(paid_at__gte=start))
+    rows = list(
+        Payment.objects.filter(paid_at__gte=min(windows.values()))
+        .values('created_by__username', 'created_by__first_name', 'created_by__last_name')
+        .annotate(**annotations)
+        .order_by()
+    )
+
+    totals, per_creator = {}, {}
+    for key in windows:
+        totals[key] = sum(r[f'{key}_total'] for r in rows)
+        items = [
+            {
+                'created_by__username': r['created_by__username'],
+                'created_by__first_name': r['created_by__first_name'],
+                'created_by__last_name': r['created_by__last_name'],
+                'total': r[f'{key}_total'],
+            }
+            for r in rows if r[f'{key}_count']
+        ]
+        items.sort(key=lambda c: c['total'], reverse=True)
+        per_creator[key] = items
+    return totals, per_creator
+
+
+def dashboard_queries(now=None) -> list:
+    """The finance dashboard's three independent queries as zero-argument callables.
+
+    They can run in any order or in parallel; pass their results, in order, to
+    `build_dashboard()`.
+    """
+    now = now or timezone.now()
+    start_today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    start_week = start_today - timedelta(days=start_today.weekday())
+    start_month = start_today.replace(day=1)
+    windows = {'today': start_today, 'week': start_week, 'month': start_month}
+    return [
+        lambda: _creator_totals(windows),
+        group_debt_totals,
+        lambda: month_rollups(month_start(now)),
+    ]
+
+
+def build_dashboard(creator_totals, debts: dict, month_rows: list) -> dict:
+    totals, creators = creator_totals
+    groups = []
+    for r in month_rows:
+        if not r['is_active']:
+            continue
+        # A group's figures cover its active enrollments, like `expected`
+        remaining = max(r['expected'] - r['active_collected'], 0)
+        # Ledger debt includes this month's charge; what is left of it is past arrears
+        arrears_past = max(debts.get(r['id'], 0) - remaining, 0)
+        groups.append((r['title'], r['expected'], r['active_collected'], remaining, arrears_past))
+    overall_expected = sum(r['expected'] for r in month_rows)
+    overall_collected = sum(r['collected'] for r in month_rows)
+    return {
+        'today_total': totals['today'],
+        'week_total': totals['week'],
+        'month_total': totals['month'],
+        'creators_today': creators['today'],
+        'creators_week': creators['week'],
+        'creators_month': creators['month'],
+        'overall_expected': overall_expected,
+        'overall_collected': overall_collected,
+        'overall_remaining': max(overall_expected - overall_collected, 0),
+        'groups': groups,
+    }
+
+
+def finance_dashboard_data(now=None) -> dict:
+    """Every figure shown on the finance dashboard, in three queries.
+
+    Expected and collected amounts come from the monthly rollup table, arrears
+    from enrollment balances. Group rows are (title, expected, collected,
+    remaining, past arrears) tuples ordered by title, for active groups only;
+    their collected amount leaves out inactive enrollments, the overall one does not.
+    """
+    return build_dashboard(*(query() for query in dashboard_queries(now)))
+
+
+def month_status(student_ids, month) -> dict:
+    """student_id -> (fee, paid, due) for `month` over active enrollments, in one grouped query.
+
+    `due` is summed per enrollment, so an overpaid group does not hide a debt in another.
+    """
+    rows = (
+        Enrollment.objects.filter(student_id__in=student_ids, is_active=True)
+        .annotate(month_payments=FilteredRelation('payments', condition=Q(payments__month=month)))
+        .values('id', 'student_id', 'monthly_fee')
+        .annotate(paid=Coalesce(Sum('month_payments__amount'), 0))
+        .order_by()
+    )
+    status = {}
+    for r in rows:
+        fee, paid, due = status.get(r['student_id'], (0, 0, 0))
+        status[r['student_id']] = (
+            fee + r['monthly_fee'], paid + r['paid'], due + max(r['monthly_fee'] - r['paid'], 0),
+        )
+    return status
+
+
+def group_month_payments(group_id: int, month) -> list:
+    """A group's active enrollments as dicts with id, name, fee and paid (for `month`), by name; one query."""
+    return list(
+        Enrollment.objects.filter(group_id=group_id, is_active=True)
+        .annotate(month_payments=FilteredRelation('payments', condition=Q(payments__month=month)))
+        .values('id', name=F('student__full_name'), fee=F('monthly_fee'))
+        .annotate(paid=Coalesce(Sum('month_payments__amount'), 0))
+        .order_by('name', 'id')
+    )
+
+
+def status_board_data(group_id: int, month):
+    """(rollup row, student rows) for a group's status board: two queries whatever the group size.
+
+    Student rows are those of `group_month_payments()`. Before the month's first
+    payment the rollup row is unsaved and its expected amount costs a third query.
+    """
+    return group_month_rollup(group_id, month), group_month_payments(group_id, month)
+
+
+def debtors_queryset(group_id: int | None = None):
+    """Debtor rows as dicts with name, due (current month) and debt, unordered.
+
+    `due` is min(balance, monthly fee), the debt the current month's charge can
+    account for, so it is read from the balance without looking at payments.
+    (Before the ledger it was the fee minus the current month's payments.)
+
+    Without `group_id` debts are summed per student across active enrollments
+    and rows carry `student_id`; with it, rows are that group's enrollments and
+    carry `id`.
+    """
+    qs = Enrollment.objects.filter(is_active=True, balance__gt=0)
+    due = Least('balance', 'monthly_fee')
+    if group_id is not None:
+        return (
+            qs.filter(group_id=group_id)
+            .annotate(name=F('student__full_name'), due=due, debt=F('balance'))
+            .values('id', 'name', 'due', 'debt')
+        )
+    return qs.values('student_id').annotate(name=Max('student__full_name'), due=Sum(due), debt=Sum('balance'))
+
+
+def group_students_queryset(group_id: int):
+    """A group's students as dicts with student_id, name and their last payment in the group, unordered.
+
+    The last payment (`last_amount`, `last_paid_at`) comes from correlated
+    subqueries, so a page of any size is a single query.
+    """
+    last = Payment.objects.filter(enrollment=OuterRef('pk')).order_by('-paid_at', '-id')
+    return (
+        Enrollment.objects.filter(group_id=group_id)
+        .annotate(
+            name=F('student__full_name'),
+            last_amount=Subquery(last.values('amount')[:1]),
+            last_paid_at=Subquery(last.values('paid_at')[:1]),
+        )
+        .values('student_id', 'name', 'last_amount', 'last_paid_at')
+    )
+
+
+def debtors_ordering(group_id: int | None = None) -> tuple:
+    """Largest debt first; the last column makes the order unique."""
+    return ('-debt', '-due', '-name', '-id' if group_id is not None else '-student_id')
+
+
+def debtors_page(page: int, page_size: int = 10, group_id: int | None = None):
+    """One page of debtors, sorted and paginated in the database.
+
+    Returns (items, page, total_pages, total) where items are (full_name,
+    current month due, total debt) tuples; see `debtors_queryset()`. The page
+    and the total count come from a single query (a window count over the result).
+    """
+    qs = debtors_queryset(group_id)
+    qs = qs.annotate(total=Window(Count('*'))).values_list('name', 'due', 'debt', 'total')
+    qs = qs.order_by(*debtors_ordering(group_id))
+
+    page_size = max(page_size, 1)
+    page = max(page, 1)
+    rows = list(qs[(page - 1) * page_size:page * page_size])
+    if not rows and page > 1:
+        # Past the end (e.g. debts were paid meanwhile): fall back to the last page
+        total = qs.count()
+        page = max((total + page_size - 1) // page_size, 1)
+        rows = list(qs[(page - 1) * page_size:page * page_size])
+    total = rows[0][3] if rows else 0
+    total_pages = max((total + page_size - 1) // page_size, 1)
+    return [(name, due, debt) for name, due, debt, _ in rows], page, total_pages, total
@@ -0,0 +1,207 @@
+"""Maintenance and reads of the per-group monthly rollup table.
+
+Writers call the delta helpers inside the transaction that changes the
+underlying rows (see `main.signals`); readers use `month_rollups()` and
+`group_month_rollup()`, which never create rows. `rebuild()` recomputes
+everything from raw payments and enrollments.
+"""
+from collections import defaultdict
+from datetime import date, datetime, timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import Count, F, FilteredRelation, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, TruncMonth
+
+from .models import Enrollment, Group, MonthlyRollup, Payment
+
+
+def as_month(value) -> date:
+    """First day of the month of a date or (UTC) datetime."""
+    if isinstance(value, datetime):
+        value = value.astimezone(dt_timezone.utc).date() if value.tzinfo else value.date()
+    return value.replace(day=1)
+
+
+def next_month(month: date) -> date:
+    return month.replace(year=month.year + 1, month=1) if month.month == 12 else month.replace(month=month.month + 1)
+
+
+def _month_end_dt(month: date) -> datetime:
+    nm = next_month(month)
+    return datetime(nm.year, nm.month, 1, tzinfo=dt_timezone.utc)
+
+
+def expected_by_group(month: date, group_ids=None) -> dict:
+    qs = Enrollment.objects.filter(is_active=True, joined_at__lt=_month_end_dt(month))
+    if group_ids is not None:
+        qs = qs.filter(group_id__in=group_ids)
+    rows = qs.values('group_id').annotate(total=Sum('monthly_fee')).order_by()
+    return {r['group_id']: r['total'] or 0 for r in rows}
+
+
+def ensure_month(month: date, group_ids=None):
+    """Create missing rollup rows for `month` with their expected amount filled in."""
+    month = as_month(month)
+    missing = Group.objects.exclude(rollups__month=month)
+    if group_ids is not None:
+        missing = missing.filter(id__in=group_ids)
+    missing_ids = list(missing.values_list('id', flat=True))
+    if not missing_ids:
+        return
+    expected = expected_by_group(month, missing_ids)
+    MonthlyRollup.objects.bulk_create(
+        [MonthlyRollup(group_id=gid, month=month, expected=expected.get(gid, 0)) for gid in missing_ids],
+        ignore_conflicts=True,
+    )
+
+
+def month_rollups(month: date) -> list:
+    """One row per group (active or not) for `month`, ordered by title.
+
+    Each row is a dict with id, title, is_active, expected, collected,
+    active_collected (paid to enrollments still active) and payments_count.
+    One query; no row is created. The expected amount of a group without a row
+    for the month (nothing was paid for it yet) comes from its enrollments.
+    """
+    month = as_month(month)
+    fees = (
+        Enrollment.objects.filter(group=OuterRef('pk'), is_active=True, joined_at__lt=_month_end_dt(month))
+        .values('group')
+        .annotate(total=Sum('monthly_fee'))
+        .values('total')[:1]
+    )
+    rows = list(
+        Group.objects.annotate(r=FilteredRelation('rollups', condition=Q(rollups__month=month)))
+        # Postgres evaluates the subquery only where the row is missing
+        .annotate(expected=Coalesce('r__expected', Subquery(fees), 0))
+        .values(
+            'id', 'title', 'is_active', 'expected', 'r__collected', 'r__inactive_collected', 'r__payments_count',
+        )
+        .order_by('title', 'id')
+    )
+    return [
+        {
+            'id': r['id'],
+            'title': r['title'],
+            'is_active': r['is_active'],
+            'expected': r['expected'],
+            'collected': r['r__collected'] or 0,
+            'active_collected': (r['r__collected'] or 0) - (r['r__inactive_collected'] or 0),
+            'payments_count': r['r__payments_count'] or 0,
+        }
+        for r in rows
+    ]
+
+
+def group_month_rollup(group_id: int, month: date) -> MonthlyRollup:
+    """The group's row for `month`; an unsaved one with the expected amount when there is none yet."""
+    month = as_month(month)
+    row = MonthlyRollup.objects.filter(group_id=group_id, month=month).first()
+    if row is None:
+        row = MonthlyRollup(group_id=group_id, month=month, expected=expected_by_group(month, [group_id]).get(group_id, 0))
+    return row
+
+
+# -----------------------------
+# Deltas
+# -----------------------------
+
+def add_collected(group_id: int, month: date, amount: int, count: int = 1, inactive: bool = False):
+    """Add a payment delta; removals (negative count) never create rows.
+
+    `inactive` marks payments of an inactive enrollment, which are also counted
+    in `inactive_collected`.
+    """
+    month = as_month(month)
+    with transaction.atomic():
+        if count > 0:
+            ensure_month(month, [group_id])
+        MonthlyRollup.objects.filter(group_id=group_id, month=month).update(
+            collected=F('collected') + amount,
+            inactive_collected=F('inactive_collected') + (amount if inactive else 0),
+            payments_count=F('payments_count') + count,
+        )
+
+
+def add_collected_bulk(items, sign: int = 1, inactive: bool = False):
+    """Apply many (group_id, month, amount) payments with one update per (group, month).
+
+    Pass sign=-1 to remove them instead; `inactive` is as for `add_collected()`.
+    """
+    deltas = defaultdict(lambda: [0, 0])
+    for group_id, month, amount in items:
+        d = deltas[(group_id, as_month(month))]
+        d[0] += sign * amount
+        d[1] += sign
+    if not deltas:
+        return
+    with transaction.atomic():
+        if sign > 0:
+            for month in {m for _, m in deltas}:
+                ensure_month(month, [gid for gid, m in deltas if m == month])
+        for (group_id, month), (amount, count) in deltas.items():
+            MonthlyRollup.objects.filter(group_id=group_id, month=month).update(
+                collected=F('collected') + amount,
+                inactive_collected=F('inactive_collected') + (amount if inactive else 0),
+                payments_count=F('payments_count') + count,
+            )
+
+
+def shift_expected(group_id: int, from_month: date, delta: int):
+    """Add `delta` to the expected amount of every existing row from `from_month` on.
+
+    Rows that do not exist yet get the right value when `ensure_month` creates them.
+    """
+    if not delta:
+        return
+    MonthlyRollup.objects.filter(group_id=group_id, month__gte=as_month(from_month)).update(
+        expected=F('expected') + delta
+    )
+
+
+# -----------------------------
+# Rebuild
+# -----------------------------
+
+@transaction.atomic
+def rebuild(until: date | None = None) -> int:
+    """Recompute every rollup row from raw payments and enrollments. Returns the row count."""
+    until = as_month(until or datetime.now(dt_timezone.utc))
+
+    collected = {
+        (r['enrollment__group_id'], r['month']): (r['total'] or 0, r['inactive'] or 0, r['cnt'])
+        for r in Payment.objects.values('enrollment__group_id', 'month')
+        .annotate(total=Sum('amount'), inactive=Sum('amount', filter=Q(enrollment__is_active=False)), cnt=Count('id'))
+        .order_by()
+    }
+    # Fee added per group in the month an active enrollment joined
+    joined = defaultdict(dict)
+    for r in (
+        Enrollment.objects.filter(is_active=True)
+        .annotate(m=TruncMonth('joined_at', tzinfo=dt_timezone.utc))
+        .values('group_id', 'm')
+        .annotate(total=Sum('monthly_fee'))
+        .order_by()
+    ):
+        joined[r['group_id']][as_month(r['m'])] = r['total'] or 0
+
+    months = {m for _, m in collected} | {until}
+    rows = []
+    for group_id in Group.objects.values_list('id', flat=True):
+        group_months = sorted(months | set(joined[group_id]))
+        fees = sorted(joined[group_id].items())
+        expected, i = 0, 0
+        for month in group_months:
+            while i < len(fees) and fees[i][0] <= month:
+                expected += fees[i][1]
+                i += 1
+            total, inactive, cnt = collected.get((group_id, month), (0, 0, 0))
+            if expected or total or month == until:
+                rows.append(MonthlyRollup(
+                    group_id=group_id, month=month, expected=expected, collected=total,
+                    inactive_collected=inactive, payments_count=cnt,
+                ))
+
+    MonthlyRollup.objects.all().delete()
+    MonthlyRollup.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
@@ -0,0 +1,92 @@
+"""Student search (bot inline mode, student lists).
+
+Names are compared on `Student.search_name` (see main.translit), so Latin and
+Cyrillic spellings find each other. Where pg_trgm is installed, names match
+by trigram word similarity and the closest come first, read in distance
+order straight from a GiST index (the cut-off is `pg_trgm.word_similarity_threshold`, set in the database
+settings); otherwise by substring. Digit queries are phone prefixes (with or
+without the country code) or a student id.
+"""
+import re
+from functools import lru_cache
+
+from django.contrib.postgres.search import TrigramWordDistance
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+
+from .models import Enrollment, Student
+from .translit import COUNTRY_CODE, normalize_name
+
+# Below this many characters trigrams are too coarse; use a prefix match
+MIN_TRIGRAM_LENGTH = 3
+
+_PHONE_QUERY = re.compile(r'^\+?[\d\s()-]+$')
+
+
+@lru_cache(maxsize=None)
+def trigram_enabled() -> bool:
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def is_phone_query(text: str) -> bool:
+    """Digits with phone punctuation ("+998 90 123-45-67"), as opposed to a name."""
+    return bool(_PHONE_QUERY.match(text)) and any(ch.isdigit() for ch in text)
+
+
+def _phone_matches(text: str):
+    digits = re.sub(r'\D', '', text)
+    cond = Q(phone_digits__startswith=digits) | Q(phone_digits__startswith=COUNTRY_CODE + digits)
+    if len(digits) <= 18:
+        cond |= Q(id=int(digits))
+        first = Case(When(id=int(digits), then=Value(0)), default=Value(1), output_field=IntegerField())
+    else:
+        first = Value(1)
+    return Student.objects.filter(cond).order_by(first, 'full_name', 'id')
+
+
+def _name_matches(name: str):
+    if len(name) < MIN_TRIGRAM_LENGTH:
+        # Any word starting with the query
+        cond = Q(search_name__startswith=name) | Q(search_name__contains=' ' + name)
+        return Student.objects.filter(cond).order_by('full_name', 'id')
+    if trigram_enabled():
+        # Distance alone, so the GiST index returns rows nearest first and stops at the
+        # limit; a tie-breaker would sort every match. Ties keep index order
+        return (
+            Student.objects.filter(Q(search_name__trigram_word_similar=name) | Q(search_name__contains=name))
+            .annotate(distance=TrigramWordDistance(name, 'search_name'))
+            .order_by('distance')
+        )
+    prefix_first = Case(When(search_name__startswith=name, then=Value(0)), default=Value(1), output_field=IntegerField())
+    return Student.objects.filter(search_name__contains=name).order_by(prefix_first, 'full_name', 'id')
+
+
+def student_matches(query: str | None):
+    """Students matching `query`, best first; all students by name when it is empty."""
+    text = (query or '').strip()
+    if not text:
+        return Student.objects.order_by('full_name', 'id')
+    if is_phone_query(text):
+        return _phone_matches(text)
+    name = normalize_name(text)
+    if not name:
+        return Student.objects.none()
+    return _name_matches(name)
+
+
+def search_students(query: str | None, limit: int = 25, offset: int = 0) -> list:
+    return list(student_matches(query)[offset:offset + limit])
+
+
+def search_enrollments(query: str | None, limit: int = 25) -> list:
+    """Active enrollments of matching students, or of groups whose title contains the query."""
+    qs = Enrollment.objects.select_related('student', 'group').filter(is_active=True)
+    text = (query or '').strip()
+    if text:
+        students = student_matches(text).order_by().values('id')
+        qs = qs.filter(Q(student__in=students) | Q(group__title__icontains=text))
+    return list(qs.order_by('student__full_name', 'group__title', 'id')[:limit])
@@ -0,0 +1,153 @@
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+
+from . import ledger, rollups
+from .models import Charge, Enrollment, Payment
+
+# Sent once after commit by `main.payments.record_payments()`, whose bulk INSERT
+# sends no post_save; receivers get the created payments as `payments`.
+payments_recorded = Signal()
+
+# Sent once after commit by `main.ledger.charge_month()` when it created charges;
+# its balance UPDATEs send no post_save. Receivers get `month` and `count`.
+month_charged = Signal()
+
+
+def _enrollment_state(payment: Payment) -> tuple:
+    """(group_id, is_active) of the payment's enrollment."""
+    if Payment.enrollment.is_cached(payment):
+        return payment.enrollment.group_id, payment.enrollment.is_active
+    return Enrollment.objects.values_list('group_id', 'is_active').get(pk=payment.enrollment_id)
+
+
+def _expected_share(group_id, fee, is_active, joined_at):
+    """(group_id, first month, fee) this enrollment contributes to `expected`, or None."""
+    if not is_active or not fee:
+        return None
+    return group_id, rollups.as_month(joined_at), fee
+
+
+# -----------------------------
+# Payments
+# -----------------------------
+
+@receiver(pre_save, sender=Payment)
+def payment_pre_save(sender, instance: Payment, raw=False, **kwargs):
+    instance._rollup_prev = None
+    if raw or instance.pk is None:
+        return
+    instance._rollup_prev = (
+        Payment.objects.filter(pk=instance.pk)
+        .values_list('enrollment__group_id', 'month', 'amount', 'enrollment_id', 'enrollment__is_active')
+        .first()
+    )
+
+
+@receiver(post_save, sender=Payment)
+def payment_post_save(sender, instance: Payment, created, raw=False, **kwargs):
+    if raw:
+        return
+    prev = getattr(instance, '_rollup_prev', None)
+    enrollment_ids = {instance.enrollment_id}
+    with transaction.atomic():
+        if prev is not None:
+            group_id, month, amount, enrollment_id, active = prev
+            rollups.add_collected(group_id, month, -amount, -1, inactive=not active)
+            enrollment_ids.add(enrollment_id)
+        group_id, active = _enrollment_state(instance)
+        rollups.add_collected(group_id, instance.month, instance.amount, 1, inactive=not active)
+        ledger.sync_balances(Enrollment.objects.filter(pk__in=enrollment_ids))
+
+
+@receiver(post_delete, sender=Payment)
+def payment_post_delete(sender, instance: Payment, **kwargs):
+    try:
+        group_id, active = _enrollment_state(instance)
+    except Enrollment.DoesNotExist:
+        return
+    with transaction.atomic():
+        rollups.add_collected(group_id, instance.month, -instance.amount, -1, inactive=not active)
+        ledger.sync_balances(Enrollment.objects.filter(pk=instance.enrollment_id))
+
+
+# -----------------------------
+# Enrollments
+# -----------------------------
+
+@receiver(pre_save, sender=Enrollment)
+def enrollment_pre_save(sender, instance: Enrollment, raw=False, **kwargs):
+    instance._rollup_prev = None
+    if raw or instance.pk is None:
+        return
+    instance._rollup_prev = (
+        Enrollment.objects.filter(pk=instance.pk)
+        .values_list('group_id', 'monthly_fee', 'is_active', 'joined_at')
+        .first()
+    )
+
+
+@receiver(post_save, sender=Enrollment)
+def enrollment_post_save(sender, instance: Enrollment, created, raw=False, **kwargs):
+    if raw:
+        return
+    prev = getattr(instance, '_rollup_prev', None)
+    with transaction.atomic():
+        _sync_ledger(instance, prev)
+        _sync_rollups(instance, prev)
+
+
+def _sync_ledger(instance: Enrollment, prev):
+    enrollment = Enrollment.objects.filter(pk=instance.pk)
+    if instance.is_active and prev is None:
+        ledger.backfill(enrollment)
+    elif instance.is_active and not prev[2]:
+        # Reactivated: bill the current month, not the months it was inactive
+        ledger.charge_enrollment(instance.pk)
+    # Also restores balance columns a full-model save may have overwritten
+    ledger.sync_balances(enrollment)
+
+
+def _sync_rollups(instance: Enrollment, prev):
+    old_share = _expected_share(*prev) if prev else None
+    new_share = _expected_share(instance.group_id, instance.monthly_fee, instance.is_active, instance.joined_at)
+    if old_share != new_share:
+        if old_share:
+            rollups.shift_expected(old_share[0], old_share[1], -old_share[2])
+        if new_share:
+            rollups.shift_expected(*new_share)
+    if prev is not None and (prev[0], prev[2]) != (instance.group_id, instance.is_active):
+        # Payments follow the enrollment into its new group, or in or out of `inactive_collected`
+        moved = list(
+            Payment.objects.filter(enrollment=instance).values_list('month', 'amount')
+        )
+        rollups.add_collected_bulk([(prev[0], m, a) for m, a in moved], sign=-1, inactive=not prev[2])
+        rollups.add_collected_bulk([(instance.group_id, m, a) for m, a in moved], inactive=not instance.is_active)
+
+
+@receiver(post_delete, sender=Enrollment)
+def enrollment_post_delete(sender, instance: Enrollment, **kwargs):
+    share = _expected_share(instance.group_id, instance.monthly_fee, instance.is_active, instance.joined_at)
+    if share:
+        rollups.shift_expected(share[0], share[1], -share[2])
+
+
+# -----------------------------
+# Charges
+# -----------------------------
+
+@receiver(post_save, sender=Charge)
+def charge_post_save(sender, instance: Charge, raw=False, **kwargs):
+    if raw:
+        return
+    ledger.sync_balances(Enrollment.objects.filter(pk=instance.enrollment_id))
+
+
+@receiver(post_delete, sender=Charge)
+def charge_post_delete(sender, instance: Charge, origin=None, **kwargs):
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin is not None and origin_model is not Charge:
+        # Cascading from an enrollment/student/group delete; nothing left to sync
+        return
+    ledger.sync_balances(Enrollment.objects.filter(pk=instance.enrollment_id))
@@ -0,0 +1,90 @@
+"""Date hierarchy for changelists over large tables.
+
+Django's `{% date_hierarchy %}` lists the years, months or days that have
+rows with a DISTINCT over every matching row. `{% date_range_hierarchy %}`
+reads only the first and last dates (two index lookups) and offers every
+period between them, empty ones included.
+"""
+import datetime
+
+from django import template
+from django.contrib.admin.templatetags.admin_list import date_hierarchy
+from django.contrib.admin.templatetags.base import InclusionAdminNode
+from django.db import models
+from django.utils import formats, timezone
+from django.utils.text import capfirst
+from django.utils.translation import gettext as _
+
+register = template.Library()
+
+
+def date_range_hierarchy(cl):
+    field_name = cl.date_hierarchy
+    year_field = "%s__year" % field_name
+    month_field = "%s__month" % field_name
+    day_field = "%s__day" % field_name
+    year_lookup = cl.params.get(year_field)
+    month_lookup = cl.params.get(month_field)
+    if year_lookup and month_lookup and cl.params.get(day_field):
+        # A single day; Django's tag runs no query for it
+        return date_hierarchy(cl)
+
+    def link(filters):
+        return cl.get_query_string(filters, ["%s__" % field_name])
+
+    date_range = cl.queryset.aggregate(first=models.Min(field_name), last=models.Max(field_name))
+    first, last = date_range["first"], date_range["last"]
+    if first is None or last is None:
+        return {"show": True, "back": None, "choices": []}
+    if isinstance(first, datetime.datetime) and timezone.is_aware(first):
+        first, last = timezone.localtime(first), timezone.localtime(last)
+    if not year_lookup and first.year == last.year:
+        # Start at the narrowest level that has more than one choice, as Django does
+        year_lookup = first.year
+        if first.month == last.month:
+            month_lookup = first.month
+
+    if year_lookup and month_lookup:
+        month = datetime.date(int(year_lookup), int(month_lookup), 1)
+        return {
+            "show": True,
+            "back": {"link": link({year_field: year_lookup}), "title": str(year_lookup)},
+            "choices": [
+                {
+                    "link": link({year_field: year_lookup, month_field: month_lookup, day_field: day}),
+                    "title": capfirst(formats.date_format(month.replace(day=day), "MONTH_DAY_FORMAT")),
+                }
+                for day in range(first.day, last.day + 1)
+            ],
+        }
+    if year_lookup:
+        return {
+            "show": True,
+            "back": {"link": link({}), "title": _("All dates")},
+            "choices": [
+                {
+                    "link": link({year_field: year_lookup, month_field: month}),
+                    "title": capfirst(formats.date_format(datetime.date(int(year_lookup), month, 1), "YEAR_MONTH_FORMAT")),
+                }
+                for month in range(first.month, last.month + 1)
+            ],
+        }
+    return {
+        "show": True,
+        "back": None,
+        "choices": [
+            {"link": link({year_field: str(year)}), "title": str(year)}
+            for year in range(first.year, last.year + 1)
+        ],
+    }
+
+
+@register.tag(name="date_range_hierarchy")
+def date_range_hierarchy_tag(parser, token):
+    return InclusionAdminNode(
+        parser,
+        token,
+        func=date_range_hierarchy,
+        template_name="date_hierarchy.html",
+        takes_context=False,
+    )
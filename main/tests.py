@@ -1,3 +1,908 @@
-from django.test import TestCase
+import csv
+import io
+import os
+import tempfile
+import zipfile
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from xml.etree import ElementTree
 
-# Create your tests here.
+from django.db import connection
+from django.db.models import DateTimeField, ExpressionWrapper, F, Q, Sum, Value
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+
+from apps.botapp.models import BotUser
+from . import imports, ledger, rollups, search
+from .admin import EstimatedCountPaginator
+from .exports import PAYMENT_COLUMNS, write_export_parts
+from .imports import prepare_import
+from .payments import pay_month_dues, record_payments
+from .profiles import student_profile
+from .models import Group, Student, Enrollment, Payment, Charge, MonthlyRollup
+from .reports import (
+    dashboard_queries, debtors_page, finance_dashboard_data, group_students_queryset, month_start, month_status,
+    group_month_payments, status_board_data,
+)
+from .signals import month_charged, payments_recorded
+from .translit import normalize_name, normalize_phone
+
+
+NOW = datetime(2025, 10, 15, 9, 30, tzinfo=dt_timezone.utc)
+
+
+def seed_dataset():
+    """A few groups with enrollments joined in different months and scattered payments."""
+    admins = [
+        BotUser.objects.create(user_id='100', username='ali'),
+        BotUser.objects.create(user_id='101', first_name='Vali', last_name='Karimov'),
+    ]
+    groups = [
+        Group.objects.create(title='Ingliz tili', monthly_fee=300_000),
+        Group.objects.create(title='Matematika', monthly_fee=250_000),
+        Group.objects.create(title='Fizika', monthly_fee=200_000),
+        Group.objects.create(title='Arxiv', monthly_fee=100_000, is_active=False),
+    ]
+    joined = [
+        datetime(2025, 6, 3, tzinfo=dt_timezone.utc),
+        datetime(2025, 8, 31, 22, tzinfo=dt_timezone.utc),
+        datetime(2025, 10, 1, tzinfo=dt_timezone.utc),
+    ]
+    enrollments = []
+    for i in range(12):
+        student = Student.objects.create(full_name=f"O'quvchi {i:02d}", phone_number=f'+99890{i:07d}')
+        group = groups[i % len(groups)]
+        enrollments.append(Enrollment.objects.create(
+            student=student,
+            group=group,
+            joined_at=joined[i % len(joined)],
+            monthly_fee=group.monthly_fee + (50_000 if i % 5 == 0 else 0),
+            is_active=(i != 7),
+        ))
+
+    paid_at = [
+        NOW - timedelta(hours=1),
+        NOW - timedelta(days=2),
+        NOW - timedelta(days=9),
+        NOW - timedelta(days=40),
+    ]
+    months = [date(2025, 10, 1), date(2025, 9, 1), date(2025, 7, 1), date(2025, 5, 1), date(2025, 11, 1)]
+    for i, enr in enumerate(enrollments):
+        for j in range(i % 4):
+            p = Payment.objects.create(
+                enrollment=enr,
+                amount=100_000 + 10_000 * j,
+                month=months[(i + j) % len(months)],
+                created_by=admins[(i + j) % 2] if (i + j) % 3 else None,
+            )
+            Payment.objects.filter(id=p.id).update(paid_at=paid_at[(i + 2 * j) % len(paid_at)])
+
+    # An inactive enrollment of an active group, with a payment for the current month
+    leaver = Enrollment.objects.create(
+        student=Student.objects.create(full_name='Ketgan', phone_number='+998931234567'),
+        group=groups[1],
+        joined_at=joined[0],
+        is_active=False,
+    )
+    p = Payment.objects.create(enrollment=leaver, amount=120_000, month=date(2025, 10, 1), created_by=admins[0])
+    Payment.objects.filter(id=p.id).update(paid_at=paid_at[1])
+
+
+def legacy_finance_dashboard_data(now):
+    """The per-group / per-enrollment loop the dashboard used before, kept as the reference."""
+    start_today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    start_week = start_today - timedelta(days=start_today.weekday())
+    start_month = start_today.replace(day=1)
+
+    def agg_range(start_dt):
+        return Payment.objects.filter(paid_at__gte=start_dt).aggregate(total=Sum('amount')).get('total') or 0
+
+    def per_creator(start_dt):
+        return list(
+            Payment.objects.filter(paid_at__gte=start_dt)
+            .values('created_by__username', 'created_by__first_name', 'created_by__last_name')
+            .annotate(total=Sum('amount'))
+            .order_by('-total')
+        )
+
+    cur_month = month_start(now)
+    overall_expected = Enrollment.objects.filter(is_active=True).aggregate(total=Sum('monthly_fee')).get('total') or 0
+    overall_collected = Payment.objects.filter(month=cur_month.date()).aggregate(total=Sum('amount')).get('total') or 0
+
+    groups = []
+    for g in Group.objects.filter(is_active=True).order_by('title'):
+        enr_qs = Enrollment.objects.filter(group=g, is_active=True)
+        expected = enr_qs.aggregate(total=Sum('monthly_fee')).get('total') or 0
+        collected = Payment.objects.filter(enrollment__in=enr_qs, month=cur_month.date()).aggregate(total=Sum('amount')).get('total') or 0
+        arrears = 0
+        for enr in enr_qs:
+            joined_m = month_start(enr.joined_at)
+            months_prior = (cur_month.year - joined_m.year) * 12 + (cur_month.month - joined_m.month)
+            if months_prior <= 0:
+                continue
+            paid_past = Payment.objects.filter(
+                enrollment=enr, month__gte=joined_m.date(), month__lt=cur_month.date()
+            ).aggregate(total=Sum('amount')).get('total') or 0
+            arrears += max(months_prior * enr.monthly_fee - paid_past, 0)
+        groups.append((g.title, expected, collected, max(expected - collected, 0), arrears))
+
+    return {
+        'today_total': agg_range(start_today),
+        'week_total': agg_range(start_week),
+        'month_total': agg_range(start_month),
+        'creators_today': per_creator(start_today),
+        'creators_week': per_creator(start_week),
+        'creators_month': per_creator(start_month),
+        'overall_expected': overall_expected,
+        'overall_collected': overall_collected,
+        'overall_remaining': max(overall_expected - overall_collected, 0),
+        'groups': groups,
+    }
+
+
+class FinanceDashboardDataTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_dataset()
+
+    def _by_name(self, rows):
+        return sorted(
+            ((r['created_by__username'], r['created_by__first_name'], r['created_by__last_name'], r['total']) for r in rows),
+            key=repr,
+        )
+
+    def test_matches_legacy_computation(self):
+        expected = legacy_finance_dashboard_data(NOW)
+        actual = finance_dashboard_data(NOW)
+        for key in ('creators_today', 'creators_week', 'creators_month'):
+            self.assertEqual(self._by_name(actual.pop(key)), self._by_name(expected.pop(key)), key)
+        # Arrears now come from the charge ledger (see LedgerTests); compare everything else
+        groups = actual.pop('groups')
+        self.assertEqual([g[:4] for g in groups], [g[:4] for g in expected.pop('groups')])
+        self.assertEqual(actual, expected)
+
+        # A group's collected amount is over its active enrollments: the leaver's payment is left out
+        month = date(2025, 10, 1)
+        leaver = Enrollment.objects.get(student__full_name='Ketgan')
+        active_paid = Payment.objects.filter(
+            enrollment__group=leaver.group, enrollment__is_active=True, month=month,
+        ).aggregate(total=Sum('amount'))['total']
+        collected = {title: collected for title, _, collected, _, _ in groups}
+        self.assertEqual(collected[leaver.group.title], active_paid)
+        self.assertEqual(
+            rollups.group_month_rollup(leaver.group_id, month).collected, active_paid + 120_000,
+        )
+
+    def test_arrears_are_ledger_debt_minus_current_remaining(self):
+        debts = dict(
+            Enrollment.objects.filter(is_active=True, balance__gt=0)
+            .values_list('group__title').annotate(total=Sum('balance'))
+        )
+        for title, _, _, remaining, arrears in finance_dashboard_data(NOW)['groups']:
+            self.assertEqual(arrears, max(debts.get(title, 0) - remaining, 0), title)
+
+    def test_query_count_is_constant(self):
+        finance_dashboard_data(NOW)
+        with self.assertNumQueries(3):
+            finance_dashboard_data(NOW)
+        extra_group = Group.objects.create(title='Kimyo', monthly_fee=150_000)
+        for i in range(5):
+            student = Student.objects.create(full_name=f'Yangi {i}')
+            Enrollment.objects.create(student=student, group=extra_group, joined_at=NOW - timedelta(days=90))
+        finance_dashboard_data(NOW)
+        with self.assertNumQueries(3):
+            finance_dashboard_data(NOW)
+
+
+class MonthlyRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_dataset()
+
+    def snapshot(self, months):
+        for month in months:
+            rollups.ensure_month(month)
+        return {
+            (r.group_id, r.month): (r.expected, r.collected, r.inactive_collected, r.payments_count)
+            for r in MonthlyRollup.objects.filter(month__in=months)
+        }
+
+    def assertMatchesRebuild(self):
+        months = set(MonthlyRollup.objects.values_list('month', flat=True)) | {rollups.as_month(NOW)}
+        incremental = self.snapshot(months)
+        rollups.rebuild(until=NOW)
+        self.assertEqual(incremental, self.snapshot(months))
+
+    def test_seeded_data_matches_rebuild(self):
+        self.assertMatchesRebuild()
+
+    def test_payment_update_and_delete(self):
+        p = Payment.objects.order_by('id').first()
+        other = Enrollment.objects.exclude(group=p.enrollment.group).first()
+        p.amount += 5_000
+        p.month = date(2025, 8, 1)
+        p.save()
+        p.enrollment = other
+        p.save()
+        Payment.objects.order_by('-id').first().delete()
+        self.assertMatchesRebuild()
+
+    def test_enrollment_changes(self):
+        rollups.ensure_month(date(2025, 9, 1))
+        enr = Enrollment.objects.filter(is_active=True).order_by('id').first()
+        enr.monthly_fee += 20_000
+        enr.save()
+        enr.is_active = False
+        enr.save()
+        moved = Enrollment.objects.filter(is_active=True).order_by('-id').first()
+        moved.group = Group.objects.exclude(id=moved.group_id).first()
+        moved.save()
+        Enrollment.objects.filter(is_active=True).order_by('id').last().delete()
+        self.assertMatchesRebuild()
+
+    def test_group_delete_cascades(self):
+        Group.objects.filter(title='Fizika').delete()
+        self.assertMatchesRebuild()
+
+    def test_deactivation_moves_payments_out_of_active_collected(self):
+        month = date(2025, 10, 1)
+        enr = Enrollment.objects.filter(is_active=True, payments__month=month).order_by('id').first()
+        paid = enr.payments.filter(month=month).aggregate(total=Sum('amount'))['total']
+        before = rollups.group_month_rollup(enr.group_id, month)
+        enr.is_active = False
+        enr.save()
+        after = rollups.group_month_rollup(enr.group_id, month)
+        self.assertEqual(after.collected, before.collected)
+        self.assertEqual(after.active_collected, before.active_collected - paid)
+        self.assertMatchesRebuild()
+
+        enr.is_active = True
+        enr.group = Group.objects.exclude(id=enr.group_id).filter(is_active=True).first()
+        enr.save()
+        self.assertMatchesRebuild()
+
+    def test_reads_do_not_create_rows(self):
+        month = date(2026, 3, 1)
+        rows = rollups.month_rollups(month)
+        group = Group.objects.get(title='Matematika')
+        self.assertEqual(rollups.group_month_rollup(group.id, month).expected, rollups.expected_by_group(month)[group.id])
+        self.assertEqual({r['id']: r['expected'] for r in rows if r['expected']}, rollups.expected_by_group(month))
+        self.assertFalse(MonthlyRollup.objects.filter(month=month).exists())
+
+
+class LedgerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_dataset()
+
+    def assertBalancesMatchLedger(self):
+        charges = dict(Charge.objects.values_list('enrollment').annotate(t=Sum('amount')))
+        payments = dict(Payment.objects.values_list('enrollment').annotate(t=Sum('amount')))
+        for enr in Enrollment.objects.all():
+            self.assertEqual(enr.balance, charges.get(enr.id, 0) - payments.get(enr.id, 0), enr.id)
+
+    def test_enrollments_are_charged_from_join_month(self):
+        cur = ledger.current_month()
+        for enr in Enrollment.objects.filter(is_active=True):
+            months = list(enr.charges.order_by('month').values_list('month', flat=True))
+            self.assertEqual(months[0], rollups.as_month(enr.joined_at))
+            self.assertEqual(months[-1], cur)
+            self.assertEqual(len(months), len(set(months)))
+        self.assertFalse(Charge.objects.filter(enrollment__is_active=False).exists())
+        self.assertBalancesMatchLedger()
+
+    def test_charge_month_is_idempotent(self):
+        nm = rollups.next_month(ledger.current_month())
+        active = Enrollment.objects.filter(is_active=True).count()
+        self.assertEqual(ledger.charge_month(nm), active)
+        self.assertEqual(ledger.charge_month(nm), 0)
+        self.assertEqual(Charge.objects.filter(month=nm).count(), active)
+        self.assertBalancesMatchLedger()
+
+    def test_charge_month_signals_after_commit(self):
+        nm = rollups.next_month(ledger.current_month())
+        received = []
+        month_charged.connect(lambda sender, **kw: received.append(kw), weak=False, dispatch_uid='test')
+        self.addCleanup(month_charged.disconnect, dispatch_uid='test')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            count = ledger.charge_month(nm)
+            self.assertEqual(received, [])
+        self.assertEqual([(kw['month'], kw['count']) for kw in received], [(nm, count)])
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            ledger.charge_month(nm)
+        self.assertEqual(callbacks, [])
+
+    def test_payment_writes_keep_balance_in_sync(self):
+        enr = Enrollment.objects.filter(is_active=True).order_by('id').first()
+        p = Payment.objects.create(enrollment=enr, amount=70_000, month=date(2025, 10, 1))
+        p.amount = 90_000
+        p.save()
+        other = Payment.objects.exclude(enrollment=enr).order_by('id').first()
+        other.delete()
+        self.assertBalancesMatchLedger()
+
+    def test_paid_through_applies_payments_oldest_first(self):
+        group = Group.objects.create(title='Kimyo', monthly_fee=100_000)
+        student = Student.objects.create(full_name='Sinov')
+        joined = datetime.combine(ledger.current_month() - timedelta(days=40), datetime.min.time(), dt_timezone.utc)
+        enr = Enrollment.objects.create(student=student, group=group, joined_at=joined)
+        months = list(enr.charges.order_by('month').values_list('month', flat=True))
+        self.assertEqual(len(months), 3)
+        enr.refresh_from_db()
+        self.assertEqual((enr.balance, enr.paid_through), (300_000, None))
+
+        Payment.objects.create(enrollment=enr, amount=150_000, month=months[-1])
+        enr.refresh_from_db()
+        self.assertEqual((enr.balance, enr.paid_through), (150_000, months[0]))
+
+        Payment.objects.create(enrollment=enr, amount=150_000, month=months[-1])
+        enr.refresh_from_db()
+        self.assertEqual((enr.balance, enr.paid_through), (0, months[-1]))
+
+    def test_full_save_does_not_clobber_balance(self):
+        enr = Enrollment.objects.filter(is_active=True).order_by('id').first()
+        stale = Enrollment.objects.get(pk=enr.pk)
+        Payment.objects.create(enrollment=enr, amount=10_000, month=date(2025, 10, 1))
+        stale.monthly_fee += 1
+        stale.save()
+        self.assertBalancesMatchLedger()
+
+
+class BulkPaymentTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_dataset()
+
+    def test_pay_month_dues(self):
+        month = date(2025, 10, 1)
+        group = Group.objects.get(title='Matematika')
+        rows = group_month_payments(group.id, month)
+        unpaid = {r['id']: r['fee'] - r['paid'] for r in rows if r['fee'] > r['paid']}
+        self.assertGreater(len(unpaid), 1)
+        before = rollups.group_month_rollup(group.id, month)
+
+        # Lock, dues, one INSERT, group ids, one rollup update, two balance updates (+ savepoints)
+        with self.assertNumQueries(14):
+            paid = pay_month_dues(group.id, month, list(unpaid) + [-1])
+        self.assertEqual({p.enrollment_id: p.amount for p, _ in paid}, unpaid)
+        self.assertTrue(all(r['paid'] >= r['fee'] for r in group_month_payments(group.id, month)))
+
+        after = rollups.group_month_rollup(group.id, month)
+        self.assertEqual(
+            (after.collected, after.payments_count),
+            (before.collected + sum(unpaid.values()), before.payments_count + len(unpaid)),
+        )
+        charges = dict(Charge.objects.values_list('enrollment').annotate(t=Sum('amount')))
+        payments = dict(Payment.objects.values_list('enrollment').annotate(t=Sum('amount')))
+        for enr in Enrollment.objects.filter(id__in=unpaid):
+            self.assertEqual(enr.balance, charges.get(enr.id, 0) - payments.get(enr.id, 0))
+
+        # Already paid: nothing is paid twice
+        self.assertEqual(pay_month_dues(group.id, month, unpaid), [])
+
+    def test_record_payments_signals_after_commit(self):
+        enrollment = Enrollment.objects.filter(is_active=True).first()
+        received = []
+        payments_recorded.connect(lambda sender, payments, **kw: received.append(payments), weak=False, dispatch_uid='test')
+        self.addCleanup(payments_recorded.disconnect, dispatch_uid='test')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            created = record_payments([(enrollment.id, date(2025, 10, 1), 100), (enrollment.id, date(2025, 11, 1), 200)])
+            self.assertEqual(received, [])
+        self.assertEqual(received, [created])
+
+
+class PaymentImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_dataset()
+
+    def test_lines_resolve_in_two_queries(self):
+        # Seeded: O'quvchi 00 and 04 in Ingliz tili, 05 in Matematika (phone +998900000005), 07 inactive
+        text = "\n".join([
+            "O'quvchi; Guruh; Oy; Summa",
+            "O‘quvchi 00; ingliz tili; 2025-10; 300 000",
+            "",
+            "900000005; Математика; 2025-11; 250,000",
+            "O'quvchi 04; Ingliz tili; 2025-13; 100",
+            "O'quvchi 04; Ingliz tili; 2025-10; -5",
+            "O'quvchi 04; Ingliz tili; 2025-10",
+            "O'quvchi 04; Kimyo; 2025-10; 100",
+            "O'quvchi 05; Ingliz tili; 2025-10; 100",
+            "O'quvchi 07; Matematika; 2025-10; 100",
+            "o'quvchi 00; Ingliz tili; 2025-10; 300000",
+        ])
+        with self.assertNumQueries(2):
+            payments, errors = prepare_import(text)
+
+        self.assertEqual(
+            [(p['line'], p['name'], p['title'], p['month'], p['amount']) for p in payments],
+            [
+                (2, "O'quvchi 00", 'Ingliz tili', date(2025, 10, 1), 300_000),
+                (4, "O'quvchi 05", 'Matematika', date(2025, 11, 1), 250_000),
+            ],
+        )
+        self.assertEqual([(n, reason) for n, _, reason in errors], [
+            (5, imports.BAD_MONTH),
+            (6, imports.BAD_AMOUNT),
+            (7, imports.BAD_FIELDS),
+            (8, imports.NO_GROUP),
+            (9, imports.NO_STUDENT),
+            (10, imports.NO_STUDENT),
+            (11, f"{imports.DUPLICATE} (2-qator bilan)"),
+        ])
+
+        before = rollups.group_month_rollup(payments[0]['group_id'], date(2025, 10, 1)).collected
+        record_payments((p['enrollment_id'], p['month'], p['amount']) for p in payments)
+        after = rollups.group_month_rollup(payments[0]['group_id'], date(2025, 10, 1)).collected
+        self.assertEqual(after - before, 300_000)
+
+    def test_same_name_in_a_group_is_ambiguous(self):
+        group = Group.objects.get(title='Fizika')
+        for phone in ('+998911111111', '+998922222222'):
+            student = Student.objects.create(full_name='Aliyev Vali', phone_number=phone)
+            Enrollment.objects.create(student=student, group=group)
+        payments, errors = prepare_import("ALIYEV  VALI; Fizika; 2025-10; 1000\n+998 92 222-22-22; Fizika; 2025-10; 1000")
+        self.assertEqual([n for n, _, _ in errors], [1])
+        self.assertEqual(errors[0][2], imports.MANY_STUDENTS)
+        self.assertEqual([p['line'] for p in payments], [2])
+
+
+class DebtorsPageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_dataset()
+
+    def expected_items(self, group_id=None):
+        agg = {}
+        qs = Enrollment.objects.filter(is_active=True, balance__gt=0).select_related('student')
+        if group_id is not None:
+            qs = qs.filter(group_id=group_id)
+        for e in qs:
+            key = e.id if group_id is not None else e.student_id
+            row = agg.setdefault(key, [e.student.full_name, 0, 0])
+            row[1] += min(e.balance, e.monthly_fee)
+            row[2] += e.balance
+        return sorted((tuple(r) for r in agg.values()), key=lambda x: (x[2], x[1], x[0]), reverse=True)
+
+    def test_pages_match_python_ordering(self):
+        for group_id in [None] + list(Group.objects.values_list('id', flat=True)):
+            expected = self.expected_items(group_id)
+            pages = max((len(expected) + 2) // 3, 1)
+            collected = []
+            for page in range(1, pages + 1):
+                with self.assertNumQueries(1):
+                    items, got_page, total_pages, total = debtors_page(page, 3, group_id=group_id)
+                self.assertEqual((got_page, total_pages, total), (page, pages, len(expected)))
+                collected += items
+            self.assertEqual(collected, expected)
+
+    def test_page_past_the_end_falls_back_to_last_page(self):
+        items, page, total_pages, total = debtors_page(99, 5)
+        self.assertEqual(page, total_pages)
+        self.assertEqual(items, self.expected_items()[(page - 1) * 5:])
+
+
+class MonthStatusTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_dataset()
+
+    def test_matches_per_enrollment_totals(self):
+        month = date(2025, 10, 1)
+        ids = list(Student.objects.values_list('id', flat=True))
+        expected = {}
+        for enr in Enrollment.objects.filter(is_active=True):
+            paid = enr.payments.filter(month=month).aggregate(s=Sum('amount'))['s'] or 0
+            fee, total, due = expected.get(enr.student_id, (0, 0, 0))
+            expected[enr.student_id] = (fee + enr.monthly_fee, total + paid, due + max(enr.monthly_fee - paid, 0))
+        with self.assertNumQueries(1):
+            self.assertEqual(month_status(ids, month), expected)
+        self.assertTrue(any(paid for _, paid, _ in expected.values()))
+
+
+class StudentProfileTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_dataset()
+
+    def test_matches_per_query_computation(self):
+        month = date(2025, 10, 1)
+        for student in Student.objects.all():
+            profile = student_profile(student.id, month)
+            payments = Payment.objects.filter(enrollment__student=student)
+            self.assertEqual(profile.payments_count, payments.count())
+            self.assertEqual(profile.total_paid, payments.aggregate(s=Sum('amount'))['s'] or 0)
+            enrollments = Enrollment.objects.filter(student=student).order_by('id')
+            self.assertEqual(
+                [(e.group_title, e.monthly_fee, e.month_paid) for e in profile.enrollments],
+                [(e.group.title, e.monthly_fee, e.payments.filter(month=month).aggregate(s=Sum('amount'))['s'] or 0)
+                 for e in enrollments],
+            )
+            self.assertEqual(profile.arrears, sum(max(e.balance, 0) for e in enrollments))
+            self.assertEqual(
+                [(p.amount, p.paid_at) for p in profile.last_payments],
+                [(p.amount, p.paid_at) for p in payments.order_by('-paid_at', '-id')[:5]],
+            )
+
+    def test_query_count_is_constant(self):
+        student = Student.objects.create(full_name='Profil')
+        with self.assertNumQueries(3):
+            student_profile(student.id)
+        admin = BotUser.objects.create(user_id='200', username='kassir')
+        for group in Group.objects.all():
+            enr = Enrollment.objects.create(student=student, group=group, joined_at=NOW - timedelta(days=90))
+            for month in (date(2025, 8, 1), date(2025, 9, 1), date(2025, 10, 1)):
+                Payment.objects.create(enrollment=enr, amount=50_000, month=month, created_by=admin)
+        with self.assertNumQueries(3):
+            profile = student_profile(student.id)
+        self.assertEqual(len(profile.enrollments), Group.objects.count())
+        self.assertEqual(profile.payments_count, 3 * Group.objects.count())
+        self.assertEqual([p.created_by for p in profile.last_payments], ['kassir'] * 5)
+
+
+class GroupStudentsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.group = Group.objects.create(title='Katta guruh', monthly_fee=200_000)
+        students = Student.objects.bulk_create(Student(full_name=f'Talaba {i:03d}') for i in range(300))
+        enrollments = Enrollment.objects.bulk_create(
+            Enrollment(student=s, group=cls.group, joined_at=NOW, monthly_fee=200_000) for s in students
+        )
+        Payment.objects.bulk_create(
+            Payment(enrollment=enr, amount=10_000 * (j + 1), month=date(2025, 10, 1), paid_at=NOW - timedelta(days=j))
+            for i, enr in enumerate(enrollments) for j in range(i % 3)
+        )
+
+    def test_last_payment_per_student_in_one_query(self):
+        with self.assertNumQueries(1):
+            rows = list(group_students_queryset(self.group.id).order_by('name', 'student_id'))
+        self.assertEqual(len(rows), 300)
+        for row in rows:
+            last = (
+                Payment.objects.filter(enrollment__student_id=row['student_id'], enrollment__group=self.group)
+                .order_by('-paid_at', '-id').first()
+            )
+            self.assertEqual(
+                (row['last_amount'], row['last_paid_at']),
+                (last.amount, last.paid_at) if last else (None, None),
+            )
+
+
+class StatusBoardDataTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.group = Group.objects.create(title='Taxta guruhi', monthly_fee=200_000)
+        students = Student.objects.bulk_create(Student(full_name=f'Talaba {i:02d}') for i in range(30))
+        enrollments = Enrollment.objects.bulk_create(
+            Enrollment(student=s, group=cls.group, joined_at=NOW, monthly_fee=200_000) for s in students
+        )
+        # An inactive enrollment is left off the board
+        Enrollment.objects.create(
+            student=Student.objects.create(full_name='Ketgan talaba'), group=cls.group, is_active=False,
+        )
+        Payment.objects.bulk_create(
+            Payment(enrollment=enr, amount=10_000 * (j + 1), month=date(2025, 10, 1), paid_at=NOW)
+            for i, enr in enumerate(enrollments) for j in range(i % 3)
+        )
+
+    def test_status_board_data(self):
+        month = date(2025, 10, 1)
+        rollups.ensure_month(month, [self.group.id])  # as the month's first payment does
+        with self.assertNumQueries(2):
+            rollup, students = status_board_data(self.group.id, month)
+        self.assertEqual((rollup.group_id, rollup.month), (self.group.id, month))
+        self.assertEqual([s['name'] for s in students], [f'Talaba {i:02d}' for i in range(30)])
+        # Student i made i % 3 payments of 10 000, 20 000, ...
+        self.assertEqual(
+            [s['paid'] for s in students[:4]], [0, 10_000, 30_000, 0],
+        )
+        self.assertEqual({s['fee'] for s in students}, {200_000})
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_dataset()
+
+    def export(self, fmt, max_bytes=10 ** 9):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(lambda: [os.remove(os.path.join(directory, f)) for f in os.listdir(directory)])
+        qs = Payment.objects.order_by('paid_at', 'id')
+        return write_export_parts(qs, PAYMENT_COLUMNS, fmt, lambda n: os.path.join(directory, f'{n}.{fmt}'), max_bytes)
+
+    def test_csv_rows(self):
+        (path, count), = self.export('csv')
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0], [header for header, _ in PAYMENT_COLUMNS])
+        self.assertEqual(count, Payment.objects.count())
+        self.assertEqual([int(r[0]) for r in rows[1:]], list(Payment.objects.order_by('paid_at', 'id').values_list('id', flat=True)))
+        self.assertEqual(sum(int(r[5]) for r in rows[1:]), Payment.objects.aggregate(s=Sum('amount'))['s'])
+
+    def test_xlsx_rows(self):
+        (path, count), = self.export('xlsx')
+        with zipfile.ZipFile(path) as z:
+            sheet = ElementTree.fromstring(z.read('xl/worksheets/sheet1.xml'))
+        ns = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+        rows = sheet.findall(f'{ns}sheetData/{ns}row')
+        self.assertEqual(len(rows), count + 1)
+        amounts = [int(row[5].find(f'{ns}v').text) for row in rows[1:]]
+        self.assertEqual(sum(amounts), Payment.objects.aggregate(s=Sum('amount'))['s'])
+
+    def test_split_into_parts(self):
+        parts = self.export('csv', max_bytes=1)
+        self.assertGreater(len(parts), 1)
+        self.assertEqual(sum(count for _, count in parts), Payment.objects.count())
+
+
+class AdminExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_dataset()
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def csv_rows(self, response):
+        self.assertEqual(response.status_code, 200)
+        return list(csv.reader(b''.join(response.streaming_content).decode('utf-8-sig').splitlines()))
+
+    def test_filtered_export_follows_changelist_filters(self):
+        rows = self.csv_rows(self.client.get(
+            '/admin/main/payment/export/csv/', {'month': '2025-10-01', 'target_month': '2025-09'},
+        ))
+        expected = Payment.objects.filter(month=date(2025, 10, 1))
+        self.assertEqual(rows[0][0], 'ID')
+        self.assertEqual(sorted(int(r[0]) for r in rows[1:]), sorted(expected.values_list('id', flat=True)))
+
+        group = Group.objects.get(title='Matematika')
+        rows = self.csv_rows(self.client.get('/admin/main/enrollment/export/csv/', {'group__id__exact': group.id}))
+        self.assertEqual(len(rows) - 1, Enrollment.objects.filter(group=group).count())
+
+        rows = self.csv_rows(self.client.get('/admin/main/student/export/csv/', {'q': 'Matematika'}))
+        expected = Student.objects.filter(enrollments__group=group).values_list('full_name', flat=True)
+        self.assertEqual(sorted(r[1] for r in rows[1:]), sorted(expected))
+
+    def test_bad_filter_redirects_to_changelist(self):
+        response = self.client.get('/admin/main/payment/export/csv/', {'month': 'oktabr'})
+        self.assertRedirects(response, '/admin/main/payment/?e=1')
+        response = self.client.get('/admin/main/enrollment/export/csv/', {'group__id__exact': 'x'})
+        self.assertRedirects(response, '/admin/main/enrollment/?e=1')
+
+    def test_export_selected_action(self):
+        ids = list(Payment.objects.values_list('id', flat=True)[:3])
+        response = self.client.post('/admin/main/payment/', {'action': 'export_xlsx', '_selected_action': ids})
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as z:
+            sheet = ElementTree.fromstring(z.read('xl/worksheets/sheet1.xml'))
+        self.assertEqual(len(list(sheet.iter('{http://schemas.openxmlformats.org/spreadsheetml/2006/main}row'))), 4)
+
+    def test_changelist_links_to_export(self):
+        response = self.client.get('/admin/main/payment/', {'month': '2025-10-01'})
+        self.assertContains(response, '/admin/main/payment/export/xlsx/?month=2025-10-01')
+
+
+class PaymentChangelistTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_dataset()
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        cache.clear()
+
+    def test_student_filter_is_autocomplete(self):
+        student = Student.objects.get(full_name="O'quvchi 03")
+        response = self.client.get('/admin/main/payment/', {'enrollment__student__id__exact': student.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'name="enrollment__student__id__exact"')
+        self.assertContains(response, f'<option value="{student.id}" selected>{student.full_name}</option>', html=True)
+        # Other students are not listed in the sidebar
+        self.assertNotContains(response, "O'quvchi 04")
+        self.assertEqual(
+            [p.id for p in response.context['cl'].result_list],
+            list(Payment.objects.filter(enrollment__student=student).order_by('-paid_at', '-pk').values_list('id', flat=True)),
+        )
+
+    def test_month_filter_and_report_month(self):
+        response = self.client.get('/admin/main/payment/', {'month': '2025-09-01', 'target_month': '2025-09'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {p.month for p in response.context['cl'].result_list}, {date(2025, 9, 1)},
+        )
+        self.assertEqual(response.context['report']['selected_month_str'], '2025-09')
+        self.assertEqual(self.client.get('/admin/main/payment/', {'month': 'bad'}).status_code, 302)
+
+    def test_student_report_matches_raw_rows(self):
+        student = Student.objects.get(full_name="O'quvchi 05")
+        params = {'enrollment__student__id__exact': student.id, 'target_month': '2025-09'}
+        report = self.client.get('/admin/main/payment/', params).context['report']
+        expected = Enrollment.objects.filter(
+            student=student, is_active=True, joined_at__lt=datetime(2025, 10, 1, tzinfo=dt_timezone.utc),
+        ).aggregate(total=Sum('monthly_fee'))['total'] or 0
+        collected = Payment.objects.filter(
+            enrollment__student=student, month=date(2025, 9, 1),
+        ).aggregate(total=Sum('amount'))['total'] or 0
+        self.assertEqual(report['expected_selected'], f"{expected:,}".replace(',', ' '))
+        self.assertEqual(report['collected_selected'], f"{collected:,}".replace(',', ' '))
+
+        # The second load takes the report from the cache
+        with CaptureQueriesContext(connection) as first:
+            self.client.get('/admin/main/payment/', params)
+        cache.clear()
+        with CaptureQueriesContext(connection) as uncached:
+            self.client.get('/admin/main/payment/', params)
+        self.assertEqual(len(uncached) - len(first), 2)
+
+    def test_estimated_count(self):
+        qs = Payment.objects.order_by('-paid_at', '-pk')
+        paginator = EstimatedCountPaginator(qs, 50)
+        self.assertEqual(paginator.count, qs.count())
+        self.assertFalse(paginator.estimated)
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE main_payment')
+        paginator = EstimatedCountPaginator(qs, 50)
+        paginator.exact_below = 0
+        self.assertGreater(paginator.count, 0)
+        self.assertTrue(paginator.estimated)
+
+        # Statistics lagging behind the table: pages past the estimate still open
+        paginator = EstimatedCountPaginator(qs, 2)
+        paginator.count, paginator.estimated = 1, True
+        self.assertEqual(len(paginator.page(1)), 2)
+        self.assertEqual(len(paginator.page(qs.count() // 2 + 5)), 0)
+
+        # Filtered lists are counted exactly, whatever the planner guesses
+        filtered = qs.filter(month=date(2025, 9, 1))
+        paginator = EstimatedCountPaginator(filtered, 50)
+        paginator.exact_below = 0
+        self.assertEqual(paginator.count, filtered.count())
+        self.assertFalse(paginator.estimated)
+
+    def test_date_hierarchy_from_range(self):
+        response = self.client.get('/admin/main/payment/')
+        # Payments were made in September and October 2025; the months come from MIN/MAX, not a DISTINCT
+        for month in (9, 10):
+            self.assertContains(response, f'?paid_at__month={month}&amp;paid_at__year=2025')
+        self.assertFalse(any('DISTINCT' in q['sql'] and 'paid_at' in q['sql'] for q in self._queries('/admin/main/payment/')))
+
+    def _queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(url)
+        return ctx.captured_queries
+
+
+@skipUnlessDBFeature('supports_partial_indexes')
+class QueryPlanTests(TestCase):
+    """Hot queries must not fall back to sequential scans of the large tables.
+
+    The dataset is big enough (and analyzed) for the planner to prefer an index
+    whenever a usable one exists, so a dropped or mismatched index shows up as
+    a seq scan here.
+    """
+    HOT_TABLES = ('main_payment', 'main_enrollment', 'main_charge')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = BotUser.objects.create(user_id='100', username='ali')
+        others = BotUser.objects.bulk_create(BotUser(user_id=str(200 + i), username=f'admin{i}') for i in range(20))
+        groups = Group.objects.bulk_create(Group(title=f'Guruh {i}', monthly_fee=200_000) for i in range(50))
+        students = Student.objects.bulk_create(Student(full_name=f"O'quvchi {i:05d}") for i in range(5000))
+        cls.enrollments = Enrollment.objects.bulk_create(
+            Enrollment(student=s, group=groups[i % len(groups)], monthly_fee=200_000,
+                       balance=100_000 if i % 10 == 0 else 0, joined_at=NOW - timedelta(days=i % 700))
+            for i, s in enumerate(students)
+        )
+        creators = [cls.admin] + others
+        months = [date(2024 + m // 12, m % 12 + 1, 1) for m in range(22)]
+        Payment.objects.bulk_create(
+            Payment(enrollment=cls.enrollments[i % len(cls.enrollments)], amount=100_000,
+                    month=months[i % len(months)], created_by=creators[i % len(creators)])
+            for i in range(30000)
+        )
+        # Spread payments over the two years before NOW
+        Payment.objects.update(paid_at=ExpressionWrapper(
+            Value(NOW) - F('id') % 17520 * Value(timedelta(hours=1)), output_field=DateTimeField(),
+        ))
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertIndexed(self, run):
+        with CaptureQueriesContext(connection) as ctx:
+            run()
+        selects = [q['sql'] for q in ctx.captured_queries if q['sql'].lstrip().upper().startswith('SELECT')]
+        self.assertTrue(selects)
+        with connection.cursor() as cursor:
+            for sql in selects:
+                cursor.execute('EXPLAIN ' + sql)
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+                for table in self.HOT_TABLES:
+                    self.assertNotIn(f'Seq Scan on {table}', plan, f'{sql}\n{plan}')
+
+    def test_dashboard(self):
+        finance_dashboard_data(NOW)  # creates this month's rollup rows
+        for query in dashboard_queries(NOW):
+            self.assertIndexed(query)
+
+    def test_debtors(self):
+        group_id = self.enrollments[0].group_id
+        self.assertIndexed(lambda: debtors_page(2, 10))
+        self.assertIndexed(lambda: debtors_page(2, 10, group_id=group_id))
+
+    def test_payments_page(self):
+        qs = Payment.objects.select_related('enrollment__student', 'enrollment__group', 'created_by')
+        last = qs.order_by('-paid_at', '-id')[20]
+        seek = Q(paid_at__lte=last.paid_at) & (Q(paid_at__lt=last.paid_at) | Q(paid_at=last.paid_at, id__lt=last.id))
+        self.assertIndexed(lambda: list(qs.order_by('-paid_at', '-id')[:11]))
+        self.assertIndexed(lambda: list(qs.filter(seek).order_by('-paid_at', '-id')[:11]))
+        self.assertIndexed(lambda: list(qs.filter(created_by__username='ali').order_by('-paid_at', '-id')[:11]))
+        self.assertIndexed(lambda: list(qs.filter(month=date(2025, 10, 1)).order_by('-paid_at', '-id')[:11]))
+
+    def test_report_filters(self):
+        self.assertIndexed(lambda: Payment.objects.filter(month=date(2025, 10, 1)).aggregate(Sum('amount')))
+        self.assertIndexed(lambda: Payment.objects.filter(created_by__username='ali').aggregate(Sum('amount')))
+
+    def test_payment_lookups(self):
+        enr = self.enrollments[42]
+        self.assertIndexed(lambda: Enrollment.objects.get(student_id=enr.student_id, group_id=enr.group_id))
+        self.assertIndexed(lambda: Payment.objects.filter(enrollment=enr, month=date(2025, 10, 1)).aggregate(Sum('amount')))
+        self.assertIndexed(lambda: list(Payment.objects.filter(enrollment__student_id=enr.student_id).order_by('-paid_at')[:5]))
+        ids = [e.student_id for e in self.enrollments[:25]]
+        self.assertIndexed(lambda: month_status(ids, date(2025, 10, 1)))
+        self.assertIndexed(lambda: list(group_students_queryset(enr.group_id).order_by('name', 'student_id')[:10]))
+
+
+class StudentSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.latin = Student.objects.create(full_name="Xasanov Shoxrux", phone_number='+998 90 123-45-67')
+        cls.cyrillic = Student.objects.create(full_name='Тошматов Ғайрат', phone_number='901112233')
+        cls.apostrophe = Student.objects.create(full_name="Qo‘chqorov O'tkir", phone_number=None)
+
+    def names(self, query):
+        return [s.full_name for s in search.search_students(query)]
+
+    def test_search_keys(self):
+        self.assertEqual(normalize_name('Хасанов Шохрух'), normalize_name('Khasanov  Shoxrux'))
+        self.assertEqual(normalize_name("G'ayrat"), normalize_name('Ғайрат'))
+        self.assertEqual(normalize_phone('+998 (90) 123-45-67'), normalize_phone('901234567'))
+        self.cyrillic.full_name = 'Тошматов Ғайратжон'
+        self.cyrillic.save(update_fields=['full_name'])
+        self.cyrillic.refresh_from_db()
+        self.assertEqual(self.cyrillic.search_name, 'toshmatov gayratjon')
+
+    def test_names_match_across_scripts(self):
+        self.assertEqual(self.names('Хасанов'), [self.latin.full_name])
+        self.assertEqual(self.names('khasanov'), [self.latin.full_name])
+        self.assertEqual(self.names('gayrat'), [self.cyrillic.full_name])
+        self.assertEqual(self.names("qo'chqorov"), [self.apostrophe.full_name])
+        self.assertEqual(self.names('sh'), [self.latin.full_name])
+
+    def test_phone_prefix_and_id(self):
+        self.assertEqual(self.names('90 123'), [self.latin.full_name])
+        self.assertEqual(self.names('+99890111'), [self.cyrillic.full_name])
+        self.assertEqual(self.names(str(self.apostrophe.id))[0], self.apostrophe.full_name)
+
+    def test_edited_student_is_found_under_new_name_and_phone(self):
+        # The bot's edit flow saves just the edited field
+        student = Student.objects.get(id=self.latin.id)
+        student.full_name = 'Karimov Jasur'
+        student.save(update_fields=['full_name'])
+        student.phone_number = '+998 93 555 44 33'
+        student.save(update_fields=['phone_number'])
+        self.assertEqual(self.names('Каримов'), ['Karimov Jasur'])
+        self.assertEqual(self.names('93 555'), ['Karimov Jasur'])
+        self.assertEqual(self.names('Xasanov'), [])
+        self.assertEqual(self.names('90 123'), [])
+
+    def test_typos_rank_by_similarity(self):
+        if not search.trigram_enabled():
+            self.skipTest('pg_trgm is not installed')
+        self.assertEqual(self.names('hasanof')[0], self.latin.full_name)
@@ -0,0 +1,55 @@
+"""Search keys for student names and phone numbers.
+
+Names are typed in Uzbek Latin, Uzbek Cyrillic or Russian-style Latin
+("Xasanov", "Хасанов", "Khasanov"), so both the stored key and the query are
+folded to one Latin spelling before they are compared.
+"""
+import re
+import unicodedata
+
+CYRILLIC = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'ғ': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo',
+    'ж': 'j', 'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'қ': 'q', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'ў': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'x', 'ҳ': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sh', 'ъ': '',
+    'ы': 'i', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+}
+
+# Spellings that differ between Uzbek and Russian-style Latin
+_FOLDS = (
+    ('kh', 'h'),
+    ('x', 'h'),
+    ('q', 'k'),
+    ('w', 'v'),
+)
+
+# o‘, g‘ and the separator sign come in many apostrophe shapes
+_APOSTROPHES = re.compile(r"['`ʻʼ‘’ʹ]")
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+_NON_DIGIT = re.compile(r'\D+')
+
+COUNTRY_CODE = '998'
+LOCAL_DIGITS = 9
+
+
+def to_latin(text: str) -> str:
+    return ''.join(CYRILLIC.get(ch, ch) for ch in text.lower())
+
+
+def normalize_name(text: str | None) -> str:
+    """Lowercase folded Latin, words separated by single spaces."""
+    text = to_latin(text or '')
+    text = _APOSTROPHES.sub('', text)
+    # Drop accents from any other Latin letters
+    text = ''.join(ch for ch in unicodedata.normalize('NFKD', text) if not unicodedata.combining(ch))
+    for src, dst in _FOLDS:
+        text = text.replace(src, dst)
+    return _NON_WORD.sub(' ', text).strip()
+
+
+def normalize_phone(text: str | None) -> str:
+    """Digits only, with the country code added to local (9-digit) numbers."""
+    digits = _NON_DIGIT.sub('', text or '')
+    if len(digits) == LOCAL_DIGITS:
+        digits = COUNTRY_CODE + digits
+    return digits